@@ -1,55 +1,214 @@
 #!/usr/bin/env python3
 
-from flask import Flask, request, make_response, jsonify
-from flask_migrate import Migrate
-from flask_restful import Api, Resource
-from models import db, Hero, Power, HeroPower
+from flask import (Blueprint, Flask, Response, request, make_response, jsonify,
+                   stream_with_context)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+from werkzeug.middleware.proxy_fix import ProxyFix
+from database import database_config, dispose_after_fork
+from models import db, Hero, Power, HeroPower, HERO_DETAIL_OPTIONS, STRENGTHS
+from serializers import (hero_detail, hero_power_columns, hero_power_detail,
+                         power_summary)
+from bulk import (BulkError, insert_rows, inserted_rows, parse_items,
+                  validate_items)
+import batch
+import changes
+from cache import response_cache
+from compression import compression, config_from_env as compression_config
+from concurrency import if_match_versions, power_etag, update_power_if_match
+import fieldsets
+from fieldsets import FieldsetError, fields_args, include_args
+from groupcommit import Conflict, group_commit
+from instrumentation import RequestMetrics
+from limits import write_limiter
+from jsonprovider import FastJSONProvider, RawJSON
+import readmodel
+import shards
+import stats
+from search import SearchError, filters_links, search_args
+from pagination import (PaginationError, keyset_page, page_args,
+                        paginated_response, stream_format, streamed_response)
 import os
+import sys
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-DATABASE = os.environ.get(
-    "DB_URI", f"sqlite:///{os.path.join(BASE_DIR, 'app.db')}")
 
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.json.compact = False
+# The routes; create_app() registers them on each app it builds
+api = Blueprint('api', __name__)
 
-migrate = Migrate(app, db)
+# The query parameters each cached view reads (full-matched against their
+# names); the cache key leaves the others out, see cache.py
+DETAIL_KEY_PARAMS = r'include|pretty|fields\[\w+\]'
+LIST_KEY_PARAMS = DETAIL_KEY_PARAMS + r'|limit|after|stream|q|ids'
+HEROES_KEY_PARAMS = LIST_KEY_PARAMS + r'|power_id|strength'
 
-db.init_app(app)
 
-@app.route('/')
+def load_config(app):
+    # DB_URI, DB_READ_URI, DB_PROFILE and pool settings, see database.py
+    app.config.update(database_config(BASE_DIR))
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # memory, sqlite:///path/to/cache.db (shared by all workers) or none
+    app.config['RESPONSE_CACHE'] = os.environ.get('RESPONSE_CACHE', 'memory')
+    app.config['RESPONSE_CACHE_TTL'] = int(os.environ.get('RESPONSE_CACHE_TTL', 60))
+    # Accept-Encoding negotiation, see compression.py
+    app.config.update(compression_config())
+    # Write rate and concurrency limits, see limits.py. LIMITS_BACKEND is
+    # memory, sqlite:///path/to/limits.db (shared by all workers) or none
+    app.config['LIMITS_BACKEND'] = os.environ.get('LIMITS_BACKEND', 'memory')
+    for name, type_ in (('WRITE_RATE_LIMIT', float), ('WRITE_RATE_BURST', float),
+                        ('WRITE_CONCURRENCY', int), ('WRITE_CONCURRENCY_MAX', int),
+                        ('WRITE_QUEUE', int), ('WRITE_QUEUE_TIMEOUT', float),
+                        ('WRITE_LATENCY_TARGET_MS', float)):
+        if name in os.environ:
+            app.config[name] = type_(os.environ[name])
+    # How many proxies in front of the app append to X-Forwarded-For. With
+    # none, request.remote_addr (which the write limits key on) is the
+    # peer's address, so behind an unconfigured proxy every client shares
+    # the proxy's bucket
+    app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))
+    # Shared by the shards and the router; writes it replays skip the limits
+    app.config['REPLICATION_TOKEN'] = os.environ.get('REPLICATION_TOKEN')
+    # Commit concurrent POST /hero_powers rows together, see groupcommit.py
+    app.config['GROUP_COMMIT'] = os.environ.get('GROUP_COMMIT', '0') == '1'
+    app.config['GROUP_COMMIT_WINDOW_MS'] = float(os.environ.get('GROUP_COMMIT_WINDOW_MS', 2))
+    app.config['GROUP_COMMIT_MAX_ROWS'] = int(os.environ.get('GROUP_COMMIT_MAX_ROWS', 64))
+    # Serve /heroes/<id> from precomputed documents, see readmodel.py
+    app.config['HERO_READ_MODEL'] = os.environ.get('HERO_READ_MODEL', '0') == '1'
+    # Per-route timings and SQL counts, exposed at /metrics
+    app.config['METRICS'] = os.environ.get('METRICS', '1') != '0'
+    app.config['METRICS_SLOW_REQUEST_MS'] = int(
+        os.environ.get('METRICS_SLOW_REQUEST_MS', 500))
+
+
+def init_migrations(app):
+    # Flask-Migrate imports alembic, which is about half of what importing
+    # this module costs. Its `flask db` commands are a plugin that the
+    # flask command imports before it loads the app, so the extension is
+    # set up only when that has happened: workers, tests and seed.py never
+    # import alembic.
+    if 'flask_migrate' not in sys.modules:
+        return
+    from flask_migrate import Migrate
+    # SQLite cannot ALTER constraints in place, so migrations use batch mode
+    Migrate(app, db, render_as_batch=True)
+
+
+def create_app(config=None):
+    """
+    Builds the app from the environment; ``config`` overrides any of the
+    settings read from it.
+
+    Nothing here connects to the database, so a pre-forking server can
+    build the app once and fork its workers from it (gunicorn --preload,
+    see wsgi.py). Each forked process drops the pooled connections it
+    inherited and opens its own.
+    """
+    app = Flask(__name__)
+    load_config(app)
+    app.config.update(config or {})
+    # orjson when installed; compact unless a request asks for ?pretty=1
+    app.json = FastJSONProvider(app)
+    if app.config['TRUSTED_PROXIES']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'])
+
+    init_migrations(app)
+    db.init_app(app)
+    dispose_after_fork(app)
+    response_cache.init_app(app)
+    write_limiter.init_app(app)
+    group_commit.init_app(app)
+    app.cli.add_command(readmodel.read_model_cli)
+    app.cli.add_command(changes.changes_cli)
+    app.cli.add_command(stats.stats_cli)
+    app.cli.add_command(shards.shards_cli)
+    app.register_blueprint(api)
+    if app.config['METRICS']:
+        RequestMetrics(app)
+    # After the metrics, so its hook runs first and the metrics see wire sizes
+    compression.init_app(app)
+    return app
+
+
+@api.route('/')
 def index():
     return '<h1>Code challenge</h1>'
 
 
-@app.route('/heroes')
+def list_response(type_name, model, search_columns, link_filters=False):
+    """
+    Shared body of the list endpoints.
+
+    Without query parameters the whole collection is returned as a JSON
+    array. ``limit``/``after`` switch to keyset pagination on ``id`` and
+    ``stream=json|ndjson`` streams the rows from a server-side cursor.
+    ``q`` (and for heroes ``power_id``/``strength``) filter the rows, see
+    search.py; ``ids=1,2,3`` fetches those rows with one IN query.
+    ``fields[<type_name>]`` limits the columns, see fieldsets.py.
+    """
+    try:
+        limit, after = page_args()
+        fmt = stream_format()
+        filters = search_args(request, model, search_columns, link_filters)
+        fields = fields_args(request, (type_name,))
+        include_args(request)
+    except (PaginationError, SearchError, FieldsetError) as e:
+        return make_response({"errors": [str(e)]}, 400)
+
+    columns = fieldsets.columns(model, fields[type_name])
+    to_dict = fieldsets.serializer(model, fields)
+    key = model.id
+    if fmt is not None:
+        return streamed_response(columns, key, to_dict, fmt, after=after,
+                                 filters=filters)
+    if limit is not None:
+        rows, next_cursor = keyset_page(columns, key, limit, after, filters)
+        return paginated_response(rows, next_cursor, limit, to_dict)
+
+    rows = db.session.query(*columns).filter(*filters).order_by(key).all()
+    return make_response(jsonify([to_dict(row) for row in rows]), 200)
+
+
+@api.route('/heroes')
+# Listings filtered by power_id/strength change when hero_powers do
+@response_cache.cached(
+    lambda: 'heroes:links' if filters_links(request) else 'heroes', HEROES_KEY_PARAMS)
 def heroes():
     """
     Returns a list of all heroes in the database.
     """
-    heroes = []  # Create an empty list to store the heroes
-    for hero in Hero.query.all():  # Iterate over all heroes in the DB 
-        hero_dict = {
-            "id": hero.id, 
-            "name": hero.name,  
-            "super_name": hero.super_name
-        }
-        # Add the hero's dict to the list of heroes
-        heroes.append(hero_dict)
+    return list_response('hero', Hero, (Hero.name, Hero.super_name),
+                         link_filters=True)
 
-    # Create a response that contains the list of heroes
-    response = make_response(
-        # Convert the list of heroes to JSON
-        jsonify(heroes),200
-    )
-    return response  # Return the response
 
-@app.route('/heroes/<int:id>')
+def sparse_hero(id):
+    # GET /heroes/<id> with fields[...] or include: only the requested
+    # columns and relationships are loaded and returned
+    try:
+        fields = fields_args(request, ('hero', 'hero_power', 'power'))
+        include = include_args(request, fieldsets.HERO_INCLUDES,
+                               fieldsets.HERO_INCLUDES)
+    except FieldsetError as e:
+        return make_response({"errors": [str(e)]}, 400)
+    hero = Hero.query.options(*fieldsets.load_options(Hero, fields, include)) \
+        .filter(Hero.id == id).first()
+    if hero is None:
+        return make_response(jsonify({"error": "Hero not found"}), 404)
+    return make_response(fieldsets.serializer(Hero, fields, include)(hero), 200)
+
+@api.route('/heroes/<int:id>')
+@response_cache.cached(lambda id: f'hero:{id}', DETAIL_KEY_PARAMS)
 def hero_by_id(id):
+    if fieldsets.requested(request):
+        return sparse_hero(id)
+    # The precomputed document, when the read model is on and has one
+    if readmodel.enabled():
+        body = readmodel.get_document(id)
+        if body is not None:
+            return jsonify(RawJSON(body))
     # Query the database for a hero with the given ID
-    hero = Hero.query.filter(Hero.id == id).first()
+    # hero_powers and their powers are loaded up front so to_dict() does
+    # not issue one lazy load per power
+    hero = Hero.query.options(*HERO_DETAIL_OPTIONS).filter(Hero.id == id).first()
     # If the hero is not found, return a 404 error
     if hero is None:
         response = make_response(
@@ -58,34 +217,107 @@ def hero_by_id(id):
             404 )
         return response
     # Convert the hero to a dictionary
-    hero_dict = hero.to_dict()
+    hero_dict = hero_detail(hero)
     # Create a response with the hero dictionary
     response = make_response(
         hero_dict, 200) # The hero dictionary
     # Return the response
     return response
 
-@app.route('/powers')
+@api.route('/powers')
+@response_cache.cached(lambda: 'powers', LIST_KEY_PARAMS)
 def powers():
-    powers = []  # Create an empty list to store the powers
-    # Iterate over all powers in the database
-    for power in Power.query.all():
-        # Create a dictionary to store the power's information,description, id and name
-        power_dict = {
-            "description": power.description,
-            "id": power.id,
-            "name": power.name,
+    """
+    Returns a list of all powers in the database.
+    """
+    return list_response('power', Power, (Power.name, Power.description))
+
+def description_errors(data):
+    # Returns the 400 response for an invalid PATCH /powers/<id> body, if any
+    if 'description' not in data:
+        # Create a response body
+        response_body = {"errors": ["description is required"]}
+        # Return the response
+        return make_response(response_body, 400)
+    # Get the description
+    description = data['description']
+
+    # Validate the description
+    if not isinstance(description, str) or len(description) < 20:
+        # Create a response body
+        response_body = {
+            "errors": ["validation errors"]
         }
-        # Add the dictionary to the list of powers
-        powers.append(power_dict)
-    response = make_response(
-        # Convert the list of powers to JSON
-        jsonify(powers),200 )   
+        # Return the response
+        return make_response(response_body, 400)
+    return None
+
+
+def power_response(power, to_dict=power_summary):
+    # Create a dictionary to store the power's information
+    response = make_response(to_dict(power), 200)
+    # The version, for If-Match on the next PATCH
+    response.set_etag(power_etag(power.version))
     return response
 
-@app.route('/powers/<int:id>', methods=['GET', 'PATCH'])
+
+def invalidate_power(power_id):
+    # The power appears in /powers, /powers/<id> and in the detail of
+    # every hero that holds it
+    hero_ids = db.session.query(HeroPower.hero_id) \
+        .filter(HeroPower.power_id == power_id).distinct()
+    response_cache.invalidate(
+        'powers', f'power:{power_id}',
+        *(f'hero:{hero_id}' for hero_id, in hero_ids))
+
+
+def patch_power_if_match(id, versions):
+    """
+    PATCH with If-Match: one conditional UPDATE ... RETURNING, without
+    loading the power first. The power is only read when the UPDATE
+    matched nothing, to tell 404 from 412.
+    """
+    data = request.get_json()
+    errors = description_errors(data)
+    if errors is not None:
+        return errors
+
+    power = update_power_if_match(id, versions, data['description'])
+    if power is None:
+        db.session.rollback()
+        if db.session.query(Power.id).filter(Power.id == id).first() is None:
+            return make_response({"error": "Power not found"}, 404)
+        # Someone else changed the power since the client read it
+        return make_response({"errors": ["Power has been modified"]}, 412)
+    if readmodel.enabled():
+        readmodel.update_power(power)
+    changes.record('power', 'update', [power_summary(power)])
+    db.session.commit()
+    invalidate_power(id)
+    return power_response(power)
+
+
+@api.route('/powers/<int:id>', methods=['GET', 'PATCH'])
+@write_limiter.limited
+@response_cache.cached(lambda id: f'power:{id}', DETAIL_KEY_PARAMS)
 def power_by_id(id):
-    power = Power.query.filter(Power.id == id).first()
+    if request.method == 'PATCH':
+        versions = if_match_versions(request)
+        if versions is not None:
+            return patch_power_if_match(id, versions)
+
+    query, to_dict = Power.query, power_summary
+    if request.method == 'GET' and fieldsets.requested(request):
+        try:
+            fields = fields_args(request, ('power',))
+            include_args(request)
+        except FieldsetError as e:
+            return make_response({"errors": [str(e)]}, 400)
+        # The version is loaded too, for the ETag
+        query = query.options(*fieldsets.load_options(Power, fields, extra=('version',)))
+        to_dict = fieldsets.serializer(Power, fields)
+
+    power = query.filter(Power.id == id).first()
     # Power does not exist
     if power is None:
         response_body = {"error": "Power not found"}
@@ -93,48 +325,55 @@ def power_by_id(id):
         return make_response(response_body, 404)
 
     if request.method == 'GET':
-        # Create a dictionary to store the power's information
-        power_dict = {
-            "description": power.description,
-            "id": power.id,
-            "name": power.name,
-        }
-        # Return the response
-        return make_response(power_dict, 200)
+        return power_response(power, to_dict)
 
     elif request.method == 'PATCH':
         data = request.get_json()
-        if 'description' not in data:
-            # Create a response body
-            response_body = {"errors": ["description is required"]}
-            # Return the response
-            return make_response(response_body, 400)
-         # Get the description
-        description = data['description']
-        
-        # Validate the description
-        if not isinstance(description, str) or len(description) < 20:
-            # Create a response body
-            response_body = {
-                "errors": ["validation errors"]
-            }
-            # Return the response
-            return make_response(response_body, 400)
+        errors = description_errors(data)
+        if errors is not None:
+            return errors
 
         # Update the description 
-        power.description = description
-        db.session.commit()
+        power.description = data['description']
+        try:
+            if readmodel.enabled():
+                readmodel.update_power(power)
+            changes.record('power', 'update', [power_summary(power)])
+            db.session.commit()
+        except StaleDataError:
+            # Another request updated the power between our read and
+            # write: the same 412 as a stale If-Match, see concurrency.py
+            db.session.rollback()
+            return make_response({"errors": ["Power has been modified"]}, 412)
+        invalidate_power(power.id)
 
-        # Create a dictionary to store the power's information
-        power_dict = {
-            "description": power.description,
-            "id": power.id,
-            "name": power.name,
-        }
-        # Return the response
-        return make_response(power_dict, 200)
-    
-@app.route('/hero_powers', methods=['POST'])
+        # Return the power's information
+        return power_response(power)
+
+
+@api.route('/powers/<int:id>/stats')
+def power_stats(id):
+    """
+    Returns how many heroes hold the power, in total and per strength,
+    from counters kept by the database, see stats.py.
+    """
+    body = stats.power_stats(id)
+    if body is None:
+        return make_response({"error": "Power not found"}, 404)
+    return make_response(body, 200)
+
+
+@api.route('/stats')
+def totals():
+    """
+    Returns the number of heroes, powers and hero_powers, and of
+    hero_powers per strength, see stats.py.
+    """
+    return make_response(stats.totals(), 200)
+
+
+@api.route('/hero_powers', methods=['POST'])
+@write_limiter.limited
 def create_hero_power():
     data = request.get_json()
 
@@ -157,36 +396,151 @@ def create_hero_power():
         return make_response({"errors": ["Power or Hero not found"]}, 404)
 
     # Validate strength value
-    valid_strengths = {"Average", "Strong", "Weak"}
-    if strength not in valid_strengths:
+    if strength not in STRENGTHS:
         # Return a 400 error with an errors key in the response body
         return make_response({"errors": ["validation errors"]}, 400)
 
+    if group_commit.enabled:
+        # Committed together with the rows of concurrent requests
+        try:
+            hero_power_id = group_commit.insert(hero.id, power.id, strength)
+        except Conflict:
+            return make_response({"errors": ["Hero already has this power"]}, 409)
+        new_hero_power = HeroPower(id=hero_power_id, strength=strength,
+                                   power_id=power.id, hero_id=hero.id)
+        response_cache.invalidate(f'hero:{hero.id}', 'heroes:links')
+        return make_response(hero_power_detail(new_hero_power, hero, power), 200)
+
     # Create the new HeroPower instance
     new_hero_power = HeroPower(strength=strength, power_id=power_id, hero_id=hero_id)
 
     # Add to the session and commit
     db.session.add(new_hero_power)
-    db.session.commit()
+    try:
+        # Flushed first for the new id, and so the hero's document
+        # includes the new power
+        db.session.flush()
+        if readmodel.enabled():
+            readmodel.refresh_heroes([hero.id])
+        changes.record('hero_power', 'create', [hero_power_columns(new_hero_power)])
+        db.session.commit()
+    except IntegrityError:
+        # (hero_id, power_id) is unique
+        db.session.rollback()
+        return make_response({"errors": ["Hero already has this power"]}, 409)
+    response_cache.invalidate(f'hero:{hero.id}', 'heroes:links')
 
     # response data
-    response_data = {
-        "id": new_hero_power.id,
-        "hero_id": hero_id,
-        "power_id": power_id,
-        "strength": strength,
-        "hero": {
-            "id": hero.id,
-            "name": hero.name,
-            "super_name": hero.super_name
-        },
-        "power": {
-            "id": power.id,
-            "name": power.name,
-            "description": power.description
-        }
-    }
+    response_data = hero_power_detail(new_hero_power, hero, power)
     # Return the response
     return make_response(response_data, 200)
+
+
+def insert_bulk(rows):
+    # Inserts and commits the validated rows of a bulk request, with their
+    # read-model documents and change records
+    insert_rows(rows)
+    if rows and readmodel.enabled():
+        readmodel.refresh_heroes({row['hero_id'] for row in rows})
+    if rows:
+        changes.record('hero_power', 'create', map(hero_power_columns, inserted_rows(rows)))
+    db.session.commit()
+
+
+@api.route('/hero_powers/bulk', methods=['POST'])
+@write_limiter.limited
+def create_hero_powers_bulk():
+    """
+    Creates many HeroPowers from a JSON array (or NDJSON) of
+    {strength, power_id, hero_id} objects.
+
+    Invalid items are reported by index and skipped; the valid ones are
+    inserted together in one transaction. Items that a concurrent request
+    stores first are reported as duplicates too; 409 only if that keeps
+    happening.
+    """
+    try:
+        items = parse_items(request)
+    except BulkError as e:
+        return make_response({"errors": [str(e)]}, 400)
+
+    rows, errors = validate_items(items)
+    try:
+        insert_bulk(rows)
+    except IntegrityError:
+        # A concurrent request stored one of the pairs after validation
+        # looked for it: validate again, now seeing it, and report it
+        db.session.rollback()
+        rows, errors = validate_items(items)
+        try:
+            insert_bulk(rows)
+        except IntegrityError:
+            db.session.rollback()
+            return make_response({"errors": ["Hero already has this power"]}, 409)
+    if rows:
+        response_cache.invalidate(
+            'heroes:links', *{f'hero:{row["hero_id"]}' for row in rows})
+
+    status = 400 if errors and not rows else 200
+    return make_response({"created": len(rows), "errors": errors}, status)
+
+
+
+@api.route('/changes')
+def change_feed():
+    """
+    Returns the changes after ``since``, waiting up to ``wait`` seconds
+    for one. Without ``since`` only the current last sequence number is
+    returned. See changes.py.
+    """
+    try:
+        since, wait = changes.feed_args(request)
+    except changes.Expired as e:
+        return make_response({"errors": [str(e)]}, 410)
+    except changes.ChangeError as e:
+        return make_response({"errors": [str(e)]}, 400)
+    if since is None:
+        return make_response({"changes": [], "last": changes.last_seq(), "more": False}, 200)
+    rows = changes.wait_for(since, wait)
+    return make_response(jsonify(RawJSON(changes.feed_body(rows, since))), 200)
+
+
+@api.route('/changes/stream')
+def change_stream():
+    """
+    Streams the changes after ``since`` (or Last-Event-ID) as Server-Sent
+    Events. Each open stream holds a worker thread.
+    """
+    try:
+        since, _ = changes.feed_args(request)
+    except changes.Expired as e:
+        return make_response({"errors": [str(e)]}, 410)
+    except changes.ChangeError as e:
+        return make_response({"errors": [str(e)]}, 400)
+    if since is None:
+        since = changes.last_seq()
+    response = Response(stream_with_context(changes.event_stream(since)),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Tells nginx not to buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@api.route('/batch', methods=['POST'])
+def batch_get():
+    """
+    Runs a JSON array of GET paths and returns their statuses and bodies
+    in one response, see batch.py.
+    """
+    try:
+        paths = batch.parse_paths(request)
+    except batch.BatchError as e:
+        return make_response({"errors": [str(e)]}, 400)
+    body = batch.encode_results(batch.run(paths))
+    return make_response(jsonify(RawJSON(body)), 200)
+
+app = create_app()
+
 if __name__ == '__main__':
     app.run(port=5555, debug=True)
\ No newline at end of file
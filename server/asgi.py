@@ -0,0 +1,296 @@
+"""
+ASGI entry point.
+
+    uvicorn asgi:app --app-dir server --port 5555 --workers 4
+
+The read endpoints (GET /heroes, /heroes/<id>, /powers, /powers/<id>, with
+or without limit/after) query the database through async handlers on
+SQLAlchemy's async engine, so a worker keeps serving other requests while
+one waits on the database. The rest of each response is made as the Flask
+app makes it: the handlers run inside the app's request context, between
+its request hooks (metrics, compression), behind the response cache with
+its ETags and 304s, and list pages carry the same ``Link`` header.
+
+Every other request is passed to the Flask app in app.py through asgiref's
+WSGI adapter: all writes, any query parameter the async handlers do not
+know, and requests asking for NDJSON with ``Accept``.
+``python server/app.py`` still runs the plain synchronous app.
+"""
+
+import io
+import os
+import re
+import sys
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi
+from flask import Response, request
+from sqlalchemy import event, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app import DETAIL_KEY_PARAMS, HEROES_KEY_PARAMS, LIST_KEY_PARAMS
+from app import app as flask_app
+from cache import response_cache
+from concurrency import power_etag
+from database import set_sqlite_pragmas
+from models import Hero, HeroDocument, Power, HERO_DETAIL_OPTIONS
+from pagination import MAX_LIMIT, accepts_ndjson, link_header
+from serializers import hero_detail, hero_summary, power_summary
+
+# Async DBAPI driver for each backend DB_URI may point at
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+# Query parameters the async list handlers understand
+LIST_PARAMS = {'limit', 'after'}
+
+
+def in_thread(func):
+    # ``func`` as a coroutine function run in the default executor, for the
+    # blocking steps (cache I/O, compression). Context variables, and so the
+    # Flask request context, are copied into the thread.
+    return sync_to_async(func, thread_sensitive=False)
+
+
+def async_url(uri):
+    url = make_url(uri)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f"no async driver known for {url.drivername}")
+    return url.set(drivername=driver)
+
+
+class Fallback(Exception):
+    # Raised by a handler to hand the request to the Flask app instead
+    pass
+
+
+def list_args(query):
+    params = parse_qs(query, keep_blank_values=True)
+    if not params.keys() <= LIST_PARAMS:
+        raise Fallback
+    try:
+        values = {name: int(value[-1]) for name, value in params.items()}
+    except ValueError:
+        raise Fallback
+    limit = values.get('limit')
+    after = values.get('after')
+    if (limit is not None and not 1 <= limit <= MAX_LIMIT) \
+            or (after is not None and after < 0):
+        raise Fallback
+    if after is not None and limit is None:
+        limit = MAX_LIMIT
+    return limit, after
+
+
+async def list_rows(session, query, columns, key, serialize):
+    limit, after = list_args(query)
+    statement = select(*columns).order_by(key)
+    if after is not None:
+        statement = statement.where(key > after)
+    if limit is not None:
+        statement = statement.limit(limit + 1)
+    rows = (await session.execute(statement)).all()
+
+    headers = []
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        headers.append(('Link', link_header(rows[-1].id, limit)))
+        headers.append(('X-Next-Cursor', str(rows[-1].id)))
+    return 200, [serialize(row) for row in rows], headers
+
+
+async def heroes(session, query):
+    return await list_rows(session, query, (Hero.id, Hero.name, Hero.super_name),
+                           Hero.id, hero_summary)
+
+
+async def powers(session, query):
+    return await list_rows(session, query, (Power.id, Power.name, Power.description),
+                           Power.id, power_summary)
+
+
+async def hero_by_id(session, query, id):
+    if query:
+        raise Fallback
+    if flask_app.config['HERO_READ_MODEL']:
+        # The precomputed document, see readmodel.py
+        body = (await session.execute(
+            select(HeroDocument.body).where(HeroDocument.hero_id == id))).scalar()
+        if body is not None:
+            return 200, body, []
+    result = await session.execute(
+        select(Hero).options(*HERO_DETAIL_OPTIONS).where(Hero.id == id))
+    hero = result.scalars().first()
+    if hero is None:
+        return 404, {"error": "Hero not found"}, []
+    return 200, hero_detail(hero), []
+
+
+async def power_by_id(session, query, id):
+    if query:
+        raise Fallback
+    result = await session.execute(
+        select(Power.id, Power.name, Power.description, Power.version)
+        .where(Power.id == id))
+    power = result.first()
+    if power is None:
+        return 404, {"error": "Power not found"}, []
+    return 200, power_summary(power), [('ETag', f'"{power_etag(power.version)}"')]
+
+
+# Path, handler and the response cache resource and key parameters of
+# the Flask view it stands in for (see the views in app.py)
+ROUTES = (
+    (re.compile(r'/heroes'), heroes, lambda: 'heroes', re.compile(HEROES_KEY_PARAMS)),
+    (re.compile(r'/heroes/(\d+)'), hero_by_id, lambda id: f'hero:{id}',
+     re.compile(DETAIL_KEY_PARAMS)),
+    (re.compile(r'/powers'), powers, lambda: 'powers', re.compile(LIST_KEY_PARAMS)),
+    (re.compile(r'/powers/(\d+)'), power_by_id, lambda id: f'power:{id}',
+     re.compile(DETAIL_KEY_PARAMS)),
+)
+
+
+def wsgi_environ(scope):
+    # The WSGI environ of a GET without a body, for Flask's request context
+    script_name = scope.get('root_path', '')
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name,
+        'PATH_INFO': scope['path'][len(script_name):].encode().decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        value = value.decode('latin-1')
+        environ[name] = f'{environ[name]},{value}' if name in environ else value
+    return environ
+
+
+class AsyncAPI:
+    """
+    ASGI application: async handlers for the read routes, the WSGI Flask
+    app for the rest.
+    """
+
+    def __init__(self, wsgi_app):
+        self.flask_app = wsgi_app
+        self.fallback = WsgiToAsgi(wsgi_app)
+        self.uri = os.environ.get(
+            'ASGI_DB_URI', wsgi_app.config['SQLALCHEMY_DATABASE_URI'])
+        self.pragmas = wsgi_app.config['SQLALCHEMY_ENGINE_OPTIONS'].get('sqlite_pragmas')
+        self.engine = None
+        self.Session = None
+
+    def connect(self):
+        # Created on first use, inside the worker process rather than the
+        # process that imported this module
+        url = async_url(self.uri)
+        options = {}
+        if url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:'):
+            # aiosqlite otherwise opens a new connection for every session
+            options['poolclass'] = AsyncAdaptedQueuePool
+        self.engine = create_async_engine(url, **options)
+        if self.pragmas and self.engine.dialect.name == 'sqlite':
+            event.listen(self.engine.sync_engine, 'connect',
+                         set_sqlite_pragmas(self.pragmas))
+        self.Session = sessionmaker(self.engine, class_=AsyncSession,
+                                    expire_on_commit=False)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            for pattern, handler, resource, params in ROUTES:
+                match = pattern.fullmatch(scope['path'])
+                if match is None:
+                    continue
+                try:
+                    response = await self.handle(
+                        scope, handler, resource, params, *map(int, match.groups()))
+                except Fallback:
+                    break
+                return await self.respond(send, response)
+
+        await self.fallback(scope, receive, send)
+
+    async def handle(self, scope, handler, resource, params, *args):
+        """
+        Returns the response the Flask view would give: the app's request
+        hooks run around the handler, and a cached response is served
+        without calling it. Raises Fallback for the Flask app to answer.
+        The cache reads and writes and the after_request hooks run in a
+        thread, off the event loop.
+        """
+        app = self.flask_app
+        with app.request_context(wsgi_environ(scope)):
+            if accepts_ndjson():
+                # The Flask view streams lists, and the cache skips these
+                raise Fallback
+            response = app.preprocess_request()
+            if response is None:
+                key = response_cache.key(resource(*args), params)
+                entry = await in_thread(response_cache.backend.get)(key)
+                if entry is None:
+                    status, body, headers = await self.dispatch(
+                        handler, request.query_string.decode('latin-1'), *args)
+                    response = await in_thread(self.fill)(key, status, body, headers)
+                else:
+                    response = await in_thread(response_cache.respond)(key, entry)
+            return await in_thread(app.finalize_request)(response)
+
+    def fill(self, key, status, body, headers):
+        # The response for a handler's result, cached under ``key`` when it
+        # can be. bytes are already-encoded JSON.
+        response = Response(
+            body if isinstance(body, bytes) else self.flask_app.json.encode(body),
+            status, headers, mimetype='application/json')
+        entry = response_cache.store(key, response)
+        return response if entry is None else response_cache.respond(key, entry)
+
+    async def dispatch(self, handler, query, *args):
+        if self.engine is None:
+            self.connect()
+        async with self.Session() as session:
+            return await handler(session, query, *args)
+
+    async def respond(self, send, response):
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                        for name, value in response.headers.items()],
+        })
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.engine is not None:
+                    await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+app = AsyncAPI(flask_app)
@@ -0,0 +1,168 @@
+"""
+POST /batch: several GET requests in one round-trip.
+
+The body is a JSON array of paths (or ``{"path": ...}`` objects):
+
+    ["/heroes/1", "/heroes/2?include=", "/powers?ids=1,2"]
+
+and the response holds one ``{"status": ..., "body": ...}`` entry per
+path, in the same order. Sub-requests for single heroes or powers that
+share a query string are answered together, with one ``IN (...)`` query
+per table instead of one lookup per id. Every other path is dispatched to
+its view as if it had been requested on its own.
+
+Sub-requests run one after another in the batch's own request, and their
+bodies are buffered into its response, so paths that stream or wait are
+refused: ``/changes/stream``, ``wait`` above 0 and ``stream=``.
+"""
+
+from urllib.parse import parse_qs, urlsplit
+
+from flask import current_app, request
+from werkzeug.exceptions import HTTPException
+
+import fieldsets
+from bulk import IN_CHUNK
+from fieldsets import FieldsetError, fields_args, include_args
+from models import Hero, Power
+import readmodel
+
+# Most sub-requests one POST /batch accepts
+BATCH_LIMIT = 200
+
+
+class BatchError(ValueError):
+    pass
+
+
+def parse_paths(request):
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        raise BatchError("body must be a JSON array of paths")
+    if len(items) > BATCH_LIMIT:
+        raise BatchError(f"at most {BATCH_LIMIT} requests per batch")
+    paths = []
+    for index, item in enumerate(items):
+        if isinstance(item, dict):
+            if item.get('method', 'GET').upper() != 'GET':
+                raise BatchError(f"request {index}: only GET requests can be batched")
+            item = item.get('path')
+        if not isinstance(item, str) or not item.startswith('/'):
+            raise BatchError(f"request {index}: path must be a string starting with /")
+        if streams(item):
+            raise BatchError(f"request {index}: streams and long polls cannot be batched")
+        paths.append(item)
+    return paths
+
+
+def streams(path):
+    # Whether ``path`` asks for a response that is streamed or held open.
+    # Sub-requests carry no Accept header, so ``stream=`` is the only way
+    # to ask for NDJSON
+    url = urlsplit(path)
+    args = parse_qs(url.query, keep_blank_values=True)
+    return (url.path.rstrip('/') == '/changes/stream'
+            or any(value not in ('', '0') for value in args.get('wait', ()))
+            or any(args.get('stream', ())))
+
+
+def _by_id(model, name, default_fields, default_include, allowed_include,
+           documents=None):
+    # Returns a resolver answering many /<name>s/<id> requests with the
+    # same query string from one IN query per table. ``documents(ids)``,
+    # if given, supplies already encoded bodies for plain requests.
+    def resolve(ids, sub_request):
+        encode = current_app.json.encode
+        if documents is not None and not fieldsets.requested(sub_request):
+            found = documents(ids)
+            ids = ids.difference(found)
+        else:
+            found = {}
+        try:
+            fields = fields_args(sub_request, default_fields)
+            include = include_args(sub_request, allowed_include, default_include)
+        except FieldsetError as e:
+            return dict.fromkeys(ids, (400, encode({"errors": [str(e)]})))
+        options = fieldsets.load_options(model, fields, include)
+        serialize = fieldsets.serializer(model, fields, include)
+        ids = sorted(ids)
+        for start in range(0, len(ids), IN_CHUNK):
+            for obj in model.query.options(*options) \
+                    .filter(model.id.in_(ids[start:start + IN_CHUNK])):
+                found[obj.id] = encode(serialize(obj))
+        missing = (404, encode({"error": f"{name.capitalize()} not found"}))
+        return {id: (200, found[id]) if id in found else missing for id in ids}
+    return resolve
+
+
+def _hero_documents(ids):
+    # The read model's documents, when it is on
+    return readmodel.get_documents(ids) if readmodel.enabled() else {}
+
+
+# Endpoints whose sub-requests are grouped, and how each group is resolved
+RESOLVERS = {
+    'api.hero_by_id': _by_id(Hero, 'hero', ('hero', 'hero_power', 'power'),
+                         fieldsets.HERO_INCLUDES, fieldsets.HERO_INCLUDES,
+                         _hero_documents),
+    'api.power_by_id': _by_id(Power, 'power', ('power',), frozenset(), frozenset()),
+}
+
+
+def dispatch(path):
+    """
+    Runs the view for a GET of ``path`` and returns (status, body bytes).
+    Only the view runs, not the request hooks, so the batch is timed and
+    compressed as one request.
+    """
+    with current_app.test_request_context(
+            path, method='GET', environ_base={'REMOTE_ADDR': request.remote_addr}):
+        try:
+            response = current_app.make_response(current_app.dispatch_request())
+        except HTTPException as e:
+            return e.code, current_app.json.encode({"error": e.name})
+        if response.is_streamed:
+            # Whatever parse_paths let through: never buffer a stream
+            response.close()
+            return 400, current_app.json.encode(
+                {"errors": ["streamed responses cannot be batched"]})
+        body = response.get_data()
+        if not response.is_json:
+            # e.g. the HTML index, sent as a string
+            body = current_app.json.encode(body.decode())
+        return response.status_code, body
+
+
+def run(paths):
+    """
+    Returns one (status, body bytes) per path. Paths for single heroes or
+    powers are grouped by endpoint and query string, and each group is
+    answered at once; the others are dispatched one by one.
+    """
+    adapter = current_app.url_map.bind('')
+    results = [None] * len(paths)
+    groups = {}
+    for index, path in enumerate(paths):
+        route, _, query = path.partition('?')
+        try:
+            endpoint, view_args = adapter.match(route, method='GET')
+        except HTTPException:
+            endpoint = view_args = None
+        if endpoint in RESOLVERS:
+            groups.setdefault((endpoint, query), []).append((index, view_args['id']))
+        else:
+            results[index] = dispatch(path)
+
+    for (endpoint, query), members in groups.items():
+        with current_app.test_request_context(f'/?{query}'):
+            answers = RESOLVERS[endpoint]({id for _, id in members}, request)
+        for index, id in members:
+            results[index] = answers[id]
+    return results
+
+
+def encode_results(results):
+    # The sub-responses' bodies are already encoded; they are joined into
+    # the batch body without decoding them again
+    return b'[' + b','.join(
+        b'{"status":%d,"body":%s}' % (status, body) for status, body in results) + b']'
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Drives the synchronous (Flask dev server, threaded) and the ASGI (uvicorn)
+serving modes with the same concurrent clients and reports p50/p99 latency
+and requests per second.
+
+    python server/benchmarks/asgi_vs_wsgi.py --clients 32 --seconds 10
+
+Needs uvicorn installed. Both servers run against the same SQLite file,
+which is created and seeded in a temporary directory.
+"""
+
+import argparse
+import http.client
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    'sync': lambda port: [sys.executable, '-m', 'flask', 'run',
+                          '--port', str(port), '--with-threads'],
+    'asgi': lambda port: [sys.executable, '-m', 'uvicorn', 'asgi:app',
+                          '--port', str(port), '--log-level', 'warning'],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def seed(env, n_heroes, n_powers):
+    script = (
+        "from app import app\n"
+        "from models import db, Hero, Power, HeroPower\n"
+        "import random\n"
+        "rng = random.Random(0)\n"
+        "with app.app_context():\n"
+        "    db.create_all()\n"
+        f"    db.session.execute(Power.__table__.insert(), [{{'name': f'power {{i}}', 'description': 'a power described at some length'}} for i in range({n_powers})])\n"
+        f"    db.session.execute(Hero.__table__.insert(), [{{'name': f'hero {{i}}', 'super_name': f'super {{i}}'}} for i in range({n_heroes})])\n"
+        f"    db.session.execute(HeroPower.__table__.insert(), [{{'hero_id': h, 'power_id': p, 'strength': 'Strong'}} for h in range(1, {n_heroes} + 1) for p in rng.sample(range(1, {n_powers} + 1), 3)])\n"
+        "    db.session.commit()\n")
+    subprocess.run([sys.executable, '-c', script], cwd=SERVER_DIR, env=env, check=True)
+
+
+def wait_for(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def client(port, paths, deadline, latencies, errors, seed):
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    while time.perf_counter() < deadline:
+        path = rng.choice(paths)
+        start = time.perf_counter()
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            ok = response.status == 200
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            ok = False
+        latencies.append(time.perf_counter() - start)
+        if not ok:
+            errors.append(path)
+    conn.close()
+
+
+def drive(mode, env, args):
+    port = free_port()
+    server = subprocess.Popen(MODES[mode](port), cwd=SERVER_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(port)
+        paths = [f'/heroes/{random.randint(1, args.heroes)}' for _ in range(200)]
+        paths += ['/powers', '/heroes?limit=50']
+        latencies, errors = [], []
+        deadline = time.perf_counter() + args.seconds
+        threads = [threading.Thread(target=client, args=(
+            port, paths, deadline, latencies, errors, i)) for i in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+    print(f"  {mode:<5} {len(latencies) / args.seconds:8.0f} req/s"
+          f"   p50 {p50:7.1f} ms   p99 {p99:7.1f} ms   {len(errors)} errors")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--heroes', type=int, default=1000)
+    parser.add_argument('--powers', type=int, default=50)
+    parser.add_argument('--modes', default='sync,asgi')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ,
+                   DB_URI=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+                   RESPONSE_CACHE='none', FLASK_APP='app.py')
+        seed(env, args.heroes, args.powers)
+        print(f"{args.clients} concurrent clients, {args.seconds:g}s per mode")
+        for mode in args.modes.split(','):
+            drive(mode, env, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Benchmarks every endpoint against generated datasets of 1k, 100k and 1M
+heroes, reporting median/p95 latency, peak allocations (tracemalloc) and
+SQL statements per request. Fixtures and options are in conftest.py.
+
+    pytest server/benchmarks/bench_endpoints.py --bench-sizes 1000,100000
+    pytest server/benchmarks/bench_endpoints.py --bench-save baseline.json
+    pytest server/benchmarks/bench_endpoints.py --bench-compare baseline.json
+
+The first run at a size generates its dataset with seed.py (about a
+minute for 1M heroes); later runs reuse it from --bench-cache.
+"""
+
+import json
+
+
+def get(client, url, status=200):
+    def call(i):
+        response = client.get(url)
+        assert response.status_code == status, response.get_data()
+        # Streamed bodies are only produced when read
+        response.get_data()
+    return call
+
+
+class TestReads:
+    '''Benchmarks of the GET endpoints.'''
+
+    def test_heroes_all(self, bench_app, dataset, bench):
+        bench(get(bench_app.test_client(), '/heroes'))
+
+    def test_heroes_page(self, bench_app, dataset, bench):
+        after = dataset['heroes'] // 2
+        bench(get(bench_app.test_client(), f'/heroes?limit=100&after={after}'))
+
+    def test_heroes_all_names(self, bench_app, dataset, bench):
+        bench(get(bench_app.test_client(), '/heroes?fields[hero]=name'))
+
+    def test_heroes_stream(self, bench_app, dataset, bench):
+        bench(get(bench_app.test_client(), '/heroes?stream=ndjson'))
+
+    def test_heroes_search(self, bench_app, dataset, bench):
+        bench(get(bench_app.test_client(), '/heroes?q=captain&limit=100'))
+
+    def test_heroes_by_power(self, bench_app, dataset, bench):
+        bench(get(bench_app.test_client(), '/heroes?power_id=1&limit=100'))
+
+    def test_hero_by_id(self, bench_app, dataset, bench):
+        bench(get(bench_app.test_client(), f"/heroes/{dataset['heroes'] // 2}"))
+
+    def test_hero_by_id_sparse(self, bench_app, dataset, bench):
+        bench(get(bench_app.test_client(),
+                  f"/heroes/{dataset['heroes'] // 2}?fields[hero]=name&include="))
+
+    def test_hero_by_id_read_model(self, bench_app, dataset, bench):
+        import readmodel
+        from models import db
+        hero_id = dataset['heroes'] // 2
+        with bench_app.app_context():
+            readmodel.refresh_heroes([hero_id])
+            db.session.commit()
+        bench_app.config['HERO_READ_MODEL'] = True
+        try:
+            bench(get(bench_app.test_client(), f'/heroes/{hero_id}'))
+        finally:
+            bench_app.config['HERO_READ_MODEL'] = False
+
+    def test_batch_heroes(self, bench_app, dataset, bench):
+        client = bench_app.test_client()
+        first = dataset['heroes'] // 2
+        paths = [f'/heroes/{hero_id}' for hero_id in range(first, first + 100)]
+
+        def call(i):
+            response = client.post('/batch', json=paths)
+            assert response.status_code == 200
+
+        bench(call)
+
+    def test_hero_not_found(self, bench_app, dataset, bench):
+        bench(get(bench_app.test_client(), f"/heroes/{dataset['heroes'] + 1}", 404))
+
+    def test_powers_all(self, bench_app, dataset, bench):
+        bench(get(bench_app.test_client(), '/powers'))
+
+    def test_power_by_id(self, bench_app, dataset, bench):
+        bench(get(bench_app.test_client(), f"/powers/{dataset['powers'] // 2}"))
+
+
+class TestWrites:
+    '''Benchmarks of the write endpoints. Each round writes new rows.'''
+
+    def test_patch_power(self, bench_app, dataset, bench):
+        client = bench_app.test_client()
+        power_id = dataset['powers'] // 2
+
+        def call(i):
+            response = client.patch(f'/powers/{power_id}', json={
+                'description': f'benchmark description number {i}'})
+            assert response.status_code == 200
+
+        bench(call)
+
+    def test_create_hero_power(self, bench_app, dataset, bench):
+        client = bench_app.test_client()
+        power_id = dataset['bench_power']
+
+        def call(i):
+            # Heroes from 1 up get the benchmark power, one per round
+            response = client.post('/hero_powers', json={
+                'strength': 'Strong', 'power_id': power_id, 'hero_id': i + 1})
+            assert response.status_code == 200
+
+        bench(call)
+
+    def test_create_hero_powers_bulk(self, bench_app, dataset, bench):
+        client = bench_app.test_client()
+        power_id = dataset['bench_power']
+        # The second half of the heroes, split between the rounds
+        first = dataset['heroes'] // 2 + 1
+        batch = min(1000, dataset['heroes'] // 2 // 25)
+
+        def call(i):
+            start = first + i * batch
+            body = json.dumps([
+                {'strength': 'Weak', 'power_id': power_id, 'hero_id': hero_id}
+                for hero_id in range(start, start + batch)])
+            response = client.post('/hero_powers/bulk', data=body,
+                                   content_type='application/json')
+            assert response.status_code == 200
+            assert response.get_json()['created'] == batch
+
+        bench(call)
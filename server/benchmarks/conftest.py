@@ -0,0 +1,233 @@
+"""
+Fixtures and reporting for the endpoint benchmarks in bench_endpoints.py.
+
+    pytest server/benchmarks/bench_endpoints.py \
+        --bench-sizes 1000,100000,1000000 --bench-save baseline.json
+    pytest server/benchmarks/bench_endpoints.py \
+        --bench-compare baseline.json --bench-threshold 0.25
+
+Generated datasets are kept in --bench-cache (one SQLite file per size and
+seed) and copied to a scratch file for each run, so write benchmarks never
+touch the template. With --bench-compare the session fails when any
+benchmark's median latency is more than --bench-threshold slower than the
+baseline.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import statistics
+import sys
+import time
+import tracemalloc
+
+import pytest
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('bench', 'endpoint benchmarks')
+    group.addoption('--bench-sizes', default='1000,100000,1000000',
+                    help='comma-separated hero counts to benchmark against')
+    group.addoption('--bench-rounds', type=int, default=20,
+                    help='timed rounds per benchmark (fewer for slow endpoints)')
+    group.addoption('--bench-budget', type=float, default=5.0,
+                    help='rough seconds to spend timing one benchmark')
+    group.addoption('--bench-seed', type=int, default=42)
+    group.addoption('--bench-cache', default=os.path.join(SERVER_DIR, '.bench-cache'),
+                    help='directory for generated template databases')
+    group.addoption('--bench-save', help='write the results to this JSON file')
+    group.addoption('--bench-compare', help='baseline JSON file to compare against')
+    group.addoption('--bench-threshold', type=float, default=0.25,
+                    help='allowed relative slowdown of the median before failing')
+
+
+def pytest_generate_tests(metafunc):
+    if 'dataset' in metafunc.fixturenames:
+        sizes = [int(size) for size in
+                 metafunc.config.getoption('bench_sizes').split(',')]
+        metafunc.parametrize('dataset', sizes, indirect=True, scope='session',
+                             ids=[f'{size}' for size in sizes])
+
+
+@pytest.fixture(scope='session')
+def bench_app():
+    # Measure the database and serialization, not the response cache
+    os.environ['RESPONSE_CACHE'] = 'none'
+    # ...nor the write rate limits
+    os.environ['LIMITS_BACKEND'] = 'none'
+    sys.path.insert(0, SERVER_DIR)
+    from app import app
+    app.logger.disabled = True
+    return app
+
+
+def schema_digest():
+    # Templates are rebuilt whenever the models' schema changes
+    from sqlalchemy.dialects import sqlite
+    from sqlalchemy.schema import CreateTable
+    from models import db
+    ddl = ''.join(str(CreateTable(table).compile(dialect=sqlite.dialect()))
+                  for table in db.metadata.sorted_tables)
+    return hashlib.blake2b(ddl.encode(), digest_size=4).hexdigest()
+
+
+def build_template(app, path, size, seed):
+    from models import db, Power
+    import seed as seeder
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    with app.app_context():
+        db.create_all()
+        seeder.seed_generated(size, max(10, min(5000, size // 200)), 5, seed, 50_000)
+        # A power nobody holds yet, for the POST /hero_powers benchmark
+        db.session.add(Power(name='benchmark power',
+                             description='a power reserved for benchmark links'))
+        db.session.commit()
+        db.session.remove()
+        # Closing the last connection checkpoints the WAL into the file
+        db.engine.dispose()
+
+
+@pytest.fixture(scope='session')
+def dataset(request, bench_app, tmp_path_factory):
+    """
+    Points the app at a fresh copy of the generated dataset for this size
+    and returns {'size', 'heroes', 'powers', 'bench_power'}.
+    """
+    size = request.param
+    config = request.config
+    cache = config.getoption('bench_cache')
+    seed = config.getoption('bench_seed')
+    os.makedirs(cache, exist_ok=True)
+    template = os.path.join(cache, f'heroes-{size}-seed{seed}-{schema_digest()}.db')
+    if not os.path.exists(template):
+        build_template(bench_app, template + '.tmp', size, seed)
+        os.replace(template + '.tmp', template)
+
+    work = str(tmp_path_factory.mktemp(f'bench{size}') / 'bench.db')
+    shutil.copyfile(template, work)
+    bench_app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{work}'
+
+    from models import db, Hero, Power
+    with bench_app.app_context():
+        info = {
+            'size': size,
+            'heroes': db.session.query(db.func.max(Hero.id)).scalar(),
+            'powers': db.session.query(db.func.max(Power.id)).scalar() - 1,
+            'bench_power': db.session.query(db.func.max(Power.id)).scalar(),
+        }
+        db.session.remove()
+    return info
+
+
+class Bench:
+    """
+    Times one callable: a warm-up call, then up to --bench-rounds timed
+    calls within --bench-budget seconds, one call under tracemalloc for
+    allocations, and the SQL statements of one call.
+    """
+
+    def __init__(self, app, results, rounds, budget):
+        self.app = app
+        self.results = results
+        self.rounds = rounds
+        self.budget = budget
+
+    def __call__(self, name, fn):
+        from instrumentation import QueryCounter
+        from models import db
+
+        with self.app.app_context():
+            engine = db.engine
+        with QueryCounter(engine) as counter:
+            fn(0)
+
+        tracemalloc.start()
+        fn(1)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        timings = []
+        deadline = time.perf_counter() + self.budget
+        for i in range(2, self.rounds + 2):
+            start = time.perf_counter()
+            fn(i)
+            timings.append(time.perf_counter() - start)
+            if time.perf_counter() > deadline and len(timings) >= 3:
+                break
+
+        timings.sort()
+        self.results[name] = {
+            'median': statistics.median(timings),
+            'min': timings[0],
+            'p95': timings[max(0, int(len(timings) * 0.95) - 1)],
+            'rounds': len(timings),
+            'peak_alloc_bytes': peak,
+            'sql_statements': counter.count,
+        }
+        return self.results[name]
+
+
+@pytest.fixture
+def bench(request, bench_app):
+    results = request.config._bench_results
+    name = request.node.name
+    runner = Bench(bench_app, results, request.config.getoption('bench_rounds'),
+                   request.config.getoption('bench_budget'))
+    return lambda fn: runner(name, fn)
+
+
+def pytest_configure(config):
+    config._bench_results = {}
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    results = getattr(config, '_bench_results', {})
+    if not results:
+        return
+    write = terminalreporter.write_line
+    terminalreporter.section('benchmarks')
+    write(f"{'benchmark':<48} {'median ms':>10} {'p95 ms':>10} {'alloc KiB':>10} {'SQL':>5}")
+    for name, r in sorted(results.items()):
+        write(f"{name:<48} {r['median'] * 1000:10.2f} {r['p95'] * 1000:10.2f} "
+              f"{r['peak_alloc_bytes'] / 1024:10.0f} {r['sql_statements']:5d}")
+
+    save = config.getoption('bench_save')
+    if save:
+        with open(save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        write(f"saved results to {save}")
+
+    for line in getattr(config, '_bench_regressions', []):
+        write(line, red=True)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    config = session.config
+    baseline_path = config.getoption('bench_compare', None)
+    results = getattr(config, '_bench_results', {})
+    if not baseline_path or not results:
+        return
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    threshold = config.getoption('bench_threshold')
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        ratio = result['median'] / base['median'] - 1
+        if ratio > threshold:
+            regressions.append(
+                f"REGRESSION {name}: median {result['median'] * 1000:.2f} ms vs "
+                f"{base['median'] * 1000:.2f} ms baseline ({ratio:+.0%} > {threshold:.0%})")
+        if result['sql_statements'] > base['sql_statements']:
+            regressions.append(
+                f"REGRESSION {name}: {result['sql_statements']} SQL statements vs "
+                f"{base['sql_statements']} baseline")
+    config._bench_regressions = regressions
+    if regressions:
+        session.exitstatus = pytest.ExitCode.TESTS_FAILED
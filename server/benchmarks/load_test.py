@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Drives a mixed read/write workload from several worker processes against
+one SQLite file, once per engine profile, and prints the throughput, the
+writes refused as duplicates (409: the hero already had that power) and
+the failed requests ("database is locked" and friends).
+
+    python server/benchmarks/load_test.py --workers 4 --seconds 10
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _load_app(db_path, profile):
+    # Environment must be set before app.py is imported
+    os.environ['DB_URI'] = f'sqlite:///{db_path}'
+    os.environ['DB_PROFILE'] = profile
+    os.environ['RESPONSE_CACHE'] = 'none'
+    sys.path.insert(0, SERVER_DIR)
+    from app import app
+    app.logger.disabled = True
+    return app
+
+
+def setup(db_path, n_heroes, n_powers):
+    app = _load_app(db_path, 'default')
+    from models import db, Hero, Power
+    with app.app_context():
+        db.create_all()
+        db.session.execute(Power.__table__.insert(), [
+            {"name": f"power {i}", "description": f"power number {i} described at length"}
+            for i in range(n_powers)])
+        db.session.execute(Hero.__table__.insert(), [
+            {"name": f"hero {i}", "super_name": f"super {i}"}
+            for i in range(n_heroes)])
+        db.session.commit()
+
+
+def worker(db_path, profile, seconds, write_ratio, n_heroes, n_powers, seed, results):
+    app = _load_app(db_path, profile)
+    client = app.test_client()
+    rng = random.Random(seed)
+    ok = duplicates = failed = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        if rng.random() < write_ratio:
+            response = client.post('/hero_powers', json={
+                'strength': 'Strong',
+                'hero_id': rng.randint(1, n_heroes),
+                'power_id': rng.randint(1, n_powers)})
+        else:
+            response = client.get(f'/heroes/{rng.randint(1, n_heroes)}')
+        if response.status_code == 200:
+            ok += 1
+        elif response.status_code == 409:
+            duplicates += 1
+        else:
+            failed += 1
+    results.put((ok, duplicates, failed))
+
+
+def run(profile, args, ctx):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'load.db')
+        process = ctx.Process(target=setup, args=(db_path, args.heroes, args.powers))
+        process.start()
+        process.join()
+
+        results = ctx.Queue()
+        workers = [
+            ctx.Process(target=worker, args=(
+                db_path, profile, args.seconds, args.write_ratio,
+                args.heroes, args.powers, seed, results))
+            for seed in range(args.workers)]
+        for process in workers:
+            process.start()
+        totals = [results.get() for _ in workers]
+        for process in workers:
+            process.join()
+
+    ok = sum(t[0] for t in totals)
+    duplicates = sum(t[1] for t in totals)
+    failed = sum(t[2] for t in totals)
+    print(f"  {profile:<10} {ok / args.seconds:10.0f} req/s   "
+          f"{duplicates:6d} duplicates   {failed:6d} failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    parser.add_argument('--heroes', type=int, default=1000)
+    parser.add_argument('--powers', type=int, default=50)
+    parser.add_argument('--profiles', default='default,production')
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')
+    print(f"{args.workers} workers, {args.seconds:g}s, "
+          f"{args.write_ratio:.0%} writes")
+    for profile in args.profiles.split(','):
+        run(profile, args, ctx)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Compares SerializerMixin.to_dict() with the compiled serializers in
+serializers.py on the hero detail shape (hero -> hero_powers -> power).
+
+    python server/benchmarks/serializer_bench.py --heroes 10000 --powers-per-hero 5
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Run against a throwaway in-memory database, never app.db
+os.environ['DB_URI'] = 'sqlite://'
+
+from app import app  # noqa: E402
+from models import db, Hero, Power, HeroPower, HERO_DETAIL_OPTIONS  # noqa: E402
+from serializers import hero_detail  # noqa: E402
+
+
+def populate(n_heroes, powers_per_hero, n_powers=100):
+    db.create_all()
+    rng = random.Random(42)
+    db.session.execute(Power.__table__.insert(), [
+        {"id": i, "name": f"power {i}",
+         "description": f"power number {i} described at length"}
+        for i in range(1, n_powers + 1)])
+    db.session.execute(Hero.__table__.insert(), [
+        {"id": i, "name": f"hero {i}", "super_name": f"super {i}"}
+        for i in range(1, n_heroes + 1)])
+    db.session.execute(HeroPower.__table__.insert(), [
+        {"hero_id": hero_id, "power_id": power_id,
+         "strength": rng.choice(["Strong", "Weak", "Average"])}
+        for hero_id in range(1, n_heroes + 1)
+        for power_id in rng.sample(range(1, n_powers + 1), powers_per_hero)])
+    db.session.commit()
+
+
+def best_of(repeat, fn, *args):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--heroes', type=int, default=10_000)
+    parser.add_argument('--powers-per-hero', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with app.app_context():
+        populate(args.heroes, args.powers_per_hero)
+        heroes = Hero.query.options(*HERO_DETAIL_OPTIONS).all()
+
+        assert [hero_detail(h) for h in heroes[:10]] == \
+            [h.to_dict() for h in heroes[:10]]
+
+        mixin = best_of(args.repeat, lambda: [h.to_dict() for h in heroes])
+        compiled = best_of(args.repeat, lambda: [hero_detail(h) for h in heroes])
+
+    print(f"{args.heroes} heroes x {args.powers_per_hero} powers, best of {args.repeat}")
+    print(f"  SerializerMixin.to_dict(): {mixin * 1000:9.1f} ms")
+    print(f"  compiled hero_detail():    {compiled * 1000:9.1f} ms")
+    print(f"  speedup:                   {mixin / compiled:9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Measures POST /hero_powers throughput of a sharded deployment (shards.py)
+for each shard count, with the same client processes sending writes for
+random heroes through the router.
+
+    python server/benchmarks/shard_bench.py --shards 1,2,4 --clients 8 --seconds 10
+
+With ``--direct`` the clients pick each hero's shard themselves and skip
+the router, which shows what the shards take without it. Every shard is
+its own process with its own database file, so writes only scale with the
+shard count while there are CPU cores (and disk) to spare for them.
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+# Read by the shard processes and the router, which inherit the environment
+os.environ.update({'RESPONSE_CACHE': 'none', 'LIMITS_BACKEND': 'none',
+                   'METRICS': '0', 'COMPRESSION_ENCODINGS': ''})
+
+HOST = '127.0.0.1'
+
+
+def setup(db_path, n_heroes, n_powers):
+    from sqlalchemy import create_engine
+    from models import db, Hero, Power
+
+    engine = create_engine(f'sqlite:///{db_path}')
+    db.Model.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(Power.__table__.insert(), [
+            {"name": f"power {i}", "description": f"power number {i} described at length"}
+            for i in range(n_powers)])
+        conn.execute(Hero.__table__.insert(), [
+            {"name": f"hero {i}", "super_name": f"super {i}"}
+            for i in range(n_heroes)])
+    engine.dispose()
+
+
+def start_router(port, urls):
+    code = (f"from werkzeug.serving import run_simple; from router import create_router; "
+            f"run_simple({HOST!r}, {port}, create_router({urls!r}), threaded=True)")
+    return subprocess.Popen([sys.executable, '-c', code], cwd=SERVER_DIR,
+                            stderr=subprocess.DEVNULL)
+
+
+def client(ports, seconds, n_heroes, n_powers, seed, results):
+    from shards import shard_for
+
+    rng = random.Random(seed)
+    connections = [http.client.HTTPConnection(HOST, port) for port in ports]
+    headers = {'Content-Type': 'application/json'}
+    ok = failed = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        hero_id = rng.randint(1, n_heroes)
+        # One port: the router. Several: the shards, in order
+        connection = connections[shard_for(hero_id, len(connections))]
+        connection.request('POST', '/hero_powers', json.dumps({
+            'strength': 'Strong', 'hero_id': hero_id,
+            'power_id': rng.randint(1, n_powers)}), headers)
+        response = connection.getresponse()
+        response.read()
+        # 409: the hero already had that power, still a write attempt
+        if response.status in (200, 409):
+            ok += 1
+        else:
+            failed += 1
+    results.put((ok, failed))
+
+
+def run(count, args, ctx):
+    import shards
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'source.db')
+        setup(source, args.heroes, args.powers)
+        paths = shards.split(source, os.path.join(tmp, 'shards'), count)
+        processes, urls = shards.start_shards(
+            paths, HOST, args.port + 1, stderr=subprocess.DEVNULL)
+        try:
+            if args.direct:
+                ports = [args.port + 1 + index for index in range(count)]
+            else:
+                processes.append(start_router(args.port, urls))
+                shards.wait_for_port(HOST, args.port)
+                ports = [args.port]
+
+            results = ctx.Queue()
+            clients = [
+                ctx.Process(target=client, args=(
+                    ports, args.seconds, args.heroes, args.powers, seed, results))
+                for seed in range(args.clients)]
+            for process in clients:
+                process.start()
+            totals = [results.get() for _ in clients]
+            for process in clients:
+                process.join()
+        finally:
+            shards.stop_shards(processes)
+
+    ok = sum(t[0] for t in totals)
+    failed = sum(t[1] for t in totals)
+    return ok / args.seconds, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--shards', default='1,2,4')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--heroes', type=int, default=10_000)
+    parser.add_argument('--powers', type=int, default=100)
+    parser.add_argument('--port', type=int, default=5600)
+    parser.add_argument('--direct', action='store_true',
+                        help="send requests to the shards, not the router")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')
+    print(f"{args.clients} clients, {args.seconds:g}s, {os.cpu_count()} CPUs, "
+          f"{'direct to the shards' if args.direct else 'through the router'}")
+    baseline = None
+    for count in map(int, args.shards.split(',')):
+        rate, failed = run(count, args, ctx)
+        baseline = baseline or rate
+        print(f"  {count:3d} shards {rate:10.0f} req/s   {rate / baseline:5.2f}x"
+              f"   {failed:6d} failed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Measures the cold-start time of the app with python -X importtime: each
+round imports it in a fresh interpreter, and the report shows the median
+import time and the packages it goes to.
+
+    python server/benchmarks/startup_bench.py --rounds 10 --save startup.json
+    python server/benchmarks/startup_bench.py --compare startup.json --threshold 0.25
+
+With --compare the script exits 1 when a module's median import time is
+more than --threshold slower than the baseline.
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# import time:  self [us] | cumulative | imported package
+LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def import_once(module):
+    """
+    Imports ``module`` in a new interpreter. Returns the wall time of the
+    process and the -X importtime report as (name, self seconds,
+    cumulative seconds) per import.
+    """
+    env = dict(os.environ, RESPONSE_CACHE='none', LIMITS_BACKEND='none',
+               DB_URI='sqlite://')
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=SERVER_DIR, env=env, capture_output=True, text=True,
+                            check=True)
+    wall = time.perf_counter() - start
+    imports = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            imports.append((match.group(4), int(match.group(1)) / 1e6,
+                            int(match.group(2)) / 1e6))
+    return wall, imports
+
+
+def packages(imports):
+    # Self time summed per top-level package, so the packages add up to
+    # the total however they import each other
+    totals = {}
+    for name, own, _ in imports:
+        package = name.split('.')[0]
+        totals[package] = totals.get(package, 0) + own
+    return totals
+
+
+def measure(module, rounds):
+    walls, totals, by_package = [], [], {}
+    for _ in range(rounds):
+        wall, imports = import_once(module)
+        walls.append(wall)
+        totals.append(next(cumulative for name, _, cumulative in imports
+                           if name == module))
+        for name, seconds in packages(imports).items():
+            by_package.setdefault(name, []).append(seconds)
+    return {
+        'median': statistics.median(totals),
+        'wall_median': statistics.median(walls),
+        'packages': {name: statistics.median(times) for name, times in by_package.items()
+                     if len(times) == rounds},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modules', default='app,wsgi',
+                        help='comma-separated modules to import')
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--top', type=int, default=10,
+                        help='packages to list per module')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed relative slowdown of the median before failing')
+    args = parser.parse_args()
+
+    results = {}
+    for module in args.modules.split(','):
+        result = results[module] = measure(module, args.rounds)
+        print(f"import {module}: median {result['median'] * 1000:.0f} ms, "
+              f"process {result['wall_median'] * 1000:.0f} ms")
+        top = sorted(result['packages'].items(), key=lambda item: -item[1])
+        for name, seconds in top[:args.top]:
+            print(f"    {name:<32} {seconds * 1000:8.1f} ms")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"saved results to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = []
+        for module, result in sorted(results.items()):
+            base = baseline.get(module)
+            if base is None:
+                continue
+            ratio = result['median'] / base['median'] - 1
+            if ratio > args.threshold:
+                regressions.append(
+                    f"REGRESSION import {module}: median {result['median'] * 1000:.0f} ms "
+                    f"vs {base['median'] * 1000:.0f} ms baseline "
+                    f"({ratio:+.0%} > {args.threshold:.0%})")
+        for line in regressions:
+            print(line)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import json
+
+from models import db, Hero, Power, HeroPower, STRENGTHS
+
+# Most links accepted by one POST /hero_powers/bulk
+BULK_LIMIT = 10_000
+# Ids per IN (...) lookup, well under SQLite's bound-parameter limit
+IN_CHUNK = 500
+
+
+class BulkError(ValueError):
+    pass
+
+
+def parse_items(request):
+    """
+    Reads the request body as a JSON array or, with
+    ``Content-Type: application/x-ndjson``, as one JSON object per line.
+    """
+    if request.mimetype == 'application/x-ndjson':
+        items = []
+        for number, line in enumerate(request.get_data(as_text=True).splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                raise BulkError(f"line {number} is not valid JSON")
+    else:
+        items = request.get_json(silent=True)
+        if not isinstance(items, list):
+            raise BulkError("body must be a JSON array of hero_powers")
+    if len(items) > BULK_LIMIT:
+        raise BulkError(f"at most {BULK_LIMIT} hero_powers per request")
+    return items
+
+
+def existing_ids(column, ids):
+    # One IN (...) query per chunk of ids rather than one query per item
+    ids = list(ids)
+    found = set()
+    for start in range(0, len(ids), IN_CHUNK):
+        chunk = ids[start:start + IN_CHUNK]
+        found.update(i for i, in db.session.query(column).filter(column.in_(chunk)))
+    return found
+
+
+def existing_links(hero_ids):
+    # The (hero_id, power_id) pairs already held by these heroes
+    hero_ids = list(hero_ids)
+    links = set()
+    for start in range(0, len(hero_ids), IN_CHUNK):
+        chunk = hero_ids[start:start + IN_CHUNK]
+        links.update(db.session.query(HeroPower.hero_id, HeroPower.power_id)
+                     .filter(HeroPower.hero_id.in_(chunk)))
+    return links
+
+
+def validate_items(items):
+    """
+    Checks every item against the same rules as POST /hero_powers.
+
+    Returns (rows, errors): the rows ready to insert, and an error entry
+    ``{"index": i, "errors": [...]}`` for every rejected item. Hero and
+    power ids, and the links heroes already hold, are looked up with one
+    IN query per table for the whole batch.
+    """
+    errors = []
+    candidates = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not {'strength', 'power_id', 'hero_id'} <= item.keys():
+            errors.append({"index": index,
+                           "errors": ["strength, power_id, and hero_id are required"]})
+        elif not isinstance(item['hero_id'], int) or not isinstance(item['power_id'], int):
+            errors.append({"index": index, "errors": ["validation errors"]})
+        else:
+            candidates.append((index, item))
+
+    heroes = existing_ids(Hero.id, {item['hero_id'] for _, item in candidates})
+    powers = existing_ids(Power.id, {item['power_id'] for _, item in candidates})
+
+    # (hero_id, power_id) is unique: reject pairs already stored and
+    # repeats within the batch
+    taken = existing_links({item['hero_id'] for _, item in candidates})
+
+    rows = []
+    for index, item in candidates:
+        pair = (item['hero_id'], item['power_id'])
+        if item['hero_id'] not in heroes or item['power_id'] not in powers:
+            errors.append({"index": index, "errors": ["Power or Hero not found"]})
+        elif item['strength'] not in STRENGTHS:
+            errors.append({"index": index, "errors": ["validation errors"]})
+        elif pair in taken:
+            errors.append({"index": index, "errors": ["Hero already has this power"]})
+        else:
+            taken.add(pair)
+            rows.append({"hero_id": item['hero_id'],
+                         "power_id": item['power_id'],
+                         "strength": item['strength']})
+    errors.sort(key=lambda error: error['index'])
+    return rows, errors
+
+
+def insert_rows(rows):
+    # A single executemany, bypassing the ORM unit of work. The caller
+    # commits, so whatever else the request writes shares the transaction.
+    if rows:
+        db.session.execute(HeroPower.__table__.insert(), rows)
+
+
+def inserted_rows(rows):
+    # The rows just inserted by insert_rows(), with their ids, looked up by
+    # (hero_id, power_id) with one IN query per chunk of heroes
+    pairs = {(row['hero_id'], row['power_id']) for row in rows}
+    hero_ids = sorted({hero_id for hero_id, _ in pairs})
+    columns = (HeroPower.id, HeroPower.hero_id, HeroPower.power_id, HeroPower.strength)
+    found = []
+    for start in range(0, len(hero_ids), IN_CHUNK):
+        chunk = hero_ids[start:start + IN_CHUNK]
+        found.extend(row for row in db.session.query(*columns)
+                     .filter(HeroPower.hero_id.in_(chunk)).order_by(HeroPower.id)
+                     if (row.hero_id, row.power_id) in pairs)
+    return found
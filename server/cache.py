@@ -0,0 +1,399 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import wraps
+from operator import itemgetter
+from urllib.parse import urlencode
+
+from flask import Response, current_app, make_response, request
+
+from compression import compression, encoded_etag, etag_matches
+from pagination import accepts_ndjson
+
+# What the cache stores for one URL: the encoded body plus what is needed
+# to rebuild the response without running the view again. variants holds
+# the body compressed with the encodings clients have asked for so far,
+# as ((encoding, bytes), ...).
+CachedResponse = namedtuple('CachedResponse', 'body mimetype etag headers variants',
+                            defaults=((),))
+
+# Response headers copied into the cache entry (e.g. pagination cursors)
+CACHED_HEADERS = ('Link', 'X-Next-Cursor')
+
+
+def make_etag(body):
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def resource_of(key):
+    # Keys are ``<resource>|<path?query>``
+    return key.partition('|')[0]
+
+
+def entry_size(entry):
+    # Bytes held by an entry: its body and compressed copies
+    return len(entry.body) + sum(len(data) for _, data in entry.variants)
+
+
+class NullCache:
+    """
+    Backend that never stores anything. Used when caching is disabled.
+    """
+
+    def get(self, key):
+        return None
+
+    def set(self, key, entry):
+        pass
+
+    def add_variant(self, key, etag, encoding, data):
+        pass
+
+    def delete_resources(self, resources):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LRUCache:
+    """
+    In-process backend: a least-recently-used map with a per-entry TTL,
+    holding at most ``maxsize`` entries and ``maxbytes`` bytes of bodies.
+    An entry larger than ``maxbytes`` is not stored.
+
+    Each worker process has its own copy, so invalidations made by one
+    worker are not seen by the others. Use SQLiteCache when running
+    several workers.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, maxbytes=64 * 1024 * 1024):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # resource -> its keys, so invalidating a resource does not scan
+        # every entry
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires, entry = item
+            if expires < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        size = entry_size(entry)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.maxbytes:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, entry)
+            self._bytes += size
+            self._keys.setdefault(resource_of(key), set()).add(key)
+            while len(self._entries) > self.maxsize or self._bytes > self.maxbytes:
+                self._remove(next(iter(self._entries)))
+
+    def add_variant(self, key, etag, encoding, data):
+        # Adds a compressed copy to the entry, unless the entry has been
+        # replaced or dropped since it was read
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None or item[1].etag != etag \
+                    or encoding in dict(item[1].variants):
+                return
+            expires, entry = item
+            entry = entry._replace(variants=entry.variants + ((encoding, data),))
+            if entry_size(entry) > self.maxbytes:
+                return
+            self._entries[key] = (expires, entry)
+            self._bytes += len(data)
+            while self._bytes > self.maxbytes:
+                self._remove(next(iter(self._entries)))
+
+    def delete_resources(self, resources):
+        with self._lock:
+            for resource in resources:
+                for key in self._keys.pop(resource, ()):
+                    self._bytes -= entry_size(self._entries.pop(key)[1])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        # Called with the lock held
+        self._bytes -= entry_size(self._entries.pop(key)[1])
+        resource = resource_of(key)
+        keys = self._keys[resource]
+        keys.discard(key)
+        if not keys:
+            del self._keys[resource]
+
+
+class SQLiteCache:
+    """
+    Shared backend: entries live in a SQLite file that every worker on the
+    host opens, so an invalidation in one worker is seen by all of them.
+    """
+
+    # Expired rows are swept after this many writes
+    PURGE_EVERY = 256
+
+    def __init__(self, path, ttl=60):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS response_cache ('
+            ' key TEXT PRIMARY KEY, body BLOB, mimetype TEXT, etag TEXT,'
+            ' headers TEXT, expires REAL)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS response_cache_variants ('
+            ' key TEXT, encoding TEXT, body BLOB, PRIMARY KEY (key, encoding))'
+            ' WITHOUT ROWID')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        with conn:
+            # One read transaction, so the variants belong to this body and
+            # not to one set() stored in between
+            conn.execute('BEGIN')
+            row = conn.execute(
+                'SELECT body, mimetype, etag, headers FROM response_cache'
+                ' WHERE key = ? AND expires > ?', (key, time.time())).fetchone()
+            if row is None:
+                return None
+            variants = conn.execute(
+                'SELECT encoding, body FROM response_cache_variants WHERE key = ?',
+                (key,)).fetchall()
+        body, mimetype, etag, headers = row
+        return CachedResponse(bytes(body), mimetype, etag,
+                              tuple(map(tuple, json.loads(headers))),
+                              tuple((encoding, bytes(data)) for encoding, data in variants))
+
+    def set(self, key, entry):
+        conn = self._connect()
+        with conn:
+            # One transaction, so readers never see a body without its
+            # variants or the variants of an older body
+            conn.execute('BEGIN')
+            conn.execute(
+                'INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?, ?, ?)',
+                (key, entry.body, entry.mimetype, entry.etag,
+                 json.dumps(entry.headers), time.time() + self.ttl))
+            conn.execute('DELETE FROM response_cache_variants WHERE key = ?', (key,))
+            conn.executemany(
+                'INSERT INTO response_cache_variants VALUES (?, ?, ?)',
+                [(key, encoding, data) for encoding, data in entry.variants])
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            now = time.time()
+            with conn:
+                conn.execute('BEGIN')
+                conn.execute(
+                    'DELETE FROM response_cache_variants WHERE key IN'
+                    ' (SELECT key FROM response_cache WHERE expires <= ?)', (now,))
+                conn.execute('DELETE FROM response_cache WHERE expires <= ?', (now,))
+
+    def add_variant(self, key, etag, encoding, data):
+        # One statement, so the copy is only added while the row still
+        # holds the body it was compressed from
+        conn = self._connect()
+        conn.execute(
+            'INSERT OR IGNORE INTO response_cache_variants'
+            ' SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM response_cache'
+            ' WHERE key = ? AND etag = ?)', (key, encoding, data, key, etag))
+
+    def delete_resources(self, resources):
+        # Range scans on the primary key, rather than LIKE, so '_' and '%'
+        # in keys need no escaping. All resources go in one transaction.
+        ranges = [(f'{resource}|', f'{resource}|\uffff') for resource in resources]
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN')
+            for table in ('response_cache', 'response_cache_variants'):
+                conn.executemany(f'DELETE FROM {table} WHERE key >= ? AND key < ?',
+                                 ranges)
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN')
+            conn.execute('DELETE FROM response_cache')
+            conn.execute('DELETE FROM response_cache_variants')
+
+
+def backend_from_config(config):
+    """
+    Builds a backend from ``RESPONSE_CACHE``:
+
+    - ``memory`` (default): LRUCache, holding at most
+      ``RESPONSE_CACHE_SIZE`` entries and ``RESPONSE_CACHE_MAX_BYTES`` bytes
+    - ``sqlite:///path/to/cache.db``: SQLiteCache shared between workers
+    - ``none``: caching disabled
+    """
+    spec = config.get('RESPONSE_CACHE', 'memory')
+    ttl = config.get('RESPONSE_CACHE_TTL', 60)
+    if spec in (None, '', 'none'):
+        return NullCache()
+    if spec == 'memory':
+        return LRUCache(maxsize=config.get('RESPONSE_CACHE_SIZE', 1024), ttl=ttl,
+                        maxbytes=config.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    if spec.startswith('sqlite:///'):
+        return SQLiteCache(spec[len('sqlite:///'):], ttl=ttl)
+    raise ValueError(f"unknown RESPONSE_CACHE backend {spec!r}")
+
+
+NULL_CACHE = NullCache()
+
+
+class ResponseCache:
+    """
+    Read-through cache of GET responses, keyed per resource.
+
+    Each cached URL is stored under ``<resource>|<path?query>``, where the
+    resource is a name such as ``powers`` or ``hero:3`` chosen by the view
+    and the query keeps only the parameters the view reads.
+    Write paths call ``invalidate()`` with the resources they changed,
+    which drops every cached URL of those resources (all pages, all query
+    strings) and nothing else.
+
+    The backend belongs to the app (``app.extensions['response_cache']``),
+    so apps built by one process, e.g. the shards under test, never share
+    entries.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['response_cache'] = backend_from_config(app.config)
+
+    @property
+    def backend(self):
+        # Apps that never called init_app cache nothing
+        return current_app.extensions.get('response_cache', NULL_CACHE)
+
+    def cached(self, resource, params=''):
+        """
+        Decorates a view so its GET responses are cached under
+        ``resource(**view_args)``. ``params`` is a regular expression
+        matching the names of the query parameters the view reads.
+        """
+        params = re.compile(params)
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(**kwargs):
+                # A stream asked for with Accept is not in the key, and
+                # streams are never cached
+                if request.method != 'GET' or accepts_ndjson():
+                    return view(**kwargs)
+
+                key = self.key(resource(**kwargs), params)
+                entry = self.backend.get(key)
+                if entry is None:
+                    response = make_response(view(**kwargs))
+                    entry = self.store(key, response)
+                    if entry is None:
+                        return response
+                return self.respond(key, entry)
+            return wrapper
+        return decorator
+
+    def key(self, resource, params):
+        # The current request's path and the parameters whose names match
+        # ``params``, filed under ``resource``. Sorted by name (values of a
+        # repeated name keep their order), so neither the order of the
+        # parameters nor ones the view ignores make new entries.
+        args = sorted(((name, value) for name, value in request.args.items(multi=True)
+                       if params.fullmatch(name)), key=itemgetter(0))
+        return f'{resource}|{request.path}?{urlencode(args)}'
+
+    def store(self, key, response):
+        """
+        Caches ``response`` under ``key`` and returns its entry, or None
+        when it is not cacheable (not a 200, or streamed). Compressed
+        copies are added by respond(), for the encodings clients ask for.
+        """
+        if response.status_code != 200 or response.is_streamed:
+            return None
+        body = response.get_data()
+        # A view may set its own ETag (e.g. a version); the default is a
+        # hash of the body
+        etag = response.get_etag()[0] or make_etag(body)
+        entry = CachedResponse(
+            body, response.mimetype, etag,
+            tuple((name, response.headers[name])
+                  for name in CACHED_HEADERS if name in response.headers))
+        self.backend.set(key, entry)
+        return entry
+
+    def respond(self, key, entry):
+        # The response for the entry cached under ``key``: 304 when the
+        # client has it, otherwise the body in the best encoding the client
+        # accepts. An encoding is compressed the first time a client asks
+        # for it and kept with the entry for the next hits.
+        compressible = compression.compressible(entry.mimetype, len(entry.body))
+        encoding = compression.negotiate() if compressible else None
+        # If-None-Match uses the weak comparison (RFC 9110 13.1.2), and
+        # any encoding of the body the client has will do
+        if etag_matches(request.if_none_match, entry.etag):
+            response = Response(status=304)
+        else:
+            if encoding is None:
+                response = Response(entry.body, mimetype=entry.mimetype)
+            else:
+                data = dict(entry.variants).get(encoding)
+                if data is None:
+                    data = compression.compress(entry.body, encoding)
+                    self.backend.add_variant(key, entry.etag, encoding, data)
+                response = Response(data, mimetype=entry.mimetype)
+                response.headers['Content-Encoding'] = encoding
+        if compressible:
+            response.vary.add('Accept-Encoding')
+        response.set_etag(entry.etag if encoding is None
+                          else encoded_etag(entry.etag, encoding))
+        for name, value in entry.headers:
+            response.headers[name] = value
+        return response
+
+    def invalidate(self, *resources):
+        # One backend call for all of them: one lock or one transaction
+        self.backend.delete_resources(resources)
+
+    def clear(self):
+        self.backend.clear()
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,210 @@
+"""
+Change feed: an append-only log of the API's writes, read by long-poll or
+Server-Sent Events, so clients can keep a local copy of /heroes and
+/powers up to date instead of downloading them again.
+
+Every write route records what it changed in the ``changes`` table, in
+the same transaction as the change itself:
+
+- ``hero_power`` / ``create`` for POST /hero_powers and /hero_powers/bulk,
+  with the new hero_power's columns
+- ``power`` / ``update`` for PATCH /powers/<id>, with the power as
+  GET /powers/<id> returns it
+
+SQLite runs one write transaction at a time, so ``seq`` follows commit
+order: once a client has seen change 41 it only needs what comes after.
+
+    GET /changes                   {"changes": [], "last": 41, "more": false}
+    GET /changes?since=41&wait=25  change 42 on, waiting up to 25 s for it
+    GET /changes/stream?since=41   the same as an event stream
+
+A client reads ``last`` and then loads the collections; from then on it
+applies the changes after ``last``. ``flask changes prune`` drops old
+changes; a ``since`` from before the oldest one kept gets 410, and the
+client starts over.
+"""
+
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from models import db, Change
+
+# Most changes returned at once
+PAGE = 500
+# Longest a client may ask /changes to wait, in seconds
+MAX_WAIT = 30
+# How often waiting requests look for changes committed by other worker
+# processes, which do not wake them
+POLL = 1.0
+# Seconds between keep-alive comments on an idle event stream
+HEARTBEAT = 15
+
+
+class ChangeError(ValueError):
+    pass
+
+
+class Expired(ChangeError):
+    # since is older than the oldest change kept
+    pass
+
+
+class Notifier:
+    """
+    Wakes the requests of this process waiting for changes when a
+    transaction that recorded some commits.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self.generation = 0
+
+    def notify(self):
+        with self._condition:
+            self.generation += 1
+            self._condition.notify_all()
+
+    def wait(self, generation, timeout):
+        # Returns once a commit after ``generation`` was seen, or on timeout
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: self.generation != generation, timeout)
+
+
+notifier = Notifier()
+
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(session):
+    if session.info.pop('changes', False):
+        notifier.notify()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _after_rollback(session):
+    session.info.pop('changes', None)
+
+
+def record(resource, action, items):
+    """
+    Adds one change per item (a dict with an ``id``, as the API returns the
+    resource) to the current transaction. The caller commits.
+    """
+    encode = current_app.json.encode
+    now = time.time()
+    rows = [{'resource': resource, 'resource_id': item['id'], 'action': action,
+             'data': encode(item), 'created': now} for item in items]
+    if rows:
+        db.session.execute(Change.__table__.insert(), rows)
+        db.session.info['changes'] = True
+
+
+def last_seq():
+    return db.session.query(func.max(Change.seq)).scalar() or 0
+
+
+def feed_args(request):
+    """
+    Returns (since, wait) from the query string. ``since`` falls back to
+    the Last-Event-ID header an EventSource sends when it reconnects.
+    """
+    since = request.args.get('since', request.headers.get('Last-Event-ID'))
+    try:
+        since = None if since is None else int(since)
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        raise ChangeError("since must be an integer and wait a number")
+    if since is not None and since < 0:
+        raise ChangeError("since must not be negative")
+    if not 0 <= wait <= MAX_WAIT:
+        raise ChangeError(f"wait must be between 0 and {MAX_WAIT} seconds")
+    if since is not None:
+        first = db.session.query(func.min(Change.seq)).scalar()
+        if first is not None and since < first - 1:
+            raise Expired(f"changes before {first} are no longer kept; reload and "
+                          "continue from the current last")
+    return since, wait
+
+
+def read(since, limit=PAGE):
+    return db.session.query(Change.seq, Change.resource, Change.resource_id,
+                            Change.action, Change.data) \
+        .filter(Change.seq > since).order_by(Change.seq).limit(limit).all()
+
+
+def wait_for(since, timeout, limit=PAGE):
+    """
+    Returns the changes after ``since``, waiting up to ``timeout`` seconds
+    for the first one.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        generation = notifier.generation
+        rows = read(since, limit)
+        remaining = deadline - time.monotonic()
+        if rows or remaining <= 0:
+            return rows
+        # The connection goes back to the pool while the request waits
+        db.session.rollback()
+        notifier.wait(generation, min(POLL, remaining))
+
+
+def encode_change(row):
+    # The data is stored encoded and spliced in without decoding it
+    encode = current_app.json.encode
+    return b'{"seq":%d,"resource":%s,"id":%d,"action":%s,"data":%s}' % (
+        row.seq, encode(row.resource), row.resource_id, encode(row.action), row.data)
+
+
+def feed_body(rows, since, limit=PAGE):
+    last = rows[-1].seq if rows else since
+    return b'{"changes":[%s],"last":%d,"more":%s}' % (
+        b','.join(map(encode_change, rows)), last,
+        b'true' if len(rows) >= limit else b'false')
+
+
+def event_stream(since):
+    """
+    Yields the changes after ``since`` as Server-Sent Events, then every
+    new one as it is committed, with a comment every HEARTBEAT seconds
+    so proxies keep the connection open.
+    """
+    yield b'retry: 3000\n\n'
+    while True:
+        rows = wait_for(since, HEARTBEAT)
+        if not rows:
+            yield b': keep-alive\n\n'
+            continue
+        yield b''.join(b'id: %d\nevent: change\ndata: %s\n\n' % (row.seq, encode_change(row))
+                       for row in rows)
+        since = rows[-1].seq
+
+
+def prune(older_than):
+    """
+    Deletes the changes recorded more than ``older_than`` seconds ago,
+    except the newest one, which tells later requests where the log ends.
+    """
+    count = Change.query.filter(Change.created < time.time() - older_than,
+                                Change.seq < last_seq()) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+changes_cli = AppGroup('changes', help="Manage the change feed.")
+
+
+@changes_cli.command('prune')
+@click.option('--days', default=7.0, show_default=True,
+              help="Keep the changes of this many days.")
+def prune_command(days):
+    """Delete old changes from the change feed."""
+    count = prune(days * 86400)
+    click.echo(f"Deleted {count} changes older than {days:g} days")
@@ -0,0 +1,189 @@
+"""
+Response compression negotiated from ``Accept-Encoding``.
+
+gzip is always available; brotli (``br``) and zstd are used when the
+``brotli`` and ``zstandard`` packages are installed. Bodies smaller than
+``COMPRESSION_MIN_SIZE`` bytes are sent as they are, since compressing
+them costs more than it saves.
+
+A response the cache in cache.py stores is compressed with an encoding the
+first time a client asks for that encoding, and the copy is kept with the
+entry; later hits are served from it without compressing again. Other
+responses are compressed on the way out by an after_request hook.
+
+A compressed response carries the ETag of its body with the encoding
+appended (``"<etag>-gzip"``), so each representation has a strong tag of
+its own; If-None-Match and If-Match accept these tags back.
+"""
+
+import gzip
+import os
+from collections import namedtuple
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - zstandard is optional
+    zstandard = None
+
+
+def _gzip(body, level):
+    # mtime=0 keeps the output, and so any ETag derived from it, stable
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+def _brotli(body, level):
+    return brotli.compress(body, quality=level)
+
+
+def _zstd(body, level):
+    return zstandard.ZstdCompressor(level=level).compress(body)
+
+
+# Content-Encoding: (compress function, default level), in the order the
+# server prefers them when the client accepts several equally
+CODECS = {}
+if brotli is not None:
+    CODECS['br'] = (_brotli, 5)
+if zstandard is not None:
+    CODECS['zstd'] = (_zstd, 3)
+CODECS['gzip'] = (_gzip, 6)
+
+# Bodies worth compressing; images and the like are compressed already
+COMPRESSIBLE = ('application/json', 'application/x-ndjson', 'text/')
+
+
+def encoded_etag(etag, encoding):
+    # Each encoding of a body is a representation of its own, so it gets
+    # its own strong ETag: the body's, with the encoding appended
+    return f'{etag}-{encoding}'
+
+
+def unencoded_etag(etag):
+    # The body's ETag, from a tag encoded_etag() may have made
+    base, _, encoding = etag.rpartition('-')
+    return base if base and encoding in CODECS else etag
+
+
+def etag_matches(etags, etag):
+    """
+    Whether ``etags`` (e.g. ``request.if_none_match``) names the body
+    tagged ``etag`` in any encoding, with the weak comparison.
+    """
+    return etags.star_tag or etag in {
+        unencoded_etag(tag) for tag in etags.as_set(include_weak=True)}
+
+
+def config_from_env(environ=os.environ):
+    """
+    Returns the settings below from the environment. COMPRESSION_ENCODINGS
+    is a comma-separated preference list; empty turns compression off.
+    """
+    config = {
+        'COMPRESSION_ENCODINGS': tuple(filter(None, environ.get(
+            'COMPRESSION_ENCODINGS', ','.join(CODECS)).split(','))),
+        'COMPRESSION_MIN_SIZE': int(environ.get('COMPRESSION_MIN_SIZE', 1024)),
+    }
+    for encoding in CODECS:
+        level = environ.get(f'COMPRESSION_LEVEL_{encoding.upper()}')
+        if level is not None:
+            config[f'COMPRESSION_LEVEL_{encoding.upper()}'] = int(level)
+    return config
+
+
+# An app's encodings, ``{name: level}`` in order of preference, and the
+# smallest body worth compressing
+Settings = namedtuple('Settings', 'levels min_size')
+NO_COMPRESSION = Settings({}, 0)
+
+
+class Compression:
+    """
+    Compresses responses for clients that accept it.
+
+    - ``COMPRESSION_ENCODINGS``: encodings to offer, in order of
+      preference (default: every available one; empty disables compression)
+    - ``COMPRESSION_MIN_SIZE``: smallest body compressed, in bytes
+    - ``COMPRESSION_LEVEL_GZIP``, ``COMPRESSION_LEVEL_BR``,
+      ``COMPRESSION_LEVEL_ZSTD``: level for each encoding
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        encodings = app.config.setdefault('COMPRESSION_ENCODINGS', tuple(CODECS))
+        min_size = app.config.setdefault('COMPRESSION_MIN_SIZE', 1024)
+        unknown = [name for name in encodings if name not in CODECS]
+        if unknown:
+            raise ValueError(f"compression not available for {', '.join(unknown)}")
+        levels = {
+            name: int(app.config.setdefault(
+                f'COMPRESSION_LEVEL_{name.upper()}', CODECS[name][1]))
+            for name in encodings}
+        app.after_request(self._after_request)
+        # Per app: each app built in one process keeps its own settings
+        app.extensions['compression'] = Settings(levels, min_size)
+
+    @property
+    def _settings(self):
+        return current_app.extensions.get('compression', NO_COMPRESSION)
+
+    @property
+    def levels(self):
+        return self._settings.levels
+
+    @property
+    def min_size(self):
+        return self._settings.min_size
+
+    def compressible(self, response_or_mimetype, size):
+        mimetype = getattr(response_or_mimetype, 'mimetype', response_or_mimetype)
+        return bool(self.levels) and size >= self.min_size \
+            and (mimetype or '').startswith(COMPRESSIBLE)
+
+    def compress(self, body, encoding):
+        compress, _ = CODECS[encoding]
+        return compress(body, self.levels[encoding])
+
+    def negotiate(self, available=None):
+        """
+        Returns the encoding, among ``available`` (default: all enabled
+        ones), that the request's Accept-Encoding ranks best, or None for
+        the uncompressed body.
+        """
+        offered = [name for name in self.levels
+                   if available is None or name in available]
+        if not offered:
+            return None
+        return request.accept_encodings.best_match(offered)
+
+    def _after_request(self, response):
+        if (response.status_code < 200 or response.status_code in (204, 304)
+                or response.direct_passthrough or response.is_streamed):
+            return response
+        if 'Content-Encoding' in response.headers:
+            # Already compressed, e.g. served from the cache's variants
+            return response
+        if not self.compressible(response, response.content_length or 0):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = self.negotiate()
+        if encoding is not None:
+            response.set_data(self.compress(response.get_data(), encoding))
+            response.headers['Content-Encoding'] = encoding
+            etag, weak = response.get_etag()
+            if etag is not None:
+                response.set_etag(encoded_etag(etag, encoding), weak)
+        return response
+
+
+compression = Compression()
@@ -0,0 +1,81 @@
+"""
+Optimistic concurrency for PATCH /powers/<id>.
+
+Every power has a ``version`` that goes up by one on each UPDATE. GET and
+PATCH send it as the ETag ``"v<version>"`` (``"v<version>-gzip"`` and so on
+when the response is compressed). A client that sends it back in
+``If-Match`` has its PATCH applied with one conditional statement,
+
+    UPDATE powers SET ..., version = version + 1
+    WHERE id = ? AND version = ? RETURNING ...
+
+and gets 412 Precondition Failed if someone else changed the power first,
+instead of silently overwriting their change.
+
+A PATCH without If-Match is applied to the version the request read. If
+another update commits between that read and the write, the PATCH is
+refused with the same 412 and ``{"errors": ["Power has been modified"]}``:
+a lost version race gets one status, whichever way the client asked.
+"""
+
+import sqlite3
+
+from sqlalchemy import bindparam, text
+
+from compression import unencoded_etag
+from models import db
+
+# UPDATE ... RETURNING needs SQLite 3.35+. SQLAlchemy 1.4 does not render
+# RETURNING for SQLite, so the statements are written out below.
+SQLITE_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+UPDATE_POWER = (
+    'UPDATE powers SET description = :description, version = version + 1'
+    ' WHERE id = :id AND version IN :versions')
+POWER_COLUMNS = 'id, name, description, version'
+
+
+def power_etag(version):
+    return f'v{version}'
+
+
+def if_match_versions(request):
+    """
+    Returns the power versions listed in the request's If-Match header, or
+    None when there is no header (or it is ``*``) and the update is
+    unconditional. Tags this app did not issue name no version, so a
+    header made only of those yields ``[]`` and can never match.
+    """
+    etags = request.if_match
+    if not etags or etags.star_tag:
+        return None
+    # If-Match uses the strong comparison, so weak tags never match. The
+    # tag of a compressed response names the same version.
+    tags = [unencoded_etag(tag) for tag in etags.as_set()]
+    return [int(tag[1:]) for tag in tags if tag[:1] == 'v' and tag[1:].isdigit()]
+
+
+def update_power_if_match(id, versions, description):
+    """
+    Sets the description of power ``id`` if its version is one of
+    ``versions``, and returns the updated row (id, name, description,
+    version), or None if no row matched. The caller commits.
+    """
+    if not versions:
+        return None
+    params = {'id': id, 'versions': versions, 'description': description}
+    returning = db.engine.dialect.name != 'sqlite' or SQLITE_RETURNING
+    statement = UPDATE_POWER
+    if returning:
+        statement += f' RETURNING {POWER_COLUMNS}'
+    result = db.session.execute(
+        text(statement).bindparams(bindparam('versions', expanding=True)), params)
+    if returning:
+        return result.first()
+
+    # Older SQLite: read the row back in the same transaction
+    if result.rowcount != 1:
+        return None
+    return db.session.execute(
+        text(f'SELECT {POWER_COLUMNS} FROM powers WHERE id = :id'),
+        {'id': id}).first()
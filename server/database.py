@@ -0,0 +1,171 @@
+import os
+import weakref
+
+from flask import has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import event, orm
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+# PRAGMAs applied to every new SQLite connection under the production
+# profile. WAL lets readers run alongside the single writer, NORMAL
+# synchronous only fsyncs at checkpoints (still safe in WAL mode), and
+# busy_timeout makes a writer wait for the lock instead of failing at once
+# with "database is locked".
+PRODUCTION_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -64000,  # negative means KiB, so 64 MiB per connection
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+# Methods served by the read-only engine when one is configured
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Apps whose engines are reset in forked child processes
+_fork_apps = weakref.WeakSet()
+
+
+def _env_pragmas(environ):
+    # SQLITE_<PRAGMA>=value overrides one PRAGMA of the profile
+    pragmas = dict(PRODUCTION_PRAGMAS)
+    for name in pragmas:
+        value = environ.get(f'SQLITE_{name.upper()}')
+        if value is not None:
+            pragmas[name] = value
+    return pragmas
+
+
+def _sqlite_in_memory(uri):
+    database = make_url(uri).database
+    return database in (None, '', ':memory:') or 'mode=memory' in uri
+
+
+def database_config(base_dir, environ=os.environ):
+    """
+    Returns the SQLAlchemy settings for the app from the environment.
+
+    - ``DB_URI``: primary database (default: ``app.db`` next to app.py)
+    - ``DB_READ_URI``: optional read-only database used by GET requests,
+      e.g. a replica, or the same SQLite file opened read-only with
+      ``sqlite:///file:/path/app.db?mode=ro&uri=true``
+    - ``DB_PROFILE``: ``production`` (default) applies the SQLite PRAGMAs
+      above; ``default`` leaves SQLite's own settings alone
+    - ``DB_POOL_SIZE``, ``DB_MAX_OVERFLOW``, ``DB_POOL_RECYCLE``,
+      ``DB_POOL_TIMEOUT``: pool sizing for server databases such as Postgres
+    """
+    uri = environ.get(
+        "DB_URI", f"sqlite:///{os.path.join(base_dir, 'app.db')}")
+    profile = environ.get('DB_PROFILE', 'production')
+
+    if uri.startswith('sqlite'):
+        options = {}
+        if profile == 'production':
+            options['sqlite_pragmas'] = _env_pragmas(environ)
+        if profile == 'production' and not _sqlite_in_memory(uri):
+            # Flask-SQLAlchemy opens a new connection per checkout for
+            # SQLite files by default; keep them pooled so the PRAGMAs and
+            # the page cache survive between requests
+            options.update({
+                'poolclass': QueuePool,
+                'pool_size': int(environ.get('DB_POOL_SIZE', 5)),
+                'max_overflow': int(environ.get('DB_MAX_OVERFLOW', 10)),
+                'connect_args': {'check_same_thread': False},
+            })
+    else:
+        options = {
+            'pool_size': int(environ.get('DB_POOL_SIZE', 10)),
+            'max_overflow': int(environ.get('DB_MAX_OVERFLOW', 20)),
+            'pool_recycle': int(environ.get('DB_POOL_RECYCLE', 1800)),
+            'pool_timeout': int(environ.get('DB_POOL_TIMEOUT', 30)),
+            # Check a pooled connection is alive before handing it out
+            'pool_pre_ping': True,
+        }
+
+    config = {
+        'SQLALCHEMY_DATABASE_URI': uri,
+        'SQLALCHEMY_ENGINE_OPTIONS': options,
+    }
+    read_uri = environ.get('DB_READ_URI')
+    if read_uri:
+        config['SQLALCHEMY_BINDS'] = {'read': read_uri}
+    return config
+
+
+def set_sqlite_pragmas(pragmas):
+    # Returns a 'connect' listener that runs the PRAGMAs on each connection
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+    return on_connect
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session that sends the queries of read-only requests to the ``read``
+    bind, when one is configured, and everything else to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        # kwargs: SQLAlchemy 1.4's scoped_session passes bind=... and
+        # friends, which SignallingSession.get_bind does not accept
+        if (not self._flushing and has_request_context()
+                and request.method in READ_METHODS
+                and 'read' in (self.app.config.get('SQLALCHEMY_BINDS') or {})):
+            return get_state(self.app).db.get_engine(self.app, bind='read')
+        return super().get_bind(mapper, clause)
+
+
+class Database(SQLAlchemy):
+    """
+    Flask-SQLAlchemy with the engine profile from database_config():
+    PRAGMAs on every SQLite connection and read/write session routing.
+    """
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        # SQLite URI filenames (file:...?mode=ro&uri=true) are passed
+        # through as-is instead of being made relative to the app folder
+        if sa_url.drivername == 'sqlite' and (sa_url.database or '').startswith('file:'):
+            return sa_url, options
+        return super().apply_driver_hacks(app, sa_url, options)
+
+    def create_engine(self, sa_url, engine_opts):
+        engine_opts = dict(engine_opts)
+        pragmas = engine_opts.pop('sqlite_pragmas', None)
+        engine = super().create_engine(sa_url, engine_opts)
+        if pragmas and engine.dialect.name == 'sqlite':
+            event.listen(engine, 'connect', set_sqlite_pragmas(pragmas))
+        return engine
+
+
+def dispose_engines(app):
+    """
+    Forgets the pooled connections of every engine ``app`` has created.
+    The connections are not closed: after a fork they belong to the
+    parent, and closing them from the child would break its sessions.
+    """
+    state = get_state(app)
+    for bind in list(state.connectors):
+        state.db.get_engine(app, bind=bind).dispose(close=False)
+
+
+def dispose_after_fork(app):
+    # A connection shared by two processes corrupts both sides' sessions
+    # (and SQLite's locks), so forked children start with empty pools
+    _fork_apps.add(app)
+
+
+def _after_fork_in_child():
+    for app in list(_fork_apps):
+        dispose_engines(app)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,160 @@
+"""
+Sparse fieldsets and include control for the read endpoints.
+
+``fields[<type>]=a,b`` limits the columns returned for every object of
+that type (``hero``, ``power`` or ``hero_power``), and on GET
+/heroes/<id> ``include=hero_powers`` or ``include=hero_powers.power``
+names the relationships to embed (``include=`` embeds none). Only those
+columns and relationships are SELECTed. Without either parameter each
+endpoint returns its usual body.
+"""
+
+import re
+from functools import lru_cache
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import joinedload, load_only, selectinload
+
+from models import Hero, HeroPower, Power
+from serializers import compile_serializer
+
+# The types fields[...] names, and the columns each may return
+TYPES = {'hero': Hero, 'power': Power, 'hero_power': HeroPower}
+FIELDS = {
+    'hero': ('id', 'name', 'super_name'),
+    'power': ('id', 'name', 'description'),
+    'hero_power': ('id', 'hero_id', 'power_id', 'strength'),
+}
+TYPE_NAMES = {model: name for name, model in TYPES.items()}
+
+# The relationships GET /heroes/<id> can embed; all of them by default
+HERO_INCLUDES = frozenset(('hero_powers', 'hero_powers.power'))
+
+FIELDS_PARAM = re.compile(r'fields\[(\w+)\]')
+
+
+class FieldsetError(ValueError):
+    pass
+
+
+def requested(request):
+    # Whether the request asks for anything but the usual body
+    return 'include' in request.args \
+        or any(FIELDS_PARAM.fullmatch(name) for name in request.args)
+
+
+def fields_args(request, types):
+    """
+    Returns ``{type: fields}`` for the ``types`` an endpoint returns, from
+    the ``fields[<type>]`` parameters. Types without one get all their
+    fields.
+    """
+    fields = {name: FIELDS[name] for name in types}
+    for param, value in request.args.items():
+        match = FIELDS_PARAM.fullmatch(param)
+        if match is None:
+            continue
+        name = match.group(1)
+        if name not in fields:
+            raise FieldsetError(f"fields[{name}] does not apply to this endpoint")
+        wanted = {field.strip() for field in value.split(',') if field.strip()}
+        unknown = sorted(wanted.difference(FIELDS[name]))
+        if unknown:
+            raise FieldsetError(f"unknown {name} fields: {', '.join(unknown)}")
+        # In the usual order, so equal requests share a compiled serializer
+        fields[name] = tuple(field for field in FIELDS[name] if field in wanted)
+    return fields
+
+
+def include_args(request, allowed=frozenset(), default=frozenset()):
+    """
+    Returns the relationship paths named by ``include``, or ``default``
+    without it. A path includes its parents: ``hero_powers.power`` implies
+    ``hero_powers``.
+    """
+    if 'include' not in request.args:
+        return default
+    paths = set()
+    for path in request.args['include'].split(','):
+        path = path.strip()
+        if not path:
+            continue
+        if path not in allowed:
+            raise FieldsetError(f"cannot include {path}")
+        parts = path.split('.')
+        paths.update('.'.join(parts[:end]) for end in range(1, len(parts) + 1))
+    return frozenset(paths)
+
+
+def columns(model, fields):
+    """
+    The columns a list endpoint SELECTs for ``fields``. ``id`` is always
+    among them, since keyset pagination needs it even when it is not sent.
+    """
+    return (model.id,) + tuple(getattr(model, field) for field in fields if field != 'id')
+
+
+def _included(model, include, prefix):
+    return [relationship for relationship in inspect(model).relationships
+            if prefix + relationship.key in include]
+
+
+def load_options(model, fields, include=frozenset(), extra=()):
+    """
+    Loader options that SELECT only the requested columns of ``model`` and
+    of the relationships in ``include``, plus the keys that join them and
+    the ``extra`` columns of ``model``.
+    """
+    return _load_options(model, fields, include, '', None, extra)
+
+
+def _load_options(model, fields, include, prefix, loader, extra):
+    keys = ['id', *fields.get(TYPE_NAMES[model], ()), *extra]
+    relationships = _included(model, include, prefix)
+    for relationship in relationships:
+        keys.extend(column.key for column in relationship.local_columns)
+    attributes = [getattr(model, key) for key in dict.fromkeys(keys)]
+    options = [load_only(*attributes) if loader is None else loader.load_only(*attributes)]
+
+    for relationship in relationships:
+        # Collections with one SELECT ... IN, many-to-ones joined onto it,
+        # as in models.HERO_DETAIL_OPTIONS
+        strategy = selectinload if relationship.uselist else joinedload
+        attribute = getattr(model, relationship.key)
+        child = strategy(attribute) if loader is None \
+            else getattr(loader, strategy.__name__)(attribute)
+        options.extend(_load_options(
+            relationship.mapper.class_, fields, include,
+            f'{prefix}{relationship.key}.', child,
+            [column.key for column in relationship.remote_side]))
+    return options
+
+
+def serializer(model, fields, include=frozenset()):
+    """
+    Returns a function serializing ``model`` with only ``fields`` and the
+    relationships in ``include``. Compiled once per combination.
+    """
+    return _serializer(model, tuple(sorted(fields.items())), include, '')
+
+
+@lru_cache(maxsize=256)
+def _serializer(model, fields, include, prefix):
+    own = compile_serializer(model, only=dict(fields).get(TYPE_NAMES[model], ()))
+    children = [(relationship.key, relationship.uselist,
+                 _serializer(relationship.mapper.class_, fields, include,
+                             f'{prefix}{relationship.key}.'))
+                for relationship in _included(model, include, prefix)]
+    if not children:
+        return own
+
+    def serialize(obj):
+        data = own(obj)
+        for key, uselist, child in children:
+            value = getattr(obj, key)
+            if uselist:
+                data[key] = [child(item) for item in value]
+            else:
+                data[key] = None if value is None else child(value)
+        return data
+    return serialize
@@ -0,0 +1,194 @@
+"""
+Group commit for POST /hero_powers.
+
+With ``GROUP_COMMIT`` on, a request does not commit its HeroPower on its
+own. It queues the row and waits. The first request to find no flush
+under way becomes the leader: it waits up to ``GROUP_COMMIT_WINDOW_MS``
+for more rows (or until ``GROUP_COMMIT_MAX_ROWS`` are queued), writes them
+all in one transaction, commits, and wakes the others. Requests that
+arrived while it was writing form the next batch, led by the oldest of
+them. Every request is answered only after the transaction holding its
+row has committed, so one commit (and, with ``SQLITE_SYNCHRONOUS=FULL``,
+one fsync) is shared by the whole batch instead of paid per request.
+
+A row whose (hero_id, power_id) pair is already taken, or is taken by an
+earlier row of the same batch, is left out and reported to its own
+request as a conflict; the rest of the batch is written. An error that
+fails the whole transaction, e.g. "database is locked", is raised in every
+request of the batch.
+
+Batches are per process: each gunicorn worker groups its own requests,
+and the workers' transactions take turns on SQLite's write lock as
+before. The write limiter in limits.py caps how many requests wait at
+once, so ``WRITE_CONCURRENCY_MAX`` also caps the batch size.
+"""
+
+import threading
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from bulk import existing_links
+import changes
+from models import db, HeroPower
+import readmodel
+
+# Times a batch is re-checked and retried when another process takes one
+# of its pairs between the check and the insert
+RETRIES = 3
+
+
+class Conflict(Exception):
+    # The hero already holds the power
+    pass
+
+
+class _Entry:
+    __slots__ = ('row', 'wake', 'lead', 'done', 'id', 'error')
+
+    def __init__(self, row):
+        self.row = row
+        self.wake = threading.Event()
+        self.lead = False
+        self.done = False
+        self.id = None
+        self.error = None
+
+
+class GroupCommit:
+    """
+    Collects the rows of concurrent POST /hero_powers requests and commits
+    them together.
+
+    - ``GROUP_COMMIT``: on or off (default off)
+    - ``GROUP_COMMIT_WINDOW_MS``: longest a leader waits for more rows
+    - ``GROUP_COMMIT_MAX_ROWS``: most rows per transaction
+
+    Each app gets its own queue (``app.extensions['group_commit']``), so
+    rows are only ever batched with others bound for the same database.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['group_commit'] = Batches(
+            bool(app.config.setdefault('GROUP_COMMIT', False)),
+            app.config.setdefault('GROUP_COMMIT_WINDOW_MS', 2) / 1000,
+            int(app.config.setdefault('GROUP_COMMIT_MAX_ROWS', 64)))
+
+    @property
+    def enabled(self):
+        batches = current_app.extensions.get('group_commit')
+        return batches is not None and batches.enabled
+
+    def insert(self, hero_id, power_id, strength):
+        """
+        Queues a HeroPower row and returns its id once it is committed.
+        Raises Conflict if the hero already holds the power.
+        """
+        return current_app.extensions['group_commit'].insert(hero_id, power_id, strength)
+
+
+class Batches:
+    """
+    The queue of one app's rows waiting to be committed.
+    """
+
+    def __init__(self, enabled, window, max_rows):
+        self.enabled = enabled
+        self.window = window
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._full = threading.Event()
+        self._pending = []
+        self._leader = None
+
+    def insert(self, hero_id, power_id, strength):
+        entry = _Entry({'hero_id': hero_id, 'power_id': power_id, 'strength': strength})
+        with self._lock:
+            self._pending.append(entry)
+            if self._leader is None:
+                self._leader = entry
+                entry.lead = True
+            elif len(self._pending) >= self.max_rows:
+                self._full.set()
+
+        while not entry.done:
+            if entry.lead:
+                self._lead()
+            else:
+                # Woken either to lead the next batch or because ours is done
+                entry.wake.wait()
+                entry.wake.clear()
+
+        if entry.error is not None:
+            raise entry.error
+        return entry.id
+
+    def _lead(self):
+        # The leader is always the oldest queued entry, so it is in the batch
+        if not self._full.is_set():
+            self._full.wait(self.window)
+        with self._lock:
+            batch = self._pending[:self.max_rows]
+            del self._pending[:self.max_rows]
+            self._full.clear()
+
+        try:
+            self._write(batch)
+        except Exception as e:
+            db.session.rollback()
+            for entry in batch:
+                entry.error = e
+
+        with self._lock:
+            if self._pending:
+                # Hand over to the oldest request that arrived meanwhile
+                self._leader = self._pending[0]
+                self._leader.lead = True
+                self._leader.wake.set()
+                if len(self._pending) >= self.max_rows:
+                    self._full.set()
+            else:
+                self._leader = None
+        for entry in batch:
+            entry.done = True
+            entry.wake.set()
+
+    def _write(self, batch):
+        for attempt in range(RETRIES):
+            try:
+                self._insert(batch)
+                db.session.commit()
+                return
+            except IntegrityError:
+                # Another process took a pair after the check; look again
+                db.session.rollback()
+                if attempt == RETRIES - 1:
+                    raise
+
+    def _insert(self, batch):
+        table = HeroPower.__table__
+        # (hero_id, power_id) is unique: leave out pairs already stored and
+        # repeats within the batch, as bulk.validate_items does
+        taken = existing_links({entry.row['hero_id'] for entry in batch})
+        written = []
+        for entry in batch:
+            pair = (entry.row['hero_id'], entry.row['power_id'])
+            if pair in taken:
+                entry.error = Conflict()
+                continue
+            taken.add(pair)
+            entry.error = None
+            # One row per execute, so each request gets its own id back
+            entry.id = db.session.execute(table.insert(), entry.row) \
+                .inserted_primary_key[0]
+            written.append(dict(entry.row, id=entry.id))
+        if written and readmodel.enabled():
+            readmodel.refresh_heroes({row['hero_id'] for row in written})
+        changes.record('hero_power', 'create', written)
+
+
+group_commit = GroupCommit()
@@ -0,0 +1,230 @@
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from jsonprovider import FastJSONProvider
+
+# Transaction control that QueryCounter leaves out
+SAVEPOINT_STATEMENTS = ('SAVEPOINT ', 'RELEASE SAVEPOINT ', 'ROLLBACK TO SAVEPOINT ')
+
+
+class QueryCounter:
+    """
+    Counts the SQL statements an engine executes while the block runs.
+
+        with QueryCounter(db.engine) as counter:
+            client.get('/heroes/1')
+        assert counter.count == 2
+
+    The executed statements are kept in ``statements`` so a failing
+    assertion can show what ran, and with their parameters in ``executed``.
+    SAVEPOINT bookkeeping is not counted: the test harness wraps every
+    test in one, and it is not a query of the code being measured.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+        self.executed = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters,
+                               context, executemany):
+        if statement.startswith(SAVEPOINT_STATEMENTS):
+            return
+        self.statements.append(statement)
+        self.executed.append((statement, parameters))
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute',
+                     self._before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute',
+                     self._before_cursor_execute)
+        return False
+
+
+# Upper bounds of the Prometheus histogram buckets
+SECONDS_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# Statements kept per request for the slow-request log
+MAX_LOGGED_STATEMENTS = 20
+
+
+class Histogram:
+    """
+    A Prometheus histogram with one set of buckets per label combination.
+    """
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+            series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted(self._series.items())
+            series = [(labels, list(counts), total, value_sum)
+                      for labels, (counts, total, value_sum) in series]
+        for labels, counts, total, value_sum in series:
+            label_text = ','.join(f'{k}="{v}"' for k, v in labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{{{label_text},le="{le}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {value_sum!r}')
+            lines.append(f'{self.name}_count{{{label_text}}} {total}')
+        return '\n'.join(lines)
+
+
+class RequestStats:
+    # What one request spent its time on; lives on flask.g
+    __slots__ = ('start', 'sql_count', 'sql_time', 'serialization_time', 'statements')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.serialization_time = 0.0
+        self.statements = []
+
+
+def current_stats():
+    if has_request_context():
+        return g.get('_request_stats')
+    return None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_statement(conn, cursor, statement, parameters, context, executemany):
+    if current_stats() is not None:
+        conn.info.setdefault('_query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _end_statement(conn, cursor, statement, parameters, context, executemany):
+    stats = current_stats()
+    starts = conn.info.get('_query_start')
+    if stats is None or not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    stats.sql_count += 1
+    stats.sql_time += elapsed
+    if len(stats.statements) < MAX_LOGGED_STATEMENTS:
+        stats.statements.append((elapsed, statement))
+
+
+class InstrumentedJSONProvider(FastJSONProvider):
+    """
+    JSON provider that adds the time spent encoding response bodies to the
+    current request's serialization time.
+    """
+
+    def encode(self, obj, pretty=False):
+        stats = current_stats()
+        if stats is None:
+            return super().encode(obj, pretty)
+        start = time.perf_counter()
+        try:
+            return super().encode(obj, pretty)
+        finally:
+            stats.serialization_time += time.perf_counter() - start
+
+
+class RequestMetrics:
+    """
+    Records, for every request, wall time, SQL statement count and time,
+    JSON serialization time and response size per route, and exposes them
+    as Prometheus histograms at ``/metrics``.
+
+    Requests slower than ``METRICS_SLOW_REQUEST_MS`` are logged as warnings
+    together with the SQL they ran, slowest first. The per-request cost is a
+    few ``perf_counter()`` calls and one histogram update per metric.
+    """
+
+    def __init__(self, app=None):
+        self.requests = Histogram(
+            'http_request_duration_seconds', 'Wall time per request.', SECONDS_BUCKETS)
+        self.sql_statements = Histogram(
+            'http_request_sql_statements', 'SQL statements per request.', COUNT_BUCKETS)
+        self.sql_time = Histogram(
+            'http_request_sql_seconds', 'Time spent in SQL per request.', SECONDS_BUCKETS)
+        self.serialization = Histogram(
+            'http_request_serialization_seconds', 'Time spent encoding JSON per request.',
+            SECONDS_BUCKETS)
+        self.response_size = Histogram(
+            'http_response_size_bytes', 'Response body size.', BYTES_BUCKETS)
+        self.histograms = (self.requests, self.sql_statements, self.sql_time,
+                           self.serialization, self.response_size)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_SLOW_REQUEST_MS', 500)
+        provider = InstrumentedJSONProvider(app)
+        provider.compact = app.json.compact
+        provider.sort_keys = app.json.sort_keys
+        app.json = provider
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule('/metrics', 'metrics', self.expose)
+        app.extensions['request_metrics'] = self
+
+    def _before_request(self):
+        if request.endpoint != 'metrics':
+            g._request_stats = RequestStats()
+
+    def _after_request(self, response):
+        stats = g.pop('_request_stats', None)
+        if stats is None:
+            return response
+        elapsed = time.perf_counter() - stats.start
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        labels = (('method', request.method), ('route', route))
+
+        self.requests.observe(labels + (('status', str(response.status_code)),), elapsed)
+        self.sql_statements.observe(labels, stats.sql_count)
+        self.sql_time.observe(labels, stats.sql_time)
+        self.serialization.observe(labels, stats.serialization_time)
+        if not response.is_streamed:
+            self.response_size.observe(labels, response.calculate_content_length() or 0)
+
+        if elapsed * 1000 >= current_app.config['METRICS_SLOW_REQUEST_MS']:
+            slowest = sorted(stats.statements, reverse=True)
+            current_app.logger.warning(
+                'slow request %s %s: %.1f ms, %d SQL statements in %.1f ms, '
+                'serialization %.1f ms\n%s',
+                request.method, request.full_path, elapsed * 1000,
+                stats.sql_count, stats.sql_time * 1000,
+                stats.serialization_time * 1000,
+                '\n'.join(f'  {t * 1000:.1f} ms: {s}' for t, s in slowest))
+        return response
+
+    def expose(self):
+        body = '\n'.join(h.expose() for h in self.histograms) + '\n'
+        return Response(body, mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,83 @@
+"""
+JSON encoding for responses.
+
+FastJSONProvider encodes with orjson when it is installed and with the
+standard library otherwise. Responses are compact; a client that wants to
+read one can ask for ``?pretty=1``. Bodies that are already encoded
+(precomputed documents, cached payloads) are wrapped in ``RawJSON`` and
+sent as they are.
+"""
+
+import json
+
+from flask import has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+
+class RawJSON(bytes):
+    """
+    Bytes that already hold a JSON document. ``jsonify(RawJSON(body))``
+    sends ``body`` without decoding and encoding it again.
+    """
+
+
+# Values Flask's default() formats differently from orjson are passed on
+# to it, so both encoders produce the same documents
+ORJSON_OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+                  if orjson is not None else 0)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider using orjson when available.
+
+    ``compact`` keeps Flask's meaning (None: pretty only in debug mode);
+    ``?pretty=1`` on a request asks for indented output regardless.
+    """
+
+    compact = True
+
+    def encode(self, obj, pretty=False):
+        """
+        Returns ``obj`` as UTF-8 encoded JSON.
+        """
+        if orjson is not None:
+            option = ORJSON_OPTIONS
+            if self.sort_keys:
+                option |= orjson.OPT_SORT_KEYS
+            if pretty:
+                option |= orjson.OPT_INDENT_2
+            try:
+                return orjson.dumps(obj, default=self.default, option=option)
+            except TypeError:
+                # e.g. integers wider than 64 bits; the standard library
+                # either copes or raises the usual error
+                pass
+        layout = {'indent': 2} if pretty else {'separators': (',', ':')}
+        return json.dumps(obj, default=self.default, sort_keys=self.sort_keys,
+                          ensure_ascii=self.ensure_ascii, **layout).encode()
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # Callers asking for specific json.dumps() options get them
+            return super().dumps(obj, **kwargs)
+        return self.encode(obj).decode()
+
+    def pretty(self):
+        if has_request_context() and request.args.get('pretty') not in (None, '', '0'):
+            return True
+        return self.compact is False or (self.compact is None and self._app.debug)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = self.pretty()
+        if isinstance(obj, RawJSON):
+            body = self.encode(self.loads(obj), pretty=True) if pretty else obj
+        else:
+            body = self.encode(obj, pretty=pretty)
+        return self._app.response_class(body, mimetype=self.mimetype)
@@ -0,0 +1,340 @@
+"""
+Rate limiting and load shedding for the write routes.
+
+Every write (POST /hero_powers, POST /hero_powers/bulk, PATCH
+/powers/<id>) passes two checks before its view runs:
+
+1. A token bucket per client (remote address): ``WRITE_RATE_LIMIT``
+   writes per second on average, bursts of up to ``WRITE_RATE_BURST``.
+   Over the limit the client gets 429 with ``Retry-After``.
+2. A concurrency limit shared by all clients: at most ``limit`` writes run
+   at once, up to ``WRITE_QUEUE`` more wait up to ``WRITE_QUEUE_TIMEOUT``
+   seconds for a slot, and the rest get 503 with ``Retry-After``. The
+   limit adapts: it grows while writes finish within
+   ``WRITE_LATENCY_TARGET_MS`` and shrinks when they are slower or fail,
+   e.g. with "database is locked".
+
+``LIMITS_BACKEND`` selects where the buckets and slots live: ``memory``
+(default) is per process; ``sqlite:///path/to/limits.db`` is a file
+every worker on the host shares, so the limits hold across gunicorn
+workers. ``none`` turns both checks off. The adaptive limit itself is
+always per process: with the sqlite backend the workers share the slots,
+but each one grows and shrinks its own ``limit`` from the writes it sees.
+
+PATCH /powers/<id> as replayed by the sharding router on shards other
+than shard 0 (see router.py) carries ``REPLICATION_HEADER`` with the
+deployment's ``REPLICATION_TOKEN`` and skips both checks: shard 0's limits
+already admitted the write, and a replica refusing it would leave the
+shards' powers out of step.
+
+Clients are told apart by ``request.remote_addr``. Behind a reverse proxy
+that is the proxy's address, so set ``TRUSTED_PROXIES`` to the number of
+proxies that append to X-Forwarded-For (see create_app in app.py);
+otherwise every client shares one bucket.
+"""
+
+import hmac
+import math
+import os
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, make_response, request
+
+# Requests that never count as writes
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Request header holding REPLICATION_TOKEN on writes replayed by the router
+REPLICATION_HEADER = 'X-Replication-Token'
+
+
+class MemoryBuckets:
+    """
+    Token buckets in a dict, for one process.
+    """
+
+    # Full buckets are dropped after this many takes, to bound memory
+    PURGE_EVERY = 1024
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._takes = 0
+
+    def take(self, key, rate, burst):
+        """
+        Takes one token from ``key``'s bucket. Returns 0 if there was one,
+        otherwise the seconds until there will be.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            self._buckets[key] = (tokens - 1 if wait == 0 else tokens, now)
+            self._takes += 1
+            if self._takes % self.PURGE_EVERY == 0:
+                full = burst / rate
+                for stale in [k for k, (_, t) in self._buckets.items() if now - t >= full]:
+                    del self._buckets[stale]
+        return wait
+
+
+class LocalSlots:
+    """
+    Write slots for one process: a counter and a condition variable.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+
+    def acquire(self, limit, max_queue, timeout):
+        """
+        Takes a slot when fewer than ``limit()`` are in use, waiting up to
+        ``timeout`` seconds in a queue of at most ``max_queue``. Returns a
+        token for release(), or None if the write should be shed.
+        """
+        with self._condition:
+            if self.active < limit():
+                self.active += 1
+                return True
+            if self.waiting >= max_queue:
+                return None
+            self.waiting += 1
+            try:
+                if not self._condition.wait_for(lambda: self.active < limit(), timeout):
+                    return None
+            finally:
+                self.waiting -= 1
+            self.active += 1
+            return True
+
+    def release(self, token):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+
+class SQLiteStore:
+    # One connection per thread and process, as in cache.SQLiteCache
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+
+class SQLiteBuckets(SQLiteStore):
+    """
+    Token buckets in a SQLite file shared by every worker on the host.
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS rate_buckets ('
+            ' key TEXT PRIMARY KEY, tokens REAL, updated REAL) WITHOUT ROWID')
+
+    def take(self, key, rate, burst):
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            # IMMEDIATE takes the write lock up front, so two workers
+            # cannot both spend the same token
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT tokens, updated FROM rate_buckets WHERE key = ?',
+                               (key,)).fetchone()
+            tokens, updated = row if row is not None else (burst, now)
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            conn.execute('INSERT OR REPLACE INTO rate_buckets VALUES (?, ?, ?)',
+                         (key, tokens - 1 if wait == 0 else tokens, now))
+        return wait
+
+
+class SQLiteSlots(SQLiteStore):
+    """
+    Write slots shared by every worker on the host. Each running or queued
+    write holds a lease row; leases of crashed workers expire after
+    ``LEASE`` seconds. Queued writes poll for a free slot.
+    """
+
+    LEASE = 60
+    POLL = (0.002, 0.05)  # first and longest sleep between polls
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS write_slots ('
+            ' id INTEGER PRIMARY KEY, active INTEGER, expires REAL)')
+
+    def _try(self, lease, limit, max_queue):
+        # Returns 'active', 'waiting' or None (shed), and the lease id
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM write_slots WHERE expires < ?', (now,))
+            active, waiting = conn.execute(
+                'SELECT COALESCE(SUM(active), 0), COALESCE(SUM(1 - active), 0)'
+                ' FROM write_slots').fetchone()
+            if lease is not None:
+                waiting -= 1
+            if active < limit():
+                if lease is None:
+                    lease = conn.execute('INSERT INTO write_slots VALUES (NULL, 1, ?)',
+                                         (now + self.LEASE,)).lastrowid
+                else:
+                    conn.execute('UPDATE write_slots SET active = 1, expires = ?'
+                                 ' WHERE id = ?', (now + self.LEASE, lease))
+                return 'active', lease
+            if lease is None:
+                if waiting >= max_queue:
+                    return None, None
+                lease = conn.execute('INSERT INTO write_slots VALUES (NULL, 0, ?)',
+                                     (now + self.LEASE,)).lastrowid
+            return 'waiting', lease
+
+    def acquire(self, limit, max_queue, timeout):
+        deadline = time.monotonic() + timeout
+        delay, longest = self.POLL
+        state, lease = self._try(None, limit, max_queue)
+        while state == 'waiting':
+            if time.monotonic() >= deadline:
+                self.release(lease)
+                return None
+            time.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+            delay = min(delay * 2, longest)
+            state, lease = self._try(lease, limit, max_queue)
+        return lease if state == 'active' else None
+
+    def release(self, token):
+        self._connect().execute('DELETE FROM write_slots WHERE id = ?', (token,))
+
+
+class AdaptiveLimit:
+    """
+    Additive-increase, multiplicative-decrease concurrency limit. Each
+    write that finishes within ``target`` seconds adds ``1/limit`` (so one
+    slot per round of writes); a slower or failed write multiplies the
+    limit by ``backoff``.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=32, target=0.05, backoff=0.75):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target = target
+        self.backoff = backoff
+        self._value = float(initial)
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        return max(self.minimum, int(self._value))
+
+    def update(self, latency, ok):
+        with self._lock:
+            if ok and latency <= self.target:
+                self._value = min(self.maximum, self._value + 1 / self._value)
+            else:
+                self._value = max(self.minimum, self._value * self.backoff)
+
+
+def backends_from_config(config):
+    spec = config.get('LIMITS_BACKEND', 'memory')
+    if spec in (None, '', 'none'):
+        return None, None
+    if spec == 'memory':
+        return MemoryBuckets(), LocalSlots()
+    if spec.startswith('sqlite:///'):
+        path = spec[len('sqlite:///'):]
+        return SQLiteBuckets(path), SQLiteSlots(path)
+    raise ValueError(f"unknown LIMITS_BACKEND {spec!r}")
+
+
+def too_many(status, message, retry_after):
+    response = make_response({"errors": [message]}, status)
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+class Limits:
+    """
+    One app's limiter settings and state, in ``app.extensions['write_limiter']``.
+    """
+
+    def __init__(self, config):
+        self.buckets, self.slots = backends_from_config(config)
+        self.rate = float(config.setdefault('WRITE_RATE_LIMIT', 20))
+        self.burst = float(config.setdefault('WRITE_RATE_BURST', 40))
+        self.limit = AdaptiveLimit(
+            initial=config.setdefault('WRITE_CONCURRENCY', 4),
+            maximum=config.setdefault('WRITE_CONCURRENCY_MAX', 16),
+            target=config.setdefault('WRITE_LATENCY_TARGET_MS', 50) / 1000)
+        self.max_queue = config.setdefault('WRITE_QUEUE', 32)
+        self.queue_timeout = config.setdefault('WRITE_QUEUE_TIMEOUT', 2.0)
+        self.replication_token = config.get('REPLICATION_TOKEN')
+
+    def replicated(self):
+        # Whether the request is a write the router replays, see above
+        token = request.headers.get(REPLICATION_HEADER)
+        return bool(self.replication_token) and token is not None \
+            and hmac.compare_digest(token, self.replication_token)
+
+
+class WriteLimiter:
+    """
+    Applies the per-client rate limit and the adaptive concurrency limit
+    to the views it decorates with ``limited``, using the limits of the
+    app handling the request.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['write_limiter'] = Limits(app.config)
+
+    def limited(self, view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            limits = current_app.extensions.get('write_limiter')
+            if (request.method in READ_METHODS or limits is None or limits.slots is None
+                    or limits.replicated()):
+                return view(**kwargs)
+
+            if limits.rate > 0:
+                wait = limits.buckets.take(request.remote_addr or '', limits.rate, limits.burst)
+                if wait > 0:
+                    return too_many(429, "Too many requests", wait)
+
+            token = limits.slots.acquire(limits.limit, limits.max_queue, limits.queue_timeout)
+            if token is None:
+                return too_many(503, "Server busy, retry later", limits.queue_timeout)
+            start = time.perf_counter()
+            # An exception (e.g. "database is locked") counts as a failure
+            ok = False
+            try:
+                response = make_response(view(**kwargs))
+                ok = response.status_code < 500
+                return response
+            finally:
+                limits.slots.release(token)
+                limits.limit.update(time.perf_counter() - start, ok)
+        return wrapper
+
+
+write_limiter = WriteLimiter()
@@ -0,0 +1,56 @@
+"""autoincrement hero_powers
+
+Revision ID: 1ed07b693d37
+Revises: 1820fe039935
+Create Date: 2026-10-18 14:20:05.413207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1ed07b693d37'
+down_revision = '1820fe039935'
+branch_labels = None
+depends_on = None
+
+
+def count(name, delta):
+    return (f"INSERT INTO counters (name, value) VALUES ({name}, {delta}) "
+            f"ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;")
+
+
+def count_link(row, delta):
+    return (f"INSERT INTO power_strength_counts (power_id, strength, heroes) "
+            f"VALUES ({row}.power_id, {row}.strength, {delta}) "
+            f"ON CONFLICT (power_id, strength) DO UPDATE SET heroes = heroes + excluded.heroes; "
+            + count("'hero_powers'", delta) + ' '
+            + count(f"'strength:' || {row}.strength", delta))
+
+
+def recreate(autoincrement):
+    # SQLite only sets AUTOINCREMENT in CREATE TABLE, so the table is
+    # copied into a new one; its triggers go with the old table
+    with op.batch_alter_table('hero_powers', recreate='always',
+                              table_kwargs={'sqlite_autoincrement': autoincrement}):
+        pass
+    op.execute(f"CREATE TRIGGER hero_powers_count_ai AFTER INSERT ON hero_powers "
+               f"BEGIN {count_link('new', 1)} END")
+    op.execute(f"CREATE TRIGGER hero_powers_count_ad AFTER DELETE ON hero_powers "
+               f"BEGIN {count_link('old', -1)} END")
+    op.execute(f"CREATE TRIGGER hero_powers_count_au "
+               f"AFTER UPDATE OF power_id, strength ON hero_powers "
+               f"BEGIN {count_link('old', -1)} {count_link('new', 1)} END")
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    recreate(True)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    recreate(False)
@@ -0,0 +1,61 @@
+"""full-text search on heroes and powers
+
+Revision ID: de76df17f76a
+Revises: 487e0002ab88
+Create Date: 2026-10-18 13:03:32.537389
+
+"""
+import sqlite3
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'de76df17f76a'
+down_revision = '487e0002ab88'
+branch_labels = None
+depends_on = None
+
+
+# Substring matching needs the trigram tokenizer (SQLite 3.34+); older
+# SQLite falls back to word-prefix matching
+TOKENIZE = ("tokenize='trigram'" if sqlite3.sqlite_version_info >= (3, 34, 0)
+            else "prefix='1 2 3'")
+
+# base table: (fts table, indexed columns)
+FTS_TABLES = {
+    'heroes': ('heroes_fts', ('name', 'super_name')),
+    'powers': ('powers_fts', ('name', 'description')),
+}
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for table, (fts, columns) in FTS_TABLES.items():
+        cols = ', '.join(columns)
+        new = ', '.join(f'new.{c}' for c in columns)
+        old = ', '.join(f'old.{c}' for c in columns)
+        op.execute(f"CREATE VIRTUAL TABLE {fts} USING fts5({cols}, "
+                   f"content='{table}', content_rowid='id', {TOKENIZE})")
+        op.execute(f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN "
+                   f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END")
+        op.execute(f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+                   f"INSERT INTO {fts}({fts}, rowid, {cols}) "
+                   f"VALUES ('delete', old.id, {old}); END")
+        op.execute(f"CREATE TRIGGER {fts}_au AFTER UPDATE ON {table} BEGIN "
+                   f"INSERT INTO {fts}({fts}, rowid, {cols}) "
+                   f"VALUES ('delete', old.id, {old}); "
+                   f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END")
+        # Index the rows that are already there
+        op.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for fts, _ in FTS_TABLES.values():
+        for suffix in ('ai', 'ad', 'au'):
+            op.execute(f"DROP TRIGGER IF EXISTS {fts}_{suffix}")
+        op.execute(f"DROP TABLE IF EXISTS {fts}")
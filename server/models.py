@@ -1,14 +1,22 @@
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import MetaData
-from sqlalchemy.orm import validates
+import sqlite3
+
+from sqlalchemy import DDL, MetaData, event
+from sqlalchemy.orm import selectinload, validates
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy_serializer import SerializerMixin
 
+from database import Database
+
 metadata = MetaData(naming_convention={
     "fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s",
+    "uq": "uq_%(table_name)s_%(column_0_N_name)s",
+    "ix": "ix_%(table_name)s_%(column_0_N_name)s",
 })
 
-db = SQLAlchemy(metadata=metadata)
+db = Database(metadata=metadata)
+
+# The values HeroPower.strength may take
+STRENGTHS = ('Strong', 'Weak', 'Average')
 
 
 # Hero Model
@@ -39,6 +47,8 @@ class Power(db.Model, SerializerMixin):
     id = db.Column(db.Integer, primary_key=True)  
     name = db.Column(db.String)  
     description = db.Column(db.String) 
+    # Bumped by every UPDATE; sent to clients as the ETag, see concurrency.py
+    version = db.Column(db.Integer, nullable=False, server_default='1')
 
     # Relationship to HeroPower model
     hero_powers = db.relationship('HeroPower', 
@@ -47,7 +57,12 @@ class Power(db.Model, SerializerMixin):
 
     # Serialization rules
     # When serializing a power object, remove the hero_powers column
-    serialize_rules = ('-hero_powers',)
+    # (the version travels in the ETag header, not the body)
+    serialize_rules = ('-hero_powers', '-version')
+
+    # The ORM checks and increments version on each flush, so an UPDATE
+    # that lost a race fails instead of overwriting the other write
+    __mapper_args__ = {'version_id_col': version}
 
     # Validation for description
     @validates('description')
@@ -60,6 +75,16 @@ class Power(db.Model, SerializerMixin):
 
 class HeroPower(db.Model, SerializerMixin):
     __tablename__ = 'hero_powers'
+    __table_args__ = (
+        # A hero holds each power once. The constraint's index also serves
+        # the hero -> hero_powers lookups of /heroes/<id>.
+        db.UniqueConstraint('hero_id', 'power_id'),
+        # Covers "which heroes hold this power" without touching the table
+        db.Index(None, 'power_id', 'hero_id'),
+        # AUTOINCREMENT: ids are never reused, and each shard of a sharded
+        # deployment hands out ids from its own range (shards.py)
+        {'sqlite_autoincrement': True},
+    )
     id = db.Column(db.Integer, primary_key=True)  
     strength = db.Column(db.String, nullable=False) 
     hero_id = db.Column(db.Integer, db.ForeignKey('heroes.id')) 
@@ -78,10 +103,216 @@ class HeroPower(db.Model, SerializerMixin):
     serialize_rules = ('-heroes.hero_powers', '-power.hero_powers',)
     @validates('strength')
     def validate_strength(self, key, value):
-        if value not in ['Strong', 'Weak', 'Average']:
+        if value not in STRENGTHS:
             raise ValueError 
         return value
 
     def __repr__(self):
         return f'<HeroPower {self.id}>'
-   
\ No newline at end of file
+
+
+class HeroDocument(db.Model):
+    """
+    The encoded body of GET /heroes/<id>, kept per hero by readmodel.py.
+    """
+    __tablename__ = 'hero_documents'
+    hero_id = db.Column(db.Integer, db.ForeignKey('heroes.id'), primary_key=True)
+    body = db.Column(db.LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return f'<HeroDocument {self.hero_id}>'
+
+
+class Change(db.Model):
+    """
+    One write to a power or a hero_power, numbered in commit order, for the
+    change feed in changes.py.
+    """
+    __tablename__ = 'changes'
+    # AUTOINCREMENT: sequence numbers are never reused, even after pruning
+    __table_args__ = {'sqlite_autoincrement': True}
+    seq = db.Column(db.Integer, primary_key=True)
+    resource = db.Column(db.String, nullable=False)
+    resource_id = db.Column(db.Integer, nullable=False)
+    action = db.Column(db.String, nullable=False)
+    # The resource as the API returns it, already encoded
+    data = db.Column(db.LargeBinary, nullable=False)
+    created = db.Column(db.Float, nullable=False)
+
+    def __repr__(self):
+        return f'<Change {self.seq}>'
+
+
+class Counter(db.Model):
+    """
+    A count kept up to date by triggers on the counted tables, see
+    counter_ddl() and stats.py. Names are the table names and
+    ``strength:<strength>`` for hero_powers at each strength.
+    """
+    __tablename__ = 'counters'
+    name = db.Column(db.String, primary_key=True)
+    value = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<Counter {self.name}={self.value}>'
+
+
+class PowerStrengthCount(db.Model):
+    """
+    How many heroes hold a power at a strength, kept up to date by triggers
+    on hero_powers.
+    """
+    __tablename__ = 'power_strength_counts'
+    power_id = db.Column(db.Integer, primary_key=True)
+    strength = db.Column(db.String, primary_key=True)
+    heroes = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<PowerStrengthCount {self.power_id} {self.strength}={self.heroes}>'
+
+
+# Loader options for serializing a hero with its powers.
+# hero_powers is a collection, so it is fetched with one extra SELECT ... IN
+# (selectinload); each HeroPower.power is many-to-one, so it is joined onto
+# that same SELECT (joinedload). The hero detail costs two statements no
+# matter how many powers the hero has.
+HERO_DETAIL_OPTIONS = (
+    selectinload(Hero.hero_powers).joinedload(HeroPower.power),
+)
+
+
+# Full-text search indexes (SQLite FTS5) over the searchable columns.
+# They are external-content tables: the text lives only in heroes/powers
+# and the triggers below keep the index in step with every insert, update
+# and delete. The trigram tokenizer (SQLite 3.34+) matches any substring of
+# three or more characters; older SQLite gets word-prefix matching.
+FTS_TRIGRAM = sqlite3.sqlite_version_info >= (3, 34, 0)
+FTS_TOKENIZE = "tokenize='trigram'" if FTS_TRIGRAM else "prefix='1 2 3'"
+
+FTS_TABLES = {
+    # base table: (fts table, indexed columns)
+    'heroes': ('heroes_fts', ('name', 'super_name')),
+    'powers': ('powers_fts', ('name', 'description')),
+}
+
+
+def fts_ddl(table):
+    """
+    Returns the statements that create ``table``'s FTS5 index and its sync
+    triggers, and fill the index from the rows already in ``table``.
+    """
+    fts, columns = FTS_TABLES[table]
+    cols = ', '.join(columns)
+    new = ', '.join(f'new.{c}' for c in columns)
+    old = ', '.join(f'old.{c}' for c in columns)
+    return [
+        f"CREATE VIRTUAL TABLE {fts} USING fts5({cols}, content='{table}', "
+        f"content_rowid='id', {FTS_TOKENIZE})",
+        f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END",
+        f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); END",
+        f"CREATE TRIGGER {fts}_au AFTER UPDATE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END",
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ]
+
+
+def fts_drop_ddl(table):
+    fts, _ = FTS_TABLES[table]
+    return [f"DROP TRIGGER IF EXISTS {fts}_{suffix}" for suffix in ('ai', 'ad', 'au')] \
+        + [f"DROP TABLE IF EXISTS {fts}"]
+
+
+for _model in (Hero, Power):
+    for _statement in fts_ddl(_model.__tablename__):
+        event.listen(_model.__table__, 'after_create',
+                     DDL(_statement).execute_if(dialect='sqlite'))
+    for _statement in fts_drop_ddl(_model.__tablename__):
+        event.listen(_model.__table__, 'before_drop',
+                     DDL(_statement).execute_if(dialect='sqlite'))
+
+
+# Counters for the statistics endpoints (stats.py), kept by SQLite
+# triggers so every write path (the API, bulk inserts, ORM cascades, raw
+# SQL) moves them in the same transaction. Other databases have no
+# triggers here and stats.py counts with GROUP BY instead.
+def _count(name, delta):
+    return (f"INSERT INTO counters (name, value) VALUES ({name}, {delta}) "
+            f"ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;")
+
+
+def _count_link(row, delta):
+    # One hero_power added (+1) or removed (-1)
+    return (f"INSERT INTO power_strength_counts (power_id, strength, heroes) "
+            f"VALUES ({row}.power_id, {row}.strength, {delta}) "
+            f"ON CONFLICT (power_id, strength) DO UPDATE SET heroes = heroes + excluded.heroes; "
+            + _count("'hero_powers'", delta) + ' '
+            + _count(f"'strength:' || {row}.strength", delta))
+
+
+def counter_recompute_ddl():
+    """
+    Returns the statements that recount every counter from the tables.
+    """
+    return [
+        "DELETE FROM counters",
+        "DELETE FROM power_strength_counts",
+        "INSERT INTO counters (name, value) "
+        "SELECT 'heroes', count(*) FROM heroes UNION ALL "
+        "SELECT 'powers', count(*) FROM powers UNION ALL "
+        "SELECT 'hero_powers', count(*) FROM hero_powers",
+        "INSERT INTO counters (name, value) "
+        "SELECT 'strength:' || strength, count(*) FROM hero_powers GROUP BY strength",
+        "INSERT INTO power_strength_counts (power_id, strength, heroes) "
+        "SELECT power_id, strength, count(*) FROM hero_powers GROUP BY power_id, strength",
+    ]
+
+
+def counter_ddl():
+    """
+    Returns the statements that create the counter triggers and fill the
+    counters from the rows already in the tables.
+    """
+    statements = []
+    for table in ('heroes', 'powers'):
+        name = f"'{table}'"
+        statements += [
+            f"CREATE TRIGGER IF NOT EXISTS {table}_count_ai AFTER INSERT ON {table} "
+            f"BEGIN {_count(name, 1)} END",
+            f"CREATE TRIGGER IF NOT EXISTS {table}_count_ad AFTER DELETE ON {table} "
+            f"BEGIN {_count(name, -1)} END",
+        ]
+    statements += [
+        "CREATE TRIGGER IF NOT EXISTS powers_count_stats_ad AFTER DELETE ON powers "
+        "BEGIN DELETE FROM power_strength_counts WHERE power_id = old.id; END",
+        f"CREATE TRIGGER IF NOT EXISTS hero_powers_count_ai AFTER INSERT ON hero_powers "
+        f"BEGIN {_count_link('new', 1)} END",
+        f"CREATE TRIGGER IF NOT EXISTS hero_powers_count_ad AFTER DELETE ON hero_powers "
+        f"BEGIN {_count_link('old', -1)} END",
+        f"CREATE TRIGGER IF NOT EXISTS hero_powers_count_au "
+        f"AFTER UPDATE OF power_id, strength ON hero_powers "
+        f"BEGIN {_count_link('old', -1)} {_count_link('new', 1)} END",
+    ]
+    return statements + counter_recompute_ddl()
+
+
+COUNTER_TRIGGERS = ('heroes_count_ai', 'heroes_count_ad', 'powers_count_ai',
+                    'powers_count_ad', 'powers_count_stats_ad', 'hero_powers_count_ai',
+                    'hero_powers_count_ad', 'hero_powers_count_au')
+
+
+def counter_drop_ddl():
+    return [f"DROP TRIGGER IF EXISTS {name}" for name in COUNTER_TRIGGERS]
+
+
+def _creating_counters(ddl, target, bind, tables=None, **kw):
+    # The triggers go on three other tables, so they are created once the
+    # whole schema is, and only when create_all() made the counters table
+    return tables is None or Counter.__table__ in tables
+
+
+for _statement in counter_ddl():
+    event.listen(metadata, 'after_create',
+                 DDL(_statement).execute_if(dialect='sqlite', callable_=_creating_counters))
@@ -0,0 +1,151 @@
+from urllib.parse import urlencode
+
+from flask import Response, current_app, jsonify, request, stream_with_context
+
+from models import db
+
+# Largest page a client may ask for with ?limit=
+MAX_LIMIT = 1000
+# Rows fetched per round-trip from the server-side cursor when streaming
+STREAM_CHUNK = 1000
+
+
+class PaginationError(ValueError):
+    pass
+
+
+def _int_arg(name, minimum, maximum=None):
+    # Read an integer query parameter, or None if it was not supplied
+    raw = request.args.get(name)
+    if raw is None or raw == '':
+        return None
+    try:
+        value = int(raw)
+    except ValueError:
+        raise PaginationError(f"{name} must be an integer")
+    if value < minimum or (maximum is not None and value > maximum):
+        if maximum is None:
+            raise PaginationError(f"{name} must be at least {minimum}")
+        raise PaginationError(f"{name} must be between {minimum} and {maximum}")
+    return value
+
+
+def page_args():
+    """
+    Returns (limit, after) from the query string.
+
+    Both are None when the client did not ask for pagination, in which
+    case the whole collection is returned as before.
+    """
+    limit = _int_arg('limit', 1, MAX_LIMIT)
+    after = _int_arg('after', 0)
+    if after is not None and limit is None:
+        limit = MAX_LIMIT
+    return limit, after
+
+
+def accepts_ndjson():
+    # Whether the client asked for NDJSON with Accept rather than ?stream=
+    return request.accept_mimetypes.best == 'application/x-ndjson'
+
+
+def stream_format():
+    """
+    Returns 'json' or 'ndjson' when the client opted into streaming,
+    otherwise None.
+    """
+    fmt = request.args.get('stream')
+    if fmt is None and accepts_ndjson():
+        fmt = 'ndjson'
+    if fmt in (None, ''):
+        return None
+    if fmt in ('1', 'true', 'json'):
+        return 'json'
+    if fmt == 'ndjson':
+        return 'ndjson'
+    raise PaginationError("stream must be json or ndjson")
+
+
+def keyset_page(columns, key, limit, after, filters=()):
+    """
+    Fetches one page of rows ordered by ``key``, starting after the
+    cursor ``after``.
+
+    Returns (rows, next_cursor). One extra row is read to find out whether
+    another page exists, so no COUNT(*) is needed.
+    """
+    query = db.session.query(*columns).filter(*filters).order_by(key)
+    if after is not None:
+        query = query.filter(key > after)
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1].id
+    return rows, next_cursor
+
+
+def link_header(next_cursor, limit):
+    # Build an RFC 8288 Link header pointing at the next page
+    args = request.args.to_dict()
+    args['limit'] = limit
+    args['after'] = next_cursor
+    return f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+
+
+def paginated_response(rows, next_cursor, limit, to_dict):
+    """
+    Returns the page as a JSON array. The cursor for the next page is sent
+    in the ``Link`` and ``X-Next-Cursor`` headers so the body keeps the
+    same shape as an unpaginated listing.
+    """
+    response = jsonify([to_dict(row) for row in rows])
+    if next_cursor is not None:
+        response.headers['Link'] = link_header(next_cursor, limit)
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    return response
+
+
+def streamed_response(columns, key, to_dict, fmt, after=None, filters=()):
+    """
+    Streams every row ordered by ``key`` as a JSON array or as NDJSON.
+
+    Rows are pulled from a server-side cursor ``STREAM_CHUNK`` at a time
+    with ``yield_per``, so memory use does not grow with the table.
+    """
+    query = db.session.query(*columns).filter(*filters).order_by(key)
+    if after is not None:
+        query = query.filter(key > after)
+    query = query.execution_options(stream_results=True).yield_per(STREAM_CHUNK)
+    # Compact bytes from the app's JSON provider (orjson when installed)
+    dumps = current_app.json.encode
+
+    def generate_ndjson():
+        buffer = []
+        for row in query:
+            buffer.append(dumps(to_dict(row)))
+            if len(buffer) >= STREAM_CHUNK:
+                yield b'\n'.join(buffer) + b'\n'
+                buffer = []
+        if buffer:
+            yield b'\n'.join(buffer) + b'\n'
+
+    def generate_json():
+        yield b'['
+        first = True
+        buffer = []
+        for row in query:
+            buffer.append(dumps(to_dict(row)))
+            if len(buffer) >= STREAM_CHUNK:
+                yield (b'' if first else b',') + b','.join(buffer)
+                first = False
+                buffer = []
+        if buffer:
+            yield (b'' if first else b',') + b','.join(buffer)
+        yield b']'
+
+    if fmt == 'ndjson':
+        return Response(stream_with_context(generate_ndjson()),
+                        mimetype='application/x-ndjson')
+    return Response(stream_with_context(generate_json()),
+                    mimetype='application/json')
@@ -0,0 +1,207 @@
+"""
+Materialized read model for GET /heroes/<id>.
+
+With ``HERO_READ_MODEL=1`` the detail JSON of every hero is kept, already
+encoded, in the hero_documents table, and /heroes/<id> serves those bytes
+with one primary-key lookup instead of joining heroes, hero_powers and
+powers and serializing the result on every request.
+
+The write paths update the documents in the same transaction as the
+change itself:
+
+- POST /hero_powers and /hero_powers/bulk recompute the documents of the
+  heroes they gave a power
+- PATCH /powers/<id> replaces the power inside the documents of the heroes
+  that hold it
+
+A hero without a document is served from the live join. Changes made
+behind the API's back (seed.py, manual SQL, or writes made while the read
+model was switched off) leave documents stale;
+
+    flask read-model rebuild    recomputes every document
+    flask read-model check      compares them with the live join
+"""
+
+import json
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, Hero, HeroDocument, HeroPower, HERO_DETAIL_OPTIONS
+from serializers import hero_detail, power_summary
+
+# Heroes loaded per query, well under SQLite's bound-parameter limit
+CHUNK = 500
+
+encode = json.JSONEncoder(separators=(',', ':'), sort_keys=True).encode
+
+# INSERT ... ON CONFLICT DO UPDATE for the backends DB_URI may point at
+UPSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def enabled():
+    return current_app.config.get('HERO_READ_MODEL', False)
+
+
+def encode_hero(hero):
+    return encode(hero_detail(hero)).encode()
+
+
+def get_document(hero_id):
+    return db.session.query(HeroDocument.body) \
+        .filter(HeroDocument.hero_id == hero_id).scalar()
+
+
+def get_documents(hero_ids):
+    # {hero_id: body} for the heroes among hero_ids that have a document
+    hero_ids = sorted(set(hero_ids))
+    documents = {}
+    for start in range(0, len(hero_ids), CHUNK):
+        documents.update(db.session.query(HeroDocument.hero_id, HeroDocument.body)
+                         .filter(HeroDocument.hero_id.in_(hero_ids[start:start + CHUNK])))
+    return documents
+
+
+def live_documents(hero_ids):
+    # Yields (hero_id, body) for the heroes among hero_ids, from the join
+    hero_ids = sorted(set(hero_ids))
+    for start in range(0, len(hero_ids), CHUNK):
+        heroes = Hero.query.options(*HERO_DETAIL_OPTIONS) \
+            .filter(Hero.id.in_(hero_ids[start:start + CHUNK])) \
+            .populate_existing()
+        for hero in heroes:
+            yield hero.id, encode_hero(hero)
+
+
+def refresh_heroes(hero_ids):
+    """
+    Recomputes the documents of ``hero_ids`` from the live join. The
+    caller commits.
+    """
+    rows = [{'hero_id': hero_id, 'body': body}
+            for hero_id, body in live_documents(hero_ids)]
+    if not rows:
+        return
+    table = HeroDocument.__table__
+    insert = UPSERTS[db.engine.dialect.name](table)
+    db.session.execute(
+        insert.on_conflict_do_update(index_elements=[table.c.hero_id],
+                                     set_={'body': insert.excluded.body}),
+        rows)
+
+
+def update_power(power):
+    """
+    Replaces ``power`` (anything with id, name and description) in the
+    document of every hero that holds it. The caller commits.
+    """
+    summary = power_summary(power)
+    documents = db.session.query(HeroDocument.hero_id, HeroDocument.body) \
+        .join(HeroPower, HeroPower.hero_id == HeroDocument.hero_id) \
+        .filter(HeroPower.power_id == power.id)
+
+    rows = []
+    for hero_id, body in documents:
+        document = json.loads(body)
+        for hero_power in document['hero_powers']:
+            if hero_power['power_id'] == power.id:
+                hero_power['power'] = summary
+        rows.append({'document_id': hero_id, 'document': encode(document).encode()})
+    if rows:
+        table = HeroDocument.__table__
+        db.session.execute(
+            update(table).where(table.c.hero_id == bindparam('document_id'))
+            .values(body=bindparam('document')),
+            rows)
+
+
+def hero_id_chunks(chunk):
+    # Every hero id, in keyset-paginated chunks
+    last = 0
+    while True:
+        ids = [id for id, in db.session.query(Hero.id).filter(Hero.id > last)
+               .order_by(Hero.id).limit(chunk)]
+        if not ids:
+            return
+        yield ids
+        last = ids[-1]
+
+
+def orphaned_documents():
+    # Documents whose hero no longer exists
+    return db.session.query(HeroDocument.hero_id) \
+        .outerjoin(Hero, Hero.id == HeroDocument.hero_id).filter(Hero.id.is_(None))
+
+
+def rebuild(chunk=CHUNK):
+    """
+    Recomputes every document, committing one chunk of heroes at a time.
+    Returns the number of documents written.
+    """
+    orphans = [hero_id for hero_id, in orphaned_documents()]
+    if orphans:
+        db.session.query(HeroDocument).filter(HeroDocument.hero_id.in_(orphans)) \
+            .delete(synchronize_session=False)
+    total = 0
+    for ids in hero_id_chunks(chunk):
+        refresh_heroes(ids)
+        db.session.commit()
+        total += len(ids)
+    return total
+
+
+def canonical(body):
+    # hero_powers come back in no particular order, so compare them sorted
+    document = json.loads(body)
+    document['hero_powers'].sort(key=lambda hero_power: hero_power['id'])
+    return document
+
+
+def check(hero_ids=None, chunk=CHUNK):
+    """
+    Compares the documents of ``hero_ids`` (default: every hero) with the
+    live join. Returns the ids of heroes whose document is missing, the
+    ids whose document differs, and the ids of documents without a hero.
+    """
+    missing, stale = [], []
+    chunks = hero_id_chunks(chunk) if hero_ids is None \
+        else (hero_ids[i:i + chunk] for i in range(0, len(hero_ids), chunk))
+    for ids in chunks:
+        stored = dict(db.session.query(HeroDocument.hero_id, HeroDocument.body)
+                      .filter(HeroDocument.hero_id.in_(ids)))
+        for hero_id, body in live_documents(ids):
+            if hero_id not in stored:
+                missing.append(hero_id)
+            elif canonical(stored[hero_id]) != canonical(body):
+                stale.append(hero_id)
+    orphaned = [hero_id for hero_id, in orphaned_documents()] if hero_ids is None else []
+    return missing, stale, orphaned
+
+
+read_model_cli = AppGroup('read-model', help="Manage the hero detail read model.")
+
+
+@read_model_cli.command('rebuild')
+@click.option('--chunk-size', default=CHUNK, show_default=True)
+def rebuild_command(chunk_size):
+    """Recompute every hero document from the live tables."""
+    start = time.perf_counter()
+    count = rebuild(chunk_size)
+    click.echo(f"Rebuilt {count} hero documents in {time.perf_counter() - start:.1f}s")
+
+
+@read_model_cli.command('check')
+def check_command():
+    """Compare every hero document with the live tables."""
+    missing, stale, orphaned = check()
+    for label, ids in (('missing', missing), ('stale', stale), ('orphaned', orphaned)):
+        if ids:
+            shown = ', '.join(map(str, ids[:20])) + (', ...' if len(ids) > 20 else '')
+            click.echo(f"{len(ids)} {label} documents: {shown}")
+    if missing or stale or orphaned:
+        raise SystemExit(1)
+    click.echo("Hero documents match the live tables")
@@ -0,0 +1,571 @@
+"""
+Router in front of a sharded deployment, see shards.py.
+
+    flask shards serve --dir shards/ --port 5555
+
+Clients talk to the router as they would to app.py. Requests for one hero
+(GET /heroes/<id>, POST /hero_powers) go to the shard that owns the hero.
+GET /heroes asks every shard at once and merges their rows by id, for
+pages (``limit``/``after``) and streams as well. Reads of powers go to the
+shards in turn, as each holds all of them; PATCH /powers/<id> is applied
+to shard 0 first and then to the others, past their write limits. A shard
+that fails to take it leaves the powers rotation until its /powers has
+matched shard 0's for ``RESPONSE_CACHE_TTL``, e.g. after ``flask shards
+sync-powers``; its heroes' details still show the old power. /stats adds up the shards' counts.
+
+POST /hero_powers/bulk sends each shard its own items in parallel: every
+shard inserts its part in one transaction, but a bulk spanning several
+shards is not atomic as a whole. The change feed is kept per shard and is
+not available through the router.
+
+The router keeps keep-alive connections to the shards, held by the
+threads of one pool that every shard request goes through.
+"""
+
+import heapq
+import http.client
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit
+
+from flask import (Blueprint, Flask, Response, current_app, jsonify,
+                   make_response, request, stream_with_context)
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException
+
+import batch
+from bulk import BulkError, parse_items
+from compression import Compression, config_from_env as compression_config
+from jsonprovider import FastJSONProvider, RawJSON
+from limits import REPLICATION_HEADER
+import pagination
+from pagination import PaginationError, stream_format
+from shards import shard_for
+
+logger = logging.getLogger(__name__)
+
+# Request headers passed on to the shards, and response headers passed back
+FORWARD_HEADERS = ('Content-Type', 'Accept', 'If-Match', 'If-None-Match')
+RETURN_HEADERS = ('Content-Type', 'ETag', 'Retry-After', 'Cache-Control')
+
+# Seconds between checks whether shards out of the powers rotation are
+# back in step with shard 0
+RECHECK_SECONDS = 10
+
+# Lost keep-alive connections; a GET that fails with one is sent again
+RETRYABLE = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+ShardResponse = namedtuple('ShardResponse', 'status headers body')
+
+
+class ShardError(Exception):
+    pass
+
+
+class ShardClient:
+    """
+    HTTP client for the shards at ``urls``, in shard order.
+    """
+
+    def __init__(self, urls, workers=32, timeout=30, cache_ttl=60):
+        self.addresses = [(urlsplit(url).hostname, urlsplit(url).port) for url in urls]
+        self.timeout = timeout
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='shard')
+        self.local = threading.local()
+        self.turns = itertools.count()
+        # PATCH /powers/<id> reaches the shards one at a time, in order
+        self.powers_lock = threading.Lock()
+        # Shards that missed a PATCH /powers/<id>, each with the time it
+        # may rejoin once in step (None while it is not), and when to look
+        self.stale = {}
+        self.stale_lock = threading.Lock()
+        self.recheck = RECHECK_SECONDS
+        self.next_check = 0.0
+        # The shards' RESPONSE_CACHE_TTL
+        self.cache_ttl = cache_ttl
+
+    @property
+    def count(self):
+        return len(self.addresses)
+
+    def owner(self, hero_id):
+        return shard_for(hero_id, self.count)
+
+    def replica(self):
+        # Any shard in step with shard 0 can answer for the powers; they
+        # take turns
+        if self.stale and time.monotonic() >= self.next_check:
+            self._check_stale()
+        in_step = [index for index in range(self.count) if index not in self.stale]
+        return in_step[next(self.turns) % len(in_step)]
+
+    def mark_stale(self, index):
+        with self.stale_lock:
+            self.stale[index] = None
+            self.next_check = time.monotonic() + self.recheck
+
+    def _check_stale(self):
+        # A stale shard rejoins once it lists the same powers as shard 0,
+        # and has done so for long enough that the responses it cached
+        # before it caught up have expired
+        with self.stale_lock:
+            if time.monotonic() < self.next_check:
+                return
+            self.next_check = time.monotonic() + self.recheck
+            stale = sorted(self.stale)
+        try:
+            primary, *answers = self.send_many(
+                [(index, 'GET', '/powers', None, None) for index in [0, *stale]])
+        except ShardError:
+            return
+        now = time.monotonic()
+        with self.stale_lock:
+            for index, answer in zip(stale, answers):
+                if index not in self.stale:
+                    continue
+                if primary.status != 200 or answer.body != primary.body:
+                    self.stale[index] = None
+                    continue
+                if self.stale[index] is None:
+                    self.stale[index] = now + self.cache_ttl
+                if now >= self.stale[index]:
+                    del self.stale[index]
+
+    def _connection(self, index, fresh=False):
+        connections = self.local.__dict__.setdefault('connections', {})
+        if fresh or index not in connections:
+            if index in connections:
+                connections[index].close()
+            host, port = self.addresses[index]
+            connections[index] = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        return connections[index]
+
+    def _send(self, index, method, path, body, headers):
+        # Runs on the pool's threads, which keep one connection per shard
+        for attempt in range(2):
+            connection = self._connection(index, fresh=attempt > 0)
+            reused = connection.sock is not None
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                return ShardResponse(response.status, response.headers, response.read())
+            except RETRYABLE:
+                connection.close()
+                if not (reused and method == 'GET' and attempt == 0):
+                    raise ShardError(f"shard {index} closed the connection")
+            except OSError as e:
+                connection.close()
+                raise ShardError(f"shard {index} is unavailable: {e}")
+
+    def submit(self, index, method, path, body=None, headers=None):
+        return self.pool.submit(self._send, index, method, path, body, headers or {})
+
+    def send(self, index, method, path, body=None, headers=None):
+        return self.submit(index, method, path, body, headers).result()
+
+    def send_many(self, calls):
+        """
+        Sends ``(index, method, path, body, headers)`` calls in parallel and
+        returns their responses in the same order.
+        """
+        futures = [self.submit(*call) for call in calls]
+        return [future.result() for future in futures]
+
+    def open_stream(self, index, path, headers):
+        # Streams are read by the request's own thread, on a connection of
+        # their own that is closed at the end
+        host, port = self.addresses[index]
+        connection = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        try:
+            connection.request('GET', path, headers=headers)
+            return connection, connection.getresponse()
+        except OSError as e:
+            connection.close()
+            raise ShardError(f"shard {index} is unavailable: {e}")
+
+
+def shards():
+    return current_app.extensions['shards']
+
+
+def forward_headers():
+    headers = {name: request.headers[name] for name in FORWARD_HEADERS
+               if name in request.headers}
+    # The shards limit writes per client, see shards.run_shard()
+    forwarded = request.headers.get('X-Forwarded-For')
+    headers['X-Forwarded-For'] = (f'{forwarded}, {request.remote_addr}'
+                                  if forwarded else request.remote_addr or '')
+    return headers
+
+
+def shard_path(path=None, args=None):
+    # The request's path and query string, or ``path`` and ``args``
+    path = request.path if path is None else path
+    args = request.args if args is None else MultiDict(args)
+    query = urlencode(list(args.items(multi=True)))
+    return f'{path}?{query}' if query else path
+
+
+def relay(shard_response):
+    """
+    Returns a shard's response to the client.
+    """
+    response = Response(shard_response.body, status=shard_response.status)
+    for name in RETURN_HEADERS:
+        if name in shard_response.headers:
+            response.headers[name] = shard_response.headers[name]
+    cursor = shard_response.headers.get('X-Next-Cursor')
+    if cursor is not None:
+        # The shard's Link points at the shard; this one at the router
+        limit, _ = pagination.page_args()
+        response.headers['Link'] = pagination.link_header(cursor, limit)
+        response.headers['X-Next-Cursor'] = cursor
+    return response
+
+
+def forward(index):
+    return relay(shards().send(index, request.method, shard_path(),
+                               request.get_data(), forward_headers()))
+
+
+routes = Blueprint('router', __name__)
+
+
+@routes.errorhandler(ShardError)
+def shard_error(e):
+    return make_response({"errors": [str(e)]}, 502)
+
+
+@routes.route('/')
+def index():
+    return forward(shards().replica())
+
+
+def hero_args():
+    """
+    Returns the query arguments to send each shard for GET /heroes, and
+    whether the merged rows must have their id removed: rows are merged
+    by id, so it is asked for even when ``fields[hero]`` leaves it out.
+    """
+    args = request.args.to_dict()
+    wanted = args.get('fields[hero]')
+    strip_id = wanted is not None and 'id' not in {
+        field.strip() for field in wanted.split(',')}
+    if strip_id:
+        args['fields[hero]'] = f'{wanted},id'
+    return args, strip_id
+
+
+def ids_by_shard(args):
+    """
+    Returns ``{shard: args}`` for ``ids=``, each shard asked only for the
+    heroes it owns, or None to ask every shard.
+    """
+    raw = args.get('ids')
+    if not raw:
+        return None
+    try:
+        ids = [int(part) for part in raw.split(',') if part.strip()]
+    except ValueError:
+        # Shard 0 answers with the usual error
+        return {0: args}
+    owned = {}
+    for id in ids:
+        owned.setdefault(shards().owner(id), []).append(str(id))
+    return {index: dict(args, ids=','.join(owned_ids))
+            for index, owned_ids in owned.items()}
+
+
+def without_id(row):
+    return {name: value for name, value in row.items() if name != 'id'}
+
+
+@routes.route('/heroes')
+def heroes():
+    """
+    GET /heroes from every shard, merged by id.
+    """
+    try:
+        limit, _ = pagination.page_args()
+        fmt = stream_format()
+    except PaginationError as e:
+        return make_response({"errors": [str(e)]}, 400)
+    args, strip_id = hero_args()
+    targets = ids_by_shard(args) or dict.fromkeys(range(shards().count), args)
+    if fmt is not None:
+        return merged_stream(targets, fmt, strip_id)
+
+    answers = shards().send_many([
+        (index, 'GET', shard_path(args=shard_args), None, forward_headers())
+        for index, shard_args in targets.items()])
+    for answer in answers:
+        if answer.status != 200:
+            # Bad arguments: every shard says the same
+            return relay(answer)
+    loads = current_app.json.loads
+    rows = list(heapq.merge(*(loads(answer.body) for answer in answers),
+                            key=lambda row: row['id']))
+    more = any('X-Next-Cursor' in answer.headers for answer in answers)
+    next_cursor = None
+    if limit is not None and (more or len(rows) > limit):
+        rows = rows[:limit]
+        next_cursor = rows[-1]['id']
+    if strip_id:
+        rows = [without_id(row) for row in rows]
+    response = jsonify(rows)
+    if next_cursor is not None:
+        response.headers['Link'] = pagination.link_header(next_cursor, limit)
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    return response
+
+
+def merged_stream(targets, fmt, strip_id):
+    # Every shard streams NDJSON in id order; the lines are merged as they
+    # arrive, so the router holds one row per shard at a time
+    headers = forward_headers()
+    headers.pop('Accept', None)
+    streams = []
+
+    def close():
+        for connection, _ in streams:
+            connection.close()
+
+    try:
+        for index, args in targets.items():
+            streams.append(shards().open_stream(
+                index, shard_path(args=dict(args, stream='ndjson')), headers))
+            response = streams[-1][1]
+            if response.status != 200:
+                answer = ShardResponse(response.status, response.headers, response.read())
+                close()
+                return relay(answer)
+    except BaseException:
+        close()
+        raise
+
+    loads, dumps = current_app.json.loads, current_app.json.encode
+
+    def rows(response):
+        for line in response:
+            line = line.rstrip(b'\n')
+            if line:
+                row = loads(line)
+                yield row['id'], dumps(without_id(row)) if strip_id else line
+
+    def generate():
+        try:
+            merged = heapq.merge(*(rows(response) for _, response in streams),
+                                 key=lambda item: item[0])
+            if fmt == 'ndjson':
+                for _, line in merged:
+                    yield line + b'\n'
+                return
+            yield b'['
+            for number, (_, line) in enumerate(merged):
+                yield line if number == 0 else b',' + line
+            yield b']'
+        finally:
+            close()
+
+    mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'application/json'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
+@routes.route('/heroes/<int:id>')
+def hero_by_id(id):
+    return forward(shards().owner(id))
+
+
+@routes.route('/powers')
+def powers():
+    return forward(shards().replica())
+
+
+@routes.route('/powers/<int:id>', methods=['GET', 'PATCH'])
+def power_by_id(id):
+    if request.method == 'GET':
+        return forward(shards().replica())
+    client = shards()
+    body, headers = request.get_data(), forward_headers()
+    with client.powers_lock:
+        primary = client.send(0, 'PATCH', shard_path(), body, headers)
+        if primary.status == 200 and client.count > 1:
+            # The primary checked If-Match and the write limits; the others
+            # follow it
+            headers.pop('If-Match', None)
+            token = current_app.config.get('REPLICATION_TOKEN')
+            if token:
+                headers[REPLICATION_HEADER] = token
+            replicas = [client.submit(index, 'PATCH', shard_path(), body, headers)
+                        for index in range(1, client.count)]
+            for index, future in enumerate(replicas, 1):
+                try:
+                    status = future.result().status
+                except ShardError as e:
+                    status = str(e)
+                if status != 200:
+                    # Its powers are behind: keep reads of powers off it
+                    client.mark_stale(index)
+                    logger.error("shard %d did not take PATCH %s (%s); it serves no "
+                                 "powers until `flask shards sync-powers` has run",
+                                 index, request.path, status)
+    return relay(primary)
+
+
+def summed(answers, replicated=()):
+    """
+    Adds up the counts in the shards' bodies, nested dicts included.
+    Fields in ``replicated`` hold the same value on every shard and are
+    taken from the first.
+    """
+    bodies = [current_app.json.loads(answer.body) for answer in answers]
+    total = bodies[0]
+    for body in bodies[1:]:
+        for name, value in body.items():
+            if name in replicated:
+                continue
+            if isinstance(value, dict):
+                for key, count in value.items():
+                    total[name][key] = total[name].get(key, 0) + count
+            else:
+                total[name] += value
+    return total
+
+
+def fan_out_get():
+    client = shards()
+    return client.send_many([(index, 'GET', shard_path(), None, forward_headers())
+                             for index in range(client.count)])
+
+
+@routes.route('/powers/<int:id>/stats')
+def power_stats(id):
+    answers = fan_out_get()
+    if answers[0].status != 200:
+        return relay(answers[0])
+    return make_response(summed(answers, replicated=('power_id',)), 200)
+
+
+@routes.route('/stats')
+def totals():
+    return make_response(summed(fan_out_get(), replicated=('powers',)), 200)
+
+
+@routes.route('/hero_powers', methods=['POST'])
+def create_hero_power():
+    data = request.get_json(silent=True)
+    hero_id = data.get('hero_id') if isinstance(data, dict) else None
+    if isinstance(hero_id, int) and not isinstance(hero_id, bool):
+        return forward(shards().owner(hero_id))
+    # Shard 0 answers with the usual error
+    return forward(0)
+
+
+@routes.route('/hero_powers/bulk', methods=['POST'])
+def create_hero_powers_bulk():
+    """
+    Sends each shard the items for its heroes, in parallel. Errors keep
+    the items' indexes in the request.
+    """
+    try:
+        items = parse_items(request)
+    except BulkError as e:
+        return make_response({"errors": [str(e)]}, 400)
+    client = shards()
+    parts = {}
+    for position, item in enumerate(items):
+        hero_id = item.get('hero_id') if isinstance(item, dict) else None
+        index = (client.owner(hero_id)
+                 if isinstance(hero_id, int) and not isinstance(hero_id, bool) else 0)
+        parts.setdefault(index, []).append(position)
+    headers = dict(forward_headers(), **{'Content-Type': 'application/json'})
+    answers = client.send_many([
+        (index, 'POST', request.path,
+         current_app.json.encode([items[position] for position in positions]), headers)
+        for index, positions in parts.items()])
+
+    created, errors = 0, []
+    for positions, answer in zip(parts.values(), answers):
+        body = current_app.json.loads(answer.body)
+        if 'created' not in body:
+            # The shard turned the whole part away, e.g. over its write limit
+            errors.extend({"index": position, "errors": body.get("errors", [])}
+                          for position in positions)
+            continue
+        created += body['created']
+        errors.extend(dict(error, index=positions[error['index']])
+                      for error in body['errors'])
+    errors.sort(key=lambda error: error['index'])
+    status = 400 if errors and not created else 200
+    return make_response({"created": created, "errors": errors}, status)
+
+
+@routes.route('/changes')
+@routes.route('/changes/stream')
+def change_feed():
+    return make_response(
+        {"errors": ["the change feed is kept per shard; read it from each shard"]}, 501)
+
+
+@routes.route('/batch', methods=['POST'])
+def batch_get():
+    """
+    POST /batch: paths for single heroes go to their shards' /batch and
+    paths for single powers to one shard's, in parallel; any other path is
+    answered by the router's own view.
+    """
+    try:
+        paths = batch.parse_paths(request)
+    except batch.BatchError as e:
+        return make_response({"errors": [str(e)]}, 400)
+    client = shards()
+    adapter = current_app.url_map.bind('')
+    results = [None] * len(paths)
+    groups = {}
+    powers_shard = client.replica()
+    for position, path in enumerate(paths):
+        try:
+            endpoint, view_args = adapter.match(path.partition('?')[0], method='GET')
+        except HTTPException:
+            endpoint = None
+        if endpoint == 'router.hero_by_id':
+            groups.setdefault(client.owner(view_args['id']), []).append(position)
+        elif endpoint == 'router.power_by_id':
+            groups.setdefault(powers_shard, []).append(position)
+        else:
+            results[position] = batch.dispatch(path)
+
+    headers = dict(forward_headers(), **{'Content-Type': 'application/json'})
+    answers = client.send_many([
+        (index, 'POST', request.path,
+         current_app.json.encode([paths[position] for position in positions]), headers)
+        for index, positions in groups.items()])
+    encode = current_app.json.encode
+    for positions, answer in zip(groups.values(), answers):
+        if answer.status != 200:
+            return relay(answer)
+        for position, result in zip(positions, current_app.json.loads(answer.body)):
+            results[position] = (result['status'], encode(result['body']))
+    return jsonify(RawJSON(batch.encode_results(results)))
+
+
+def create_router(urls, config=None):
+    """
+    Builds the router for the shards at ``urls``, in shard order.
+    """
+    app = Flask(__name__)
+    app.config.update(compression_config())
+    # Lets PATCH /powers/<id> past the write limits of shards 1 and up
+    app.config['REPLICATION_TOKEN'] = os.environ.get('REPLICATION_TOKEN')
+    app.config.update(config or {})
+    app.json = FastJSONProvider(app)
+    app.extensions['shards'] = ShardClient(
+        urls, cache_ttl=int(os.environ.get('RESPONSE_CACHE_TTL', 60)))
+    app.register_blueprint(routes)
+    Compression(app)
+    return app
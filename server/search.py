@@ -0,0 +1,88 @@
+from sqlalchemy import Integer, column, or_, select, text
+
+from models import db, HeroPower, FTS_TABLES, FTS_TRIGRAM, STRENGTHS
+
+# Shortest query the trigram index can answer; shorter ones fall back to a
+# prefix match on the base table
+TRIGRAM_MIN = 3
+# Most ids one ?ids= lookup accepts; one IN (...) stays under SQLite's
+# bound-parameter limit
+MAX_IDS = 500
+
+
+class SearchError(ValueError):
+    pass
+
+
+def fts_match(q):
+    # Quote the text as one FTS5 string so operators in it are not parsed
+    phrase = '"' + q.replace('"', '""') + '"'
+    return phrase if FTS_TRIGRAM else phrase + ' *'
+
+
+def text_filter(model, columns, q):
+    """
+    Returns a filter on ``model`` matching rows whose ``columns`` contain
+    ``q``: through the table's FTS5 index on SQLite, LIKE elsewhere.
+    """
+    fts = FTS_TABLES[model.__tablename__][0]
+    if db.session.get_bind().dialect.name != 'sqlite':
+        pattern = '%' + q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        return or_(*(column.ilike(pattern, escape='\\') for column in columns))
+    if FTS_TRIGRAM and len(q) < TRIGRAM_MIN:
+        pattern = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        return or_(*(column.like(pattern, escape='\\') for column in columns))
+    matches = text(f'SELECT rowid FROM {fts} WHERE {fts} MATCH :q') \
+        .bindparams(q=fts_match(q)).columns(column('rowid', Integer))
+    return model.id.in_(matches)
+
+
+def id_list(value):
+    # "1,2,3" -> [1, 2, 3], without repeats
+    try:
+        ids = list(dict.fromkeys(int(part) for part in value.split(',') if part.strip()))
+    except ValueError:
+        raise SearchError("ids must be a comma-separated list of integers")
+    if len(ids) > MAX_IDS:
+        raise SearchError(f"at most {MAX_IDS} ids per request")
+    return ids
+
+
+def search_args(request, model, columns, link_filters=False):
+    """
+    Builds the filters for a list endpoint from the query string.
+
+    ``q`` searches ``columns``. ``ids=1,2,3`` keeps the rows with those
+    ids. With ``link_filters`` (heroes), ``power_id`` and ``strength`` keep
+    the heroes holding that power and/or holding a power at that strength.
+    """
+    filters = []
+    ids = request.args.get('ids')
+    if ids is not None:
+        filters.append(model.id.in_(id_list(ids)))
+
+    q = request.args.get('q', '').strip()
+    if q:
+        filters.append(text_filter(model, columns, q))
+
+    if link_filters:
+        links = []
+        power_id = request.args.get('power_id')
+        if power_id is not None:
+            try:
+                links.append(HeroPower.power_id == int(power_id))
+            except ValueError:
+                raise SearchError("power_id must be an integer")
+        strength = request.args.get('strength')
+        if strength is not None:
+            if strength not in STRENGTHS:
+                raise SearchError(f"strength must be one of {', '.join(STRENGTHS)}")
+            links.append(HeroPower.strength == strength)
+        if links:
+            filters.append(model.id.in_(select(HeroPower.hero_id).where(*links)))
+    return filters
+
+
+def filters_links(request):
+    # Whether a /heroes listing depends on hero_powers
+    return 'power_id' in request.args or 'strength' in request.args
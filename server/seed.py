@@ -1,50 +1,245 @@
+#!/usr/bin/env python3
+"""
+Seeds the database.
+
+    python server/seed.py
+        the 4 sample powers and 10 sample heroes
+    python server/seed.py --heroes 1_000_000 --powers 5_000 --links-per-hero 5 --seed 42
+        a generated dataset of any size, reproducible for a given --seed
+"""
+
+import argparse
+import random
+import time
+from itertools import islice
 from random import choice as rc
 
+from faker import Faker
+from sqlalchemy import text
+
 from app import app
-from models import db, Hero, Power, HeroPower
+from models import (db, Change, Hero, HeroDocument, Power, HeroPower, STRENGTHS,
+                    FTS_TABLES, counter_ddl, counter_drop_ddl, fts_ddl, fts_drop_ddl)
+
+# Distinct first names, last names and words drawn from Faker; generated
+# rows combine them, which is far cheaper than one Faker call per row
+NAME_POOL = 2000
+
+
+def clear():
+    print("Clearing db...")
+    # The read model is stale from here on: flask read-model rebuild
+    HeroDocument.query.delete()
+    # The change log describes rows that are gone; clients reload
+    Change.query.delete()
+    HeroPower.query.delete()
+    Power.query.delete()
+    Hero.query.delete()
+    if db.engine.dialect.name == 'sqlite':
+        # hero_powers is AUTOINCREMENT; number the new links from 1 again
+        db.session.execute(text("DELETE FROM sqlite_sequence WHERE name = 'hero_powers'"))
+    db.session.commit()
+
+
+def seed_sample():
+    print("Seeding powers...")
+    powers = [
+        Power(name="super strength", description="gives the wielder super-human strengths"),
+        Power(name="flight", description="gives the wielder the ability to fly through the skies at supersonic speed"),
+        Power(name="super human senses", description="allows the wielder to use her senses at a super-human level"),
+        Power(name="elasticity", description="can stretch the human body to extreme lengths"),
+    ]
+
+    db.session.add_all(powers)
+
+    print("Seeding heroes...")
+    heroes = [
+        Hero(name="Kamala Khan", super_name="Ms. Marvel"),
+        Hero(name="Doreen Green", super_name="Squirrel Girl"),
+        Hero(name="Gwen Stacy", super_name="Spider-Gwen"),
+        Hero(name="Janet Van Dyne", super_name="The Wasp"),
+        Hero(name="Wanda Maximoff", super_name="Scarlet Witch"),
+        Hero(name="Carol Danvers", super_name="Captain Marvel"),
+        Hero(name="Jean Grey", super_name="Dark Phoenix"),
+        Hero(name="Ororo Munroe", super_name="Storm"),
+        Hero(name="Kitty Pryde", super_name="Shadowcat"),
+        Hero(name="Elektra Natchios", super_name="Elektra"),
+    ]
+
+    db.session.add_all(heroes)
+
+    print("Adding powers to heroes...")
+    strengths = ["Strong", "Weak", "Average"]
+    hero_powers = []
+    for hero in heroes:
+        power = rc(powers)
+        hero_powers.append(
+            HeroPower(heroes=hero, power=power, strength=rc(strengths))
+        )
+    db.session.add_all(hero_powers)
+    db.session.commit()
+
+
+class Generator:
+    """
+    Deterministic row generator: the same seed always yields the same rows.
+    """
+
+    def __init__(self, seed):
+        fake = Faker()
+        fake.seed_instance(seed)
+        self.rng = random.Random(seed)
+        self.first_names = [fake.first_name() for _ in range(NAME_POOL)]
+        self.last_names = [fake.last_name() for _ in range(NAME_POOL)]
+        self.words = [fake.word() for _ in range(NAME_POOL)]
+        self.titles = ['Captain', 'Doctor', 'Lady', 'Mister', 'Ms.', 'The', 'Agent', 'Night']
+
+    # Rows are tuples in the column order given by the COLUMNS mapping
+
+    def powers(self, count):
+        rng, words = self.rng, self.words
+        for id in range(1, count + 1):
+            yield (id,
+                   f"{rng.choice(words)} {rng.choice(words)}",
+                   "gives the wielder the power of "
+                   + " ".join(rng.choice(words) for _ in range(5)))
+
+    def heroes(self, count):
+        rng = self.rng
+        for id in range(1, count + 1):
+            yield (id,
+                   f"{rng.choice(self.first_names)} {rng.choice(self.last_names)}",
+                   f"{rng.choice(self.titles)} {rng.choice(self.words).title()}")
+
+    def hero_powers(self, n_heroes, n_powers, links_per_hero):
+        rng = self.rng
+        links_per_hero = min(links_per_hero, n_powers)
+        power_ids = range(1, n_powers + 1)
+        for hero_id in range(1, n_heroes + 1):
+            strengths = rng.choices(STRENGTHS, k=links_per_hero)
+            for power_id, strength in zip(rng.sample(power_ids, links_per_hero), strengths):
+                yield (strength, hero_id, power_id)
+
+
+# Column order of the tuples each Generator method yields; it must follow
+# the table's column order, which is the order insert() compiles to
+COLUMNS = {
+    'powers': ('id', 'name', 'description'),
+    'heroes': ('id', 'name', 'super_name'),
+    'hero_powers': ('strength', 'hero_id', 'power_id'),
+}
+
+
+def insert_chunked(table, rows, chunk_size):
+    """
+    Inserts ``rows`` with one executemany per chunk, each chunk in its own
+    transaction, so memory stays bounded by ``chunk_size``.
+
+    The Core insert() is compiled once and the tuples go straight to the
+    DBAPI's executemany, skipping per-row parameter processing.
+    """
+    columns = COLUMNS[table.name]
+    assert [c.key for c in table.columns if c.key in columns] == list(columns)
+    insert = str(table.insert().compile(dialect=db.engine.dialect,
+                                        column_keys=list(columns)))
+    total = 0
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return total
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql(insert, chunk)
+        total += len(chunk)
+
+
+def build_derived(indexes, sqlite):
+    """
+    Builds the secondary indexes, and on SQLite the search indexes and the
+    statistics counters, from the rows in the tables. Whatever of them
+    still exists is replaced.
+    """
+    start = time.perf_counter()
+    with db.engine.begin() as conn:
+        for index in indexes:
+            index.create(conn, checkfirst=True)
+    print(f"Built indexes in {time.perf_counter() - start:.1f}s")
+
+    if sqlite:
+        start = time.perf_counter()
+        with db.engine.begin() as conn:
+            for table in FTS_TABLES:
+                for statement in fts_drop_ddl(table) + fts_ddl(table):
+                    conn.execute(text(statement))
+        print(f"Built search indexes in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        with db.engine.begin() as conn:
+            for statement in counter_ddl():
+                conn.execute(text(statement))
+        print(f"Counted statistics in {time.perf_counter() - start:.1f}s")
+
+
+def seed_generated(n_heroes, n_powers, links_per_hero, seed, chunk_size):
+    sqlite = db.engine.dialect.name == 'sqlite'
+    # Secondary indexes are cheaper to build once, sorted, than to maintain
+    # row by row in random order
+    indexes = [index for model in (Power, Hero, HeroPower)
+               for index in model.__table__.indexes]
+    try:
+        if sqlite:
+            # Index the text once at the end instead of firing the FTS
+            # triggers for every row
+            with db.engine.begin() as conn:
+                for table in FTS_TABLES:
+                    for statement in fts_drop_ddl(table):
+                        conn.execute(text(statement))
+                # The statistics counters are recounted once at the end too
+                for statement in counter_drop_ddl():
+                    conn.execute(text(statement))
+        with db.engine.begin() as conn:
+            for index in indexes:
+                index.drop(conn, checkfirst=True)
+        # With the triggers and indexes gone, SQLite empties the tables
+        # without visiting every row
+        clear()
+
+        generate = Generator(seed)
+        for label, table, rows in (
+                ("powers", Power.__table__, generate.powers(n_powers)),
+                ("heroes", Hero.__table__, generate.heroes(n_heroes)),
+                ("hero_powers", HeroPower.__table__,
+                 generate.hero_powers(n_heroes, n_powers, links_per_hero))):
+            start = time.perf_counter()
+            count = insert_chunked(table, rows, chunk_size)
+            print(f"Seeded {count} {label} in {time.perf_counter() - start:.1f}s")
+    finally:
+        # Also when the load stops part way (a constraint error, Ctrl-C, a
+        # full disk): without the triggers search and /stats would stop
+        # following the tables
+        db.session.rollback()
+        build_derived(indexes, sqlite)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed the superheroes database.")
+    parser.add_argument('--heroes', type=int,
+                        help="generate this many heroes instead of the sample data")
+    parser.add_argument('--powers', type=int, default=100)
+    parser.add_argument('--links-per-hero', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--chunk-size', type=int, default=50_000)
+    args = parser.parse_args()
 
-if __name__ == '__main__':
     with app.app_context():
-        print("Clearing db...")
-        Power.query.delete()
-        Hero.query.delete()
-        HeroPower.query.delete()
-
-        print("Seeding powers...")
-        powers = [
-            Power(name="super strength", description="gives the wielder super-human strengths"),
-            Power(name="flight", description="gives the wielder the ability to fly through the skies at supersonic speed"),
-            Power(name="super human senses", description="allows the wielder to use her senses at a super-human level"),
-            Power(name="elasticity", description="can stretch the human body to extreme lengths"),
-        ]
-
-        db.session.add_all(powers)
-
-        print("Seeding heroes...")
-        heroes = [
-            Hero(name="Kamala Khan", super_name="Ms. Marvel"),
-            Hero(name="Doreen Green", super_name="Squirrel Girl"),
-            Hero(name="Gwen Stacy", super_name="Spider-Gwen"),
-            Hero(name="Janet Van Dyne", super_name="The Wasp"),
-            Hero(name="Wanda Maximoff", super_name="Scarlet Witch"),
-            Hero(name="Carol Danvers", super_name="Captain Marvel"),
-            Hero(name="Jean Grey", super_name="Dark Phoenix"),
-            Hero(name="Ororo Munroe", super_name="Storm"),
-            Hero(name="Kitty Pryde", super_name="Shadowcat"),
-            Hero(name="Elektra Natchios", super_name="Elektra"),
-        ]
-
-        db.session.add_all(heroes)
-
-        print("Adding powers to heroes...")
-        strengths = ["Strong", "Weak", "Average"]
-        hero_powers = []
-        for hero in heroes:
-            power = rc(powers)
-            hero_powers.append(
-                HeroPower(hero=hero, power=power, strength=rc(strengths))
-            )
-        db.session.add_all(hero_powers)
-        db.session.commit()
+        if args.heroes is None:
+            clear()
+            seed_sample()
+        else:
+            seed_generated(args.heroes, args.powers, args.links_per_hero,
+                           args.seed, args.chunk_size)
 
         print("Done seeding!")
+
+
+if __name__ == '__main__':
+    main()
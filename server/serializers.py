@@ -0,0 +1,108 @@
+from operator import attrgetter
+
+from sqlalchemy import inspect
+
+from models import Hero, Power, HeroPower
+
+# Column types the compiled serializers pass straight through to JSON
+JSON_NATIVE = (int, str, float, bool)
+
+# Guard against serialize_rules that never stop recursing
+MAX_DEPTH = 5
+
+
+class SerializerError(TypeError):
+    pass
+
+
+def _child_rules(rules, name):
+    # '-hero_powers.heroes' applies to the hero_powers relationship as '-heroes'
+    prefix = f'-{name}.'
+    return {'-' + rule[len(prefix):] for rule in rules if rule.startswith(prefix)}
+
+
+def compile_serializer(model, only=None, rules=(), depth=0):
+    """
+    Compiles ``model``'s serialization rules into a plain function.
+
+    The rules are interpreted the same way ``SerializerMixin.to_dict()``
+    interprets them: every column and relationship is included unless a
+    ``-name`` rule removes it, ``-name.child`` rules are pushed down to the
+    related model and merged with that model's own ``serialize_rules``.
+    The difference is that this walk happens once, here, instead of on
+    every call. ``only`` restricts the output to the listed columns.
+
+    The returned function accepts a model instance or any row with the
+    same attribute names (such as a ``db.session.query(*columns)`` row).
+    """
+    if depth > MAX_DEPTH:
+        raise SerializerError(
+            f"serialize_rules for {model.__name__} nest deeper than {MAX_DEPTH}")
+
+    rules = set(rules) | set(getattr(model, 'serialize_rules', ()))
+    excluded = {rule[1:] for rule in rules if rule.startswith('-') and '.' not in rule}
+    mapper = inspect(model)
+
+    columns = []
+    for column in mapper.column_attrs:
+        if column.key in excluded or (only is not None and column.key not in only):
+            continue
+        python_type = column.columns[0].type.python_type
+        if not issubclass(python_type, JSON_NATIVE):
+            raise SerializerError(
+                f"{model.__name__}.{column.key} is {python_type.__name__}, "
+                "which the compiled serializer does not convert")
+        columns.append(column.key)
+
+    relationships = []
+    if only is None:
+        for relationship in mapper.relationships:
+            if relationship.key in excluded:
+                continue
+            child = compile_serializer(
+                relationship.mapper.class_,
+                rules=_child_rules(rules, relationship.key),
+                depth=depth + 1)
+            relationships.append((relationship.key, relationship.uselist, child))
+
+    keys = tuple(columns)
+    # attrgetter with several names returns a tuple; with one it does not
+    if len(keys) > 1:
+        get_columns = attrgetter(*keys)
+    elif keys:
+        get_columns = lambda obj, _get=attrgetter(keys[0]): (_get(obj),)
+    else:
+        # only=() from an empty sparse fieldset
+        get_columns = lambda obj: ()
+
+    if not relationships:
+        def serialize(obj):
+            return dict(zip(keys, get_columns(obj)))
+        return serialize
+
+    def serialize(obj):
+        data = dict(zip(keys, get_columns(obj)))
+        for key, uselist, child in relationships:
+            value = getattr(obj, key)
+            if uselist:
+                data[key] = [child(item) for item in value]
+            else:
+                data[key] = None if value is None else child(value)
+        return data
+    return serialize
+
+
+# Compiled once at import time and shared by every endpoint
+hero_summary = compile_serializer(Hero, only=('id', 'name', 'super_name'))
+hero_detail = compile_serializer(Hero)
+power_summary = compile_serializer(Power, only=('id', 'name', 'description'))
+hero_power_columns = compile_serializer(
+    HeroPower, only=('id', 'hero_id', 'power_id', 'strength'))
+
+
+def hero_power_detail(hero_power, hero, power):
+    # The body returned by POST /hero_powers
+    data = hero_power_columns(hero_power)
+    data['hero'] = hero_summary(hero)
+    data['power'] = power_summary(power)
+    return data
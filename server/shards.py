@@ -0,0 +1,249 @@
+"""
+Sharded deployment: heroes and their hero_powers partitioned across
+several SQLite files by hero id, each served by its own app.py process,
+with router.py in front.
+
+    flask shards split --count 4 --dir shards/    # from the app's database
+    flask shards serve --dir shards/ --port 5555   # the shards and the router
+
+Hero ``id`` lives on shard ``id % count``, and its hero_powers live with
+it, so a write only ever takes one shard's lock and the shards take writes
+in parallel. The powers table is small and read by every shard (hero
+detail, hero_power validation), so each shard holds a full copy. Shard 0
+is the primary for powers: the router applies PATCH /powers/<id> there
+first and then to the others. A shard that misses one of these updates
+serves no powers through the router until ``flask shards sync-powers``
+has copied shard 0's powers to it.
+
+Every shard is an ordinary database for app.py. New hero_power ids are
+handed out from a range of their own per shard, starting at
+``(index + 1) * ID_SPAN``, so they never collide across shards. The change
+feed, the read model and the response cache are kept per shard; a split
+starts each shard with an empty change feed and read model
+(``flask read-model rebuild`` against each file fills the latter).
+"""
+
+import glob
+import os
+import re
+import secrets
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import click
+from flask.cli import AppGroup, with_appcontext
+from sqlalchemy import create_engine
+
+from models import (db, FTS_TABLES, counter_ddl, counter_drop_ddl, fts_ddl,
+                    fts_drop_ddl)
+
+# hero_power ids per shard: shard k numbers its new links from (k + 1) *
+# ID_SPAN. 2**40 links per shard keeps ids of up to 8190 shards below 2**53,
+# where JavaScript numbers stop being exact.
+ID_SPAN = 1 << 40
+
+SHARD_FILE = re.compile(r'shard-(\d+)\.db$')
+
+
+def shard_for(hero_id, count):
+    # The shard that owns a hero, and its hero_powers
+    return hero_id % count
+
+
+def shard_path(directory, index):
+    return os.path.join(directory, f'shard-{index}.db')
+
+
+def shard_paths(directory):
+    """
+    Returns the shard files in ``directory``, in shard order.
+    """
+    found = {}
+    for path in glob.glob(os.path.join(directory, 'shard-*.db')):
+        match = SHARD_FILE.search(path)
+        if match:
+            found[int(match.group(1))] = path
+    if sorted(found) != list(range(len(found))):
+        raise click.ClickException(f"{directory} does not hold shards 0 to {len(found) - 1}")
+    return [found[index] for index in range(len(found))]
+
+
+def split(source, directory, count):
+    """
+    Creates ``count`` shard files in ``directory`` from the SQLite database
+    at ``source``: every power, and the heroes and hero_powers each shard
+    owns. Returns the shard files.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for index in range(count):
+        path = shard_path(directory, index)
+        if os.path.exists(path):
+            raise click.ClickException(f"{path} already exists")
+        engine = create_engine(f'sqlite:///{path}')
+        db.Model.metadata.create_all(engine)
+        with engine.connect() as conn:
+            # ATTACH cannot run inside a transaction
+            conn.exec_driver_sql('ATTACH DATABASE ? AS source', (source,))
+            with conn.begin():
+                # As in seed.py: index the text and count the rows once
+                # at the end instead of firing the triggers for every row
+                for statement in counter_drop_ddl() + [
+                        statement for table in FTS_TABLES for statement in fts_drop_ddl(table)]:
+                    conn.exec_driver_sql(statement)
+                conn.exec_driver_sql(
+                    'INSERT INTO powers (id, name, description, version) '
+                    'SELECT id, name, description, version FROM source.powers')
+                conn.exec_driver_sql(
+                    'INSERT INTO heroes (id, name, super_name) '
+                    'SELECT id, name, super_name FROM source.heroes '
+                    'WHERE id % ? = ? ORDER BY id', (count, index))
+                conn.exec_driver_sql(
+                    'INSERT INTO hero_powers (id, strength, hero_id, power_id) '
+                    'SELECT id, strength, hero_id, power_id FROM source.hero_powers '
+                    'WHERE hero_id % ? = ? ORDER BY id', (count, index))
+                for statement in [statement for table in FTS_TABLES
+                                  for statement in fts_ddl(table)] + counter_ddl():
+                    conn.exec_driver_sql(statement)
+                # New links are numbered from this shard's range on
+                conn.exec_driver_sql("DELETE FROM sqlite_sequence WHERE name = 'hero_powers'")
+                conn.exec_driver_sql(
+                    "INSERT INTO sqlite_sequence (name, seq) SELECT 'hero_powers', "
+                    "max(?, coalesce((SELECT max(id) FROM hero_powers), 0))",
+                    ((index + 1) * ID_SPAN,))
+            conn.exec_driver_sql('DETACH DATABASE source')
+        engine.dispose()
+        paths.append(path)
+    return paths
+
+
+def sync_powers(paths):
+    """
+    Makes the powers of every shard match those of the first one. Returns
+    the number of shards changed.
+    """
+    changed = 0
+    for path in paths[1:]:
+        engine = create_engine(f'sqlite:///{path}')
+        with engine.connect() as conn:
+            conn.exec_driver_sql('ATTACH DATABASE ? AS primary_shard', (paths[0],))
+            with conn.begin():
+                # An upsert, not INSERT OR REPLACE: REPLACE deletes the row
+                # without firing the triggers that keep the search index
+                result = conn.exec_driver_sql(
+                    'INSERT INTO powers (id, name, description, version) '
+                    'SELECT id, name, description, version FROM primary_shard.powers '
+                    'WHERE true '
+                    'ON CONFLICT (id) DO UPDATE SET name = excluded.name, '
+                    'description = excluded.description, version = excluded.version '
+                    'WHERE (name, description, version) IS NOT '
+                    '(excluded.name, excluded.description, excluded.version)')
+                changed += result.rowcount > 0
+            conn.exec_driver_sql('DETACH DATABASE primary_shard')
+        engine.dispose()
+    return changed
+
+
+def run_shard(path, host, port):
+    """
+    Serves app.py on the shard file ``path``, behind the router.
+    """
+    os.environ['DB_URI'] = f'sqlite:///{path}'
+    # The router appends the client's address to X-Forwarded-For, for the
+    # write limits: trust it and whatever proxies the router itself trusts
+    os.environ['TRUSTED_PROXIES'] = str(1 + int(os.environ.get('TRUSTED_PROXIES', 0)))
+    from werkzeug.serving import run_simple
+    from app import app
+    run_simple(host, port, app, threaded=True)
+
+
+def wait_for_port(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def start_shards(paths, host, first_port, stderr=None):
+    """
+    Starts one app.py process per shard file, on consecutive ports from
+    ``first_port``. Returns the processes and the shards' URLs once all of
+    them accept connections. ``stderr`` is passed to subprocess.Popen, for
+    the request log.
+    """
+    processes, urls = [], []
+    server_dir = os.path.dirname(os.path.abspath(__file__))
+    # Inherited by the shards, and by the router built in this process or
+    # started from it, so the router's replayed writes skip the limits
+    os.environ.setdefault('REPLICATION_TOKEN', secrets.token_hex(16))
+    for index, path in enumerate(paths):
+        port = first_port + index
+        processes.append(subprocess.Popen(
+            [sys.executable, '-c', f'import shards; shards.run_shard({path!r}, {host!r}, {port})'],
+            cwd=server_dir, stderr=stderr))
+        urls.append(f'http://{host}:{port}')
+    try:
+        for index in range(len(paths)):
+            wait_for_port(host, first_port + index)
+    except OSError:
+        stop_shards(processes)
+        raise
+    return processes, urls
+
+
+def stop_shards(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait()
+
+
+shards_cli = AppGroup('shards', help="Run the API sharded by hero id.")
+
+
+@shards_cli.command('split')
+@click.option('--count', type=int, required=True, help="Number of shards.")
+@click.option('--dir', 'directory', required=True, help="Directory for the shard files.")
+@with_appcontext
+def split_command(count, directory):
+    """Split the app's database into shard files."""
+    if db.engine.dialect.name != 'sqlite':
+        raise click.ClickException("only SQLite databases can be split")
+    start = time.perf_counter()
+    paths = split(db.engine.url.database, directory, count)
+    click.echo(f"Wrote {len(paths)} shards to {directory} in {time.perf_counter() - start:.1f}s")
+
+
+@shards_cli.command('sync-powers')
+@click.option('--dir', 'directory', required=True, help="Directory of the shard files.")
+def sync_powers_command(directory):
+    """Copy the powers of shard 0 to the other shards."""
+    changed = sync_powers(shard_paths(directory))
+    click.echo(f"Updated the powers of {changed} shards")
+
+
+@shards_cli.command('serve')
+@click.option('--dir', 'directory', required=True, help="Directory of the shard files.")
+@click.option('--host', default='127.0.0.1', show_default=True)
+@click.option('--port', type=int, default=5555, show_default=True,
+              help="Port of the router; the shards listen on the ports after it.")
+def serve_command(directory, host, port):
+    """Serve the shards, each in its own process, behind the router."""
+    from werkzeug.serving import run_simple
+    from router import create_router
+
+    processes, urls = start_shards(shard_paths(directory), host, port + 1)
+    # So a plain kill stops the shards too
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        run_simple(host, port, create_router(urls), threaded=True)
+    finally:
+        stop_shards(processes)
@@ -0,0 +1,152 @@
+"""
+Statistics for dashboards, read from counters instead of counting rows.
+
+    GET /stats               heroes, powers and hero_powers in total, and
+                             hero_powers per strength
+    GET /powers/<id>/stats   heroes holding the power, in total and per
+                             strength
+
+On SQLite the counters and power_strength_counts tables are kept by
+triggers (models.counter_ddl()), in the same transaction as every insert,
+delete or update of heroes, powers and hero_powers, so both endpoints read
+a handful of rows however large the tables grow. Other databases count
+with GROUP BY.
+
+    flask stats check       compares the counters with a full count
+    flask stats recompute   recounts everything from the tables
+"""
+
+import time
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import func, text
+
+from models import (db, Counter, Hero, HeroPower, Power, PowerStrengthCount,
+                    STRENGTHS, counter_recompute_ddl)
+
+
+def counters_enabled():
+    return db.engine.dialect.name == 'sqlite'
+
+
+def _strengths(counts):
+    # Every strength, including those no hero_power has
+    return {strength: counts.get(strength, 0) for strength in STRENGTHS}
+
+
+def totals():
+    """
+    Returns the body of GET /stats.
+    """
+    if counters_enabled():
+        counts = dict(db.session.query(Counter.name, Counter.value))
+    else:
+        counts = live_totals()
+    return {
+        'heroes': counts.get('heroes', 0),
+        'powers': counts.get('powers', 0),
+        'hero_powers': counts.get('hero_powers', 0),
+        'strengths': _strengths({name[len('strength:'):]: value
+                                 for name, value in counts.items()
+                                 if name.startswith('strength:')}),
+    }
+
+
+def power_stats(power_id):
+    """
+    Returns the body of GET /powers/<id>/stats, or None if there is no such
+    power. One statement: the power's row joined to its counts.
+    """
+    if counters_enabled():
+        rows = db.session.query(Power.id, PowerStrengthCount.strength,
+                                PowerStrengthCount.heroes) \
+            .outerjoin(PowerStrengthCount, PowerStrengthCount.power_id == Power.id) \
+            .filter(Power.id == power_id).all()
+    else:
+        rows = db.session.query(Power.id, HeroPower.strength, func.count(HeroPower.id)) \
+            .outerjoin(HeroPower, HeroPower.power_id == Power.id) \
+            .filter(Power.id == power_id).group_by(Power.id, HeroPower.strength).all()
+    if not rows:
+        return None
+    counts = {strength: heroes for _, strength, heroes in rows if strength is not None}
+    return {
+        'power_id': power_id,
+        'heroes': sum(counts.values()),
+        'strengths': _strengths(counts),
+    }
+
+
+def live_totals():
+    # The counters, counted from the tables
+    counts = {
+        'heroes': db.session.query(func.count(Hero.id)).scalar(),
+        'powers': db.session.query(func.count(Power.id)).scalar(),
+        'hero_powers': db.session.query(func.count(HeroPower.id)).scalar(),
+    }
+    counts.update((f'strength:{strength}', count) for strength, count in
+                  db.session.query(HeroPower.strength, func.count(HeroPower.id))
+                  .group_by(HeroPower.strength))
+    return counts
+
+
+def live_power_counts():
+    return {(power_id, strength): count for power_id, strength, count in
+            db.session.query(HeroPower.power_id, HeroPower.strength,
+                             func.count(HeroPower.id))
+            .group_by(HeroPower.power_id, HeroPower.strength)}
+
+
+def check():
+    """
+    Compares the counters with a full count. Returns the counters that
+    differ as ``(name, stored, counted)``.
+    """
+    stored = dict(db.session.query(Counter.name, Counter.value))
+    counted = live_totals()
+    differences = [(name, stored.get(name), counted.get(name, 0))
+                   for name in sorted(set(stored) | set(counted))
+                   if stored.get(name, 0) != counted.get(name, 0)]
+
+    stored = {(row.power_id, row.strength): row.heroes
+              for row in PowerStrengthCount.query}
+    counted = live_power_counts()
+    for power_id, strength in sorted(set(stored) | set(counted)):
+        key = (power_id, strength)
+        if stored.get(key, 0) != counted.get(key, 0):
+            differences.append((f'power:{power_id}:{strength}',
+                                stored.get(key), counted.get(key, 0)))
+    return differences
+
+
+def recompute():
+    for statement in counter_recompute_ddl():
+        db.session.execute(text(statement))
+    db.session.commit()
+
+
+stats_cli = AppGroup('stats', help="Manage the statistics counters.")
+
+
+@stats_cli.command('recompute')
+def recompute_command():
+    """Recount every counter from the tables."""
+    start = time.perf_counter()
+    recompute()
+    click.echo(f"Recomputed the counters in {time.perf_counter() - start:.1f}s")
+
+
+@stats_cli.command('check')
+def check_command():
+    """Compare the counters with a full count of the tables."""
+    if not counters_enabled():
+        click.echo("Counters are only kept on SQLite; nothing to check")
+        return
+    differences = check()
+    for name, stored, counted in differences[:20]:
+        click.echo(f"{name}: stored {stored}, counted {counted}")
+    if differences:
+        if len(differences) > 20:
+            click.echo(f"... {len(differences) - 20} more")
+        raise SystemExit(1)
+    click.echo("Counters match the tables")
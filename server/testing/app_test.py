@@ -1,6 +1,8 @@
+import json
 from faker import Faker
 from app import app
 from models import db, Hero, Power, HeroPower
+from instrumentation import QueryCounter
 
 
 class TestApp:
@@ -52,6 +54,35 @@ class TestApp:
             assert response['super_name'] == hero.super_name
             assert 'hero_powers' in response
 
+    def test_hero_by_id_query_count_is_constant(self):
+        '''loads a hero with its powers in the same number of queries however many powers it has.'''
+
+        with app.app_context():
+            fake = Faker()
+            client = app.test_client()
+            counts = []
+            for n_powers in (1, 5):
+                hero = Hero(name=fake.name(), super_name=fake.name())
+                powers = [Power(name=fake.name(),
+                                description=fake.sentence(nb_words=10))
+                          for _ in range(n_powers)]
+                db.session.add_all([hero] + powers + [
+                    HeroPower(heroes=hero, power=power, strength='Strong')
+                    for power in powers])
+                db.session.commit()
+                hero_id = hero.id
+                # Start from an empty identity map, as a real request would
+                db.session.remove()
+
+                with QueryCounter(db.engine) as counter:
+                    response = client.get(f'/heroes/{hero_id}')
+                assert response.status_code == 200
+                assert len(response.json['hero_powers']) == n_powers
+                counts.append(counter.count)
+
+            assert counts[0] == counts[1], counter.statements
+            assert counts[0] <= 2, counter.statements
+
     def test_returns_404_if_no_hero_to_get(self):
         '''returns an error message and 404 status code with GET request to /heros/<int:id> by a non-existent ID.'''
 
@@ -250,3 +281,166 @@ class TestApp:
             assert response.status_code == 400
             assert response.content_type == 'application/json'
             assert response.json['errors'] == ["validation errors"]
+
+    def test_paginates_heroes_by_cursor(self):
+        '''pages through /heroes with limit and after, following the next cursor.'''
+
+        with app.app_context():
+            fake = Faker()
+            db.session.add_all(
+                [Hero(name=fake.name(), super_name=fake.name()) for _ in range(3)])
+            db.session.commit()
+
+            client = app.test_client()
+            seen = []
+            after = 0
+            while True:
+                response = client.get(f'/heroes?limit=2&after={after}')
+                assert response.status_code == 200
+                assert len(response.json) <= 2
+                seen.extend(hero['id'] for hero in response.json)
+                if 'X-Next-Cursor' not in response.headers:
+                    assert 'Link' not in response.headers
+                    break
+                assert 'rel="next"' in response.headers['Link']
+                after = int(response.headers['X-Next-Cursor'])
+                assert after == seen[-1]
+
+            assert seen == [hero.id for hero in Hero.query.order_by(Hero.id)]
+
+    def test_rejects_bad_pagination_parameters(self):
+        '''returns 400 when limit or after is not a valid integer.'''
+
+        with app.app_context():
+            client = app.test_client()
+            assert client.get('/heroes?limit=0').status_code == 400
+            assert client.get('/powers?limit=abc').status_code == 400
+            assert client.get('/powers?after=-1').status_code == 400
+            assert client.get('/powers?stream=xml').status_code == 400
+
+    def test_streams_powers(self):
+        '''streams /powers as a JSON array or as NDJSON.'''
+
+        with app.app_context():
+            fake = Faker()
+            db.session.add(Power(name=fake.name(),
+                                 description=fake.sentence(nb_words=10)))
+            db.session.commit()
+            expected = [power.id for power in Power.query.order_by(Power.id)]
+
+            client = app.test_client()
+            response = client.get('/powers?stream=json')
+            assert response.status_code == 200
+            assert response.content_type == 'application/json'
+            assert [power['id'] for power in response.json] == expected
+
+            response = client.get('/powers?stream=ndjson')
+            assert response.status_code == 200
+            assert response.content_type == 'application/x-ndjson'
+            lines = response.get_data(as_text=True).splitlines()
+            assert [json.loads(line)['id'] for line in lines] == expected
+
+    def test_creates_hero_powers_in_bulk(self):
+        '''creates the valid items of a POST to /hero_powers/bulk and reports the invalid ones by index.'''
+
+        with app.app_context():
+            fake = Faker()
+            hero = Hero(name=fake.name(), super_name=fake.name())
+            power, other = [Power(name=fake.name(),
+                                  description=fake.sentence(nb_words=10))
+                            for _ in range(2)]
+            db.session.add_all([hero, power, other])
+            db.session.commit()
+
+            response = app.test_client().post('/hero_powers/bulk', json=[
+                {'strength': 'Strong', 'hero_id': hero.id, 'power_id': power.id},
+                {'strength': 'Cheese', 'hero_id': hero.id, 'power_id': other.id},
+                {'strength': 'Weak', 'hero_id': 0, 'power_id': power.id},
+                {'strength': 'Weak', 'hero_id': hero.id},
+                {'strength': 'Average', 'hero_id': hero.id, 'power_id': other.id},
+                {'strength': 'Weak', 'hero_id': hero.id, 'power_id': other.id},
+            ])
+
+            assert response.status_code == 200
+            assert response.json['created'] == 2
+            assert [e['index'] for e in response.json['errors']] == [1, 2, 3, 5]
+            assert response.json['errors'][0]['errors'] == ["validation errors"]
+            assert response.json['errors'][3]['errors'] == ["Hero already has this power"]
+            assert sorted(hp.strength for hp in HeroPower.query.filter_by(
+                hero_id=hero.id)) == ['Average', 'Strong']
+
+    def test_bulk_reports_pairs_stored_concurrently(self, monkeypatch):
+        '''reports a pair stored by another request after validation as a duplicate, not a 500.'''
+
+        import app as app_module
+
+        with app.app_context():
+            fake = Faker()
+            hero = Hero(name=fake.name(), super_name=fake.name())
+            powers = [Power(name=fake.name(),
+                            description=fake.sentence(nb_words=10))
+                      for _ in range(2)]
+            db.session.add_all([hero] + powers)
+            db.session.commit()
+            validate = app_module.validate_items
+
+            def racing(items):
+                # Validates, then lets the "other request" commit its link
+                result = validate(items)
+                if not HeroPower.query.count():
+                    db.session.add(HeroPower(strength='Weak', hero_id=hero.id,
+                                             power_id=powers[0].id))
+                    db.session.commit()
+                return result
+
+            monkeypatch.setattr(app_module, 'validate_items', racing)
+            response = app.test_client().post('/hero_powers/bulk', json=[
+                {'strength': 'Strong', 'hero_id': hero.id, 'power_id': power.id}
+                for power in powers])
+
+            assert response.status_code == 200
+            assert response.json == {'created': 1, 'errors': [
+                {'index': 0, 'errors': ["Hero already has this power"]}]}
+            assert HeroPower.query.count() == 2
+
+    def test_creates_hero_powers_from_ndjson(self):
+        '''accepts NDJSON bodies on /hero_powers/bulk.'''
+
+        with app.app_context():
+            fake = Faker()
+            hero = Hero(name=fake.name(), super_name=fake.name())
+            powers = [Power(name=fake.name(),
+                            description=fake.sentence(nb_words=10))
+                      for _ in range(3)]
+            db.session.add_all([hero] + powers)
+            db.session.commit()
+
+            body = '\n'.join(json.dumps(
+                {'strength': 'Weak', 'hero_id': hero.id, 'power_id': power.id})
+                for power in powers)
+            response = app.test_client().post(
+                '/hero_powers/bulk', data=body,
+                content_type='application/x-ndjson')
+
+            assert response.status_code == 200
+            assert response.json == {'created': 3, 'errors': []}
+
+            response = app.test_client().post('/hero_powers/bulk', json={})
+            assert response.status_code == 400
+
+    def test_rejects_duplicate_hero_power(self):
+        '''returns 409 when a POST to /hero_powers repeats a hero's existing power.'''
+
+        with app.app_context():
+            fake = Faker()
+            hero = Hero(name=fake.name(), super_name=fake.name())
+            power = Power(name=fake.name(),
+                          description=fake.sentence(nb_words=10))
+            db.session.add_all([hero, power])
+            db.session.commit()
+
+            link = {'strength': 'Weak', 'hero_id': hero.id, 'power_id': power.id}
+            assert app.test_client().post('/hero_powers', json=link).status_code == 200
+            response = app.test_client().post('/hero_powers', json=link)
+            assert response.status_code == 409
+            assert response.json['errors']
@@ -0,0 +1,176 @@
+import asyncio
+import gzip
+import json
+import threading
+
+import pytest
+
+pytest.importorskip('aiosqlite')
+pytest.importorskip('asgiref')
+
+from app import app as flask_app
+from asgi import app
+from models import db, Hero, Power, HeroPower
+from faker import Faker
+
+
+def request(method, path, query='', body=b'', headers=()):
+    '''Runs one HTTP request through the ASGI app; returns (status, headers, body).'''
+
+    async def run():
+        scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+                 'method': method, 'scheme': 'http', 'path': path,
+                 'raw_path': path.encode(), 'root_path': '',
+                 'query_string': query.encode(), 'server': ('testserver', 80),
+                 'client': ('127.0.0.1', 1234),
+                 'headers': [(b'host', b'testserver'),
+                             (b'content-type', b'application/json'),
+                             (b'content-length', str(len(body)).encode())]
+                            + [(k.encode(), v.encode()) for k, v in headers]}
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            sent.append(message)
+
+        await app(scope, receive, send)
+        # Each asyncio.run() has its own loop; pooled connections belong to it
+        if app.engine is not None:
+            await app.engine.dispose()
+        start = sent[0]
+        received = {k.decode().lower(): v.decode() for k, v in start['headers']}
+        return start['status'], received, b''.join(m.get('body', b'') for m in sent[1:])
+
+    return asyncio.run(run())
+
+
+# The async engine reads through its own connections
+@pytest.mark.commits
+class TestAsgi:
+    '''ASGI application in asgi.py'''
+
+    def test_async_reads_match_flask(self):
+        '''serves the read endpoints with the same bodies as the Flask app.'''
+
+        with flask_app.app_context():
+            fake = Faker()
+            hero = Hero(name=fake.name(), super_name=fake.name())
+            power = Power(name=fake.name(), description=fake.sentence(nb_words=10))
+            db.session.add_all([hero, power,
+                                HeroPower(heroes=hero, power=power, strength='Weak')])
+            db.session.commit()
+            client = flask_app.test_client()
+
+            for path in ('/heroes', f'/heroes/{hero.id}', '/powers',
+                         f'/powers/{power.id}', '/heroes/0', '/powers/0'):
+                status, headers, body = request('GET', path)
+                expected = client.get(path)
+                assert status == expected.status_code, path
+                assert headers['content-type'] == 'application/json'
+                assert json.loads(body) == expected.json, path
+
+    def test_async_pagination(self):
+        '''pages with limit/after and reports the next cursor.'''
+
+        with flask_app.app_context():
+            fake = Faker()
+            db.session.add_all(
+                [Power(name=fake.name(), description=fake.sentence(nb_words=10))
+                 for _ in range(3)])
+            db.session.commit()
+            ids = [power.id for power in Power.query.order_by(Power.id)]
+
+            status, headers, body = request('GET', '/powers', 'limit=2')
+            assert status == 200
+            assert [p['id'] for p in json.loads(body)] == ids[:2]
+            assert headers['x-next-cursor'] == str(ids[1])
+
+    def test_same_response_pipeline(self):
+        '''caches, tags, compresses, links and measures async responses as the Flask app does.'''
+
+        with flask_app.app_context():
+            fake = Faker()
+            # Enough rows for /powers to pass COMPRESSION_MIN_SIZE
+            db.session.add_all(
+                [Power(name=fake.name(), description=fake.sentence(nb_words=10))
+                 for _ in range(30)])
+            db.session.commit()
+            expected = flask_app.test_client().get('/powers')
+            power_id = expected.json[0]['id']
+
+            metrics = flask_app.extensions['request_metrics']
+            labels = (('method', 'GET'), ('route', '/powers/<int:id>'))
+            before = metrics.sql_statements._series.get(labels, [None, 0, 0.0])[1:]
+            status, headers, _ = request('GET', f'/powers/{power_id}')
+            assert status == 200 and headers['etag'] == '"v1"'
+            count, statements = metrics.sql_statements._series[labels][1:]
+            assert count == before[0] + 1 and statements > before[1]
+
+            status, headers, body = request('GET', '/powers',
+                                            headers=[('accept-encoding', 'gzip')])
+            assert status == 200
+            assert headers['content-encoding'] == 'gzip'
+            assert 'Accept-Encoding' in headers['vary']
+            assert headers['etag'] == f'{expected.headers["ETag"][:-1]}-gzip"'
+            assert int(headers['content-length']) == len(body)
+            assert json.loads(gzip.decompress(body)) == expected.json
+
+            status, _, body = request('GET', '/powers',
+                                      headers=[('if-none-match', headers['etag'])])
+            assert status == 304 and body == b''
+
+            status, headers, _ = request('GET', '/powers', 'limit=2')
+            assert headers['link'] == (f'<http://testserver/powers?limit=2&after='
+                                       f'{headers["x-next-cursor"]}>; rel="next"')
+
+            status, headers, body = request('GET', '/powers',
+                                            headers=[('accept', 'application/x-ndjson')])
+            assert headers['content-type'] == 'application/x-ndjson'
+            assert len(body.splitlines()) == 30
+
+    def test_falls_back_to_flask(self):
+        '''passes writes and unknown parameters through to the Flask app.'''
+
+        with flask_app.app_context():
+            fake = Faker()
+            power = Power(name=fake.name(), description=fake.sentence(nb_words=10))
+            db.session.add(power)
+            db.session.commit()
+
+            description = power.description + ' (via asgi)'
+            status, _, body = request('PATCH', f'/powers/{power.id}',
+                                      body=json.dumps({'description': description}).encode())
+            assert status == 200
+            assert json.loads(body)['description'] == description
+
+            status, headers, _ = request('GET', '/powers', 'stream=ndjson')
+            assert status == 200
+            assert headers['content-type'] == 'application/x-ndjson'
+
+            status, _, _ = request('GET', '/powers', 'limit=0')
+            assert status == 400
+
+    def test_blocking_steps_leave_the_loop(self, monkeypatch):
+        '''reads and fills the cache and runs the after_request hooks outside the event loop's thread.'''
+
+        with flask_app.app_context():
+            fake = Faker()
+            db.session.add(Power(name=fake.name(), description=fake.sentence(nb_words=10)))
+            db.session.commit()
+
+            threads = {}
+            backend = flask_app.extensions['response_cache']
+            for name, func in (('get', backend.get), ('set', backend.set),
+                               ('finalize_request', flask_app.finalize_request)):
+                def record(*args, name=name, func=func):
+                    threads[name] = threading.get_ident()
+                    return func(*args)
+                monkeypatch.setattr(flask_app if name == 'finalize_request' else backend,
+                                    name, record)
+
+            status, _, _ = request('GET', '/powers', headers=[('accept-encoding', 'gzip')])
+            assert status == 200
+            assert threads.keys() == {'get', 'set', 'finalize_request'}
+            assert threading.get_ident() not in threads.values()
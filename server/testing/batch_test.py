@@ -0,0 +1,89 @@
+from app import app
+import batch
+from instrumentation import QueryCounter
+from models import db
+
+
+class TestIds:
+    '''?ids= on GET /heroes and GET /powers'''
+
+    def test_ids_filter(self, make_rows):
+        '''returns only the listed rows, in id order, with one query.'''
+
+        with app.app_context():
+            heroes, (power,) = make_rows(heroes=3, strength='Average')
+            hero_ids, power_id = [hero.id for hero in heroes], power.id
+            client = app.test_client()
+            with QueryCounter(db.engine) as counter:
+                response = client.get(f'/heroes?ids={hero_ids[2]},{hero_ids[0]},0')
+            assert [hero['id'] for hero in response.json] == [hero_ids[0], hero_ids[2]]
+            assert counter.count == 1
+
+            response = client.get(f'/powers?ids={power_id}&fields[power]=name')
+            assert len(response.json) == 1 and response.json[0].keys() == {'name'}
+
+            assert client.get('/heroes?ids=1,x').status_code == 400
+
+
+class TestBatch:
+    '''POST /batch'''
+
+    def test_batch_matches_single_requests(self, make_rows):
+        '''answers every path with the status and body of its own GET, in order.'''
+
+        with app.app_context():
+            heroes, (power,) = make_rows(heroes=2, strength='Average')
+            hero_ids, power_id = [hero.id for hero in heroes], power.id
+            client = app.test_client()
+            paths = [f'/heroes/{hero_ids[0]}', f'/powers/{power_id}', '/heroes/0',
+                     f'/heroes/{hero_ids[1]}?fields[hero]=name&include=',
+                     f'/heroes?ids={hero_ids[1]}', '/unknown']
+
+            response = client.post('/batch', json=paths)
+
+            assert response.status_code == 200
+            assert len(response.json) == len(paths)
+            for path, result in zip(paths[:5], response.json):
+                single = client.get(path)
+                assert result == {'status': single.status_code, 'body': single.json}, path
+            assert response.json[5]['status'] == 404
+
+    def test_batch_groups_lookups(self, make_rows):
+        '''loads the heroes of a batch with one IN query per table, not one lookup per hero.'''
+
+        with app.app_context():
+            heroes, _ = make_rows(heroes=20, strength='Average')
+            hero_ids = [hero.id for hero in heroes]
+            client = app.test_client()
+            with QueryCounter(db.engine) as counter:
+                response = client.post('/batch', json=[f'/heroes/{id}' for id in hero_ids])
+            assert all(result['status'] == 200 for result in response.json)
+            assert counter.count == 2, counter.statements
+
+    def test_batch_errors(self):
+        '''rejects bodies that are not arrays of GET paths.'''
+
+        with app.app_context():
+            client = app.test_client()
+            for body in ({'path': '/heroes'}, ['heroes'],
+                         [{'method': 'DELETE', 'path': '/heroes/1'}]):
+                response = client.post('/batch', json=body)
+                assert response.status_code == 400
+                assert response.json['errors']
+
+    def test_batch_refuses_streams(self):
+        '''rejects paths that stream or long-poll, and never buffers a streamed sub-response.'''
+
+        with app.app_context():
+            client = app.test_client()
+            for path in ('/changes/stream', '/changes?since=0&wait=5',
+                         '/heroes?stream=ndjson', '/powers?stream=json'):
+                response = client.post('/batch', json=['/heroes', path])
+                assert response.status_code == 400
+                assert 'cannot be batched' in response.json['errors'][0]
+            response = client.post('/batch', json=['/changes?wait=0', '/heroes?stream='])
+            assert [result['status'] for result in response.json] == [200, 200]
+
+            with app.test_request_context('/batch', method='POST'):
+                status, body = batch.dispatch('/heroes?stream=ndjson')
+            assert status == 400 and b'cannot be batched' in body
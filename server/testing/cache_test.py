@@ -0,0 +1,157 @@
+from app import app
+from cache import CachedResponse, LRUCache, response_cache
+from models import db, Hero, Power, HeroPower
+from faker import Faker
+
+
+class TestResponseCache:
+    '''ResponseCache in cache.py'''
+
+    def test_serves_cached_response_and_304(self, cache_backend):
+        '''serves a repeated GET from the cache and answers If-None-Match with 304.'''
+
+        with app.app_context():
+            fake = Faker()
+            power = Power(name=fake.name(),
+                          description=fake.sentence(nb_words=10))
+            db.session.add(power)
+            db.session.commit()
+
+            client = app.test_client()
+            first = client.get(f'/powers/{power.id}')
+            etag = first.headers['ETag']
+            assert first.status_code == 200
+
+            # A change made behind the API's back is not seen until invalidated
+            Power.query.filter(Power.id == power.id).update(
+                {'name': 'changed directly'})
+            db.session.commit()
+            second = client.get(f'/powers/{power.id}')
+            assert second.json == first.json
+
+            not_modified = client.get(f'/powers/{power.id}',
+                                      headers={'If-None-Match': etag})
+            assert not_modified.status_code == 304
+            assert not_modified.data == b''
+
+            # Matched with the weak comparison, so a W/ tag from a proxy counts
+            weak = client.get(f'/powers/{power.id}', headers={'If-None-Match': f'W/{etag}'})
+            assert weak.status_code == 304
+
+    def test_ndjson_accept_skips_cache(self, cache_backend):
+        '''streams a list asked for as NDJSON with Accept even when its JSON is cached.'''
+
+        with app.app_context():
+            fake = Faker()
+            db.session.add(Power(name=fake.name(), description=fake.sentence(nb_words=10)))
+            db.session.commit()
+
+            client = app.test_client()
+            assert client.get('/powers').content_type == 'application/json'
+            response = client.get('/powers', headers={'Accept': 'application/x-ndjson'})
+            assert response.content_type == 'application/x-ndjson'
+
+    def test_patch_invalidates_power_and_holders(self, cache_backend):
+        '''PATCH /powers/<id> evicts /powers, /powers/<id> and the heroes holding the power.'''
+
+        with app.app_context():
+            fake = Faker()
+            hero = Hero(name=fake.name(), super_name=fake.name())
+            other = Hero(name=fake.name(), super_name=fake.name())
+            power = Power(name=fake.name(),
+                          description=fake.sentence(nb_words=10))
+            db.session.add_all([hero, other, power,
+                                HeroPower(heroes=hero, power=power, strength='Weak')])
+            db.session.commit()
+
+            client = app.test_client()
+            client.get('/powers')
+            client.get(f'/powers/{power.id}')
+            client.get(f'/heroes/{hero.id}')
+            client.get(f'/heroes/{other.id}')
+            client.get('/heroes')
+
+            description = power.description + ' (patched)'
+            response = client.patch(f'/powers/{power.id}',
+                                    json={'description': description})
+            assert response.status_code == 200
+
+            assert client.get(f'/powers/{power.id}').json['description'] == description
+            assert description in [p['description'] for p in client.get('/powers').json]
+            hero_powers = client.get(f'/heroes/{hero.id}').json['hero_powers']
+            assert hero_powers[0]['power']['description'] == description
+
+            # Unrelated resources stay cached
+            assert cache_backend.get(f'hero:{other.id}|/heroes/{other.id}?')
+            assert cache_backend.get('heroes|/heroes?')
+
+    def test_post_hero_power_invalidates_hero(self, cache_backend):
+        '''POST /hero_powers evicts the detail of the hero that gained the power.'''
+
+        with app.app_context():
+            fake = Faker()
+            hero = Hero(name=fake.name(), super_name=fake.name())
+            power = Power(name=fake.name(),
+                          description=fake.sentence(nb_words=10))
+            db.session.add_all([hero, power])
+            db.session.commit()
+
+            client = app.test_client()
+            assert client.get(f'/heroes/{hero.id}').json['hero_powers'] == []
+            client.post('/hero_powers', json={
+                'strength': 'Strong', 'hero_id': hero.id, 'power_id': power.id})
+            assert len(client.get(f'/heroes/{hero.id}').json['hero_powers']) == 1
+
+    def test_invalidate_drops_only_named_resources(self, cache_backend):
+        '''drops every URL of the resources passed to invalidate() in one call, and no others.'''
+
+        with app.app_context():
+            entry = CachedResponse(b'[]', 'application/json', 'x', ())
+            for key in ('hero:1|/heroes/1?', 'hero:1|/heroes/1?fields%5Bhero%5D=name',
+                        'hero:12|/heroes/12?', 'hero:2|/heroes/2?', 'powers|/powers?'):
+                cache_backend.set(key, entry)
+
+            response_cache.invalidate(*(f'hero:{n}' for n in range(1, 11)))
+            assert cache_backend.get('hero:1|/heroes/1?') is None
+            assert cache_backend.get('hero:1|/heroes/1?fields%5Bhero%5D=name') is None
+            assert cache_backend.get('hero:2|/heroes/2?') is None
+            assert cache_backend.get('hero:12|/heroes/12?') == entry
+            assert cache_backend.get('powers|/powers?') == entry
+
+    def test_key_ignores_unread_params(self, cache_backend):
+        '''files URLs differing only in parameter order or in parameters the view ignores under one key.'''
+
+        with app.app_context():
+            client = app.test_client()
+            client.get('/heroes?limit=5&q=a&x=1')
+            assert cache_backend.get('heroes|/heroes?limit=5&q=a')
+            assert client.get('/heroes?q=a&limit=5&y=2').json == \
+                client.get('/heroes?limit=5&q=a').json
+
+            client.get('/heroes?x=1')
+            client.get('/heroes?fields%5Bhero%5D=name')
+            assert cache_backend.get('heroes|/heroes?')
+            assert cache_backend.get('heroes|/heroes?fields%5Bhero%5D=name')
+            # A parameter the view reads still gets its own answer
+            assert client.get('/heroes?fields%5Bpower%5D=name').status_code == 400
+
+
+class TestLRUCache:
+    '''LRUCache in cache.py'''
+
+    def test_evicts_by_bytes(self):
+        '''evicts the least recently used entries to stay under maxbytes, and skips larger bodies.'''
+
+        cache = LRUCache(maxsize=100, maxbytes=1000)
+        small = CachedResponse(b'x' * 400, 'application/json', 'a', ())
+        cache.set('heroes|/heroes?limit=1', small)
+        cache.set('heroes|/heroes?limit=2', small)
+        cache.get('heroes|/heroes?limit=1')
+        cache.set('heroes|/heroes?limit=3', small)
+        assert cache.get('heroes|/heroes?limit=2') is None
+        assert cache.get('heroes|/heroes?limit=1') == small
+        assert cache.get('heroes|/heroes?limit=3') == small
+
+        cache.set('powers|/powers?', CachedResponse(b'x' * 1001, 'application/json', 'b', ()))
+        assert cache.get('powers|/powers?') is None
+        assert cache.get('heroes|/heroes?limit=3') == small
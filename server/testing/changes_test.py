@@ -0,0 +1,107 @@
+import threading
+import time
+
+import pytest
+
+from app import app
+import changes
+from models import db, Change
+
+
+class TestChangeFeed:
+    '''GET /changes and GET /changes/stream (changes.py)'''
+
+    def test_writes_are_recorded(self, make_rows):
+        '''records every write with the body the API returned for it, in commit order.'''
+
+        with app.app_context():
+            (hero,), (power,) = make_rows()
+            hero_id, power_id = hero.id, power.id
+            client = app.test_client()
+            last = client.get('/changes').json['last']
+
+            patched = client.patch(f'/powers/{power_id}', json={
+                'description': 'a description for the change feed'}).json
+            created = client.post('/hero_powers', json={
+                'strength': 'Weak', 'hero_id': hero_id, 'power_id': power_id}).json
+            client.post('/hero_powers', json={
+                'strength': 'Weak', 'hero_id': hero_id, 'power_id': power_id})
+
+            feed = client.get(f'/changes?since={last}').json
+            assert [(c['resource'], c['action'], c['id']) for c in feed['changes']] == [
+                ('power', 'update', power_id), ('hero_power', 'create', created['id'])]
+            assert feed['changes'][0]['data'] == patched
+            assert feed['changes'][1]['data'] == {
+                key: created[key] for key in ('id', 'hero_id', 'power_id', 'strength')}
+            assert feed['last'] == feed['changes'][1]['seq'] == last + 2
+            assert feed['more'] is False
+
+            assert client.get(f"/changes?since={feed['last']}").json['changes'] == []
+
+    # The writer runs in another thread, with its own session
+    @pytest.mark.commits
+    def test_long_poll_wakes_on_commit(self, make_rows):
+        '''holds a request with wait= until a change is committed, then returns it.'''
+
+        with app.app_context():
+            _, (power,) = make_rows(heroes=0)
+            power_id = power.id
+            client = app.test_client()
+            last = client.get('/changes').json['last']
+
+            def patch_later():
+                time.sleep(0.2)
+                with app.app_context():
+                    app.test_client().patch(f'/powers/{power_id}', json={
+                        'description': 'committed while a client waits'})
+
+            writer = threading.Thread(target=patch_later)
+            start = time.monotonic()
+            writer.start()
+            response = client.get(f'/changes?since={last}&wait=5')
+            elapsed = time.monotonic() - start
+            writer.join()
+
+            assert [c['id'] for c in response.json['changes']] == [power_id]
+            assert 0.2 <= elapsed < 2
+
+    def test_event_stream(self, make_rows):
+        '''streams the changes after Last-Event-ID as server-sent events.'''
+
+        with app.app_context():
+            _, (power,) = make_rows(heroes=0)
+            power_id = power.id
+            client = app.test_client()
+            last = client.get('/changes').json['last']
+            client.patch(f'/powers/{power_id}', json={
+                'description': 'sent down the event stream'})
+
+            response = client.get('/changes/stream', headers={'Last-Event-ID': str(last)},
+                                  buffered=False)
+            assert response.mimetype == 'text/event-stream'
+            events = iter(response.response)
+            assert next(events) == b'retry: 3000\n\n'
+            event = next(events)
+            response.close()
+            assert event.startswith(b'id: %d\nevent: change\ndata: {' % (last + 1))
+            assert b'sent down the event stream' in event
+
+    def test_expired_and_invalid_since(self, make_rows):
+        '''answers 410 for a since older than the log kept, and 400 for bad arguments.'''
+
+        with app.app_context():
+            _, (power,) = make_rows(heroes=0)
+            power_id = power.id
+            client = app.test_client()
+            for description in ('the first of two descriptions', 'the second of two descriptions'):
+                client.patch(f'/powers/{power_id}', json={'description': description})
+            last = client.get('/changes').json['last']
+            Change.query.update({'created': 0})
+            db.session.commit()
+
+            assert changes.prune(60) >= 1
+            assert client.get(f'/changes?since={last - 2}').status_code == 410
+            assert client.get(f'/changes?since={last - 1}').status_code == 200
+
+            for query in ('since=x', 'since=-1', 'since=0&wait=100'):
+                assert client.get(f'/changes?{query}').status_code == 400
@@ -0,0 +1,89 @@
+import gzip
+
+from app import app
+from compression import CODECS, compression
+from models import db, Power
+from faker import Faker
+
+
+def add_powers(count=20):
+    # Enough rows for /powers to pass COMPRESSION_MIN_SIZE
+    fake = Faker()
+    db.session.add_all([Power(name=fake.name(), description=fake.sentence(nb_words=10))
+                        for _ in range(count)])
+    db.session.commit()
+
+
+class TestCompression:
+    '''Compression in compression.py'''
+
+    def test_compresses_large_responses(self):
+        '''gzips responses above COMPRESSION_MIN_SIZE for clients that accept it.'''
+
+        with app.app_context():
+            add_powers()
+            client = app.test_client()
+            plain = client.get('/powers')
+            response = client.get('/powers', headers={'Accept-Encoding': 'gzip'})
+
+            assert 'Content-Encoding' not in plain.headers
+            assert response.headers['Content-Encoding'] == 'gzip'
+            assert 'Accept-Encoding' in response.headers['Vary']
+            assert gzip.decompress(response.get_data()) == plain.get_data()
+
+    def test_negotiates_by_quality(self):
+        '''picks the encoding the client ranks highest, and none for small bodies.'''
+
+        with app.app_context():
+            add_powers()
+            client = app.test_client()
+            for encoding in CODECS:
+                others = ', '.join(f'{name};q=0.5' for name in CODECS if name != encoding)
+                response = client.get('/powers', headers={
+                    'Accept-Encoding': f'{encoding};q=1, {others}'})
+                assert response.headers['Content-Encoding'] == encoding
+
+            response = client.get('/heroes/0', headers={'Accept-Encoding': 'gzip'})
+            assert 'Content-Encoding' not in response.headers
+
+    def test_cached_variants_compressed_once(self, cache_backend, monkeypatch):
+        '''compresses a cached response in an encoding when first asked for it, and serves hits from that copy.'''
+
+        calls = []
+        compress = compression.compress
+        monkeypatch.setattr(compression, 'compress',
+                            lambda body, encoding: calls.append(encoding) or compress(body, encoding))
+
+        with app.app_context():
+            add_powers()
+            client = app.test_client()
+            plain = client.get('/powers')
+            assert calls == []
+
+            for _ in range(3):
+                response = client.get('/powers', headers={'Accept-Encoding': 'gzip'})
+                assert response.headers['Content-Encoding'] == 'gzip'
+                assert gzip.decompress(response.get_data()) == plain.get_data()
+            assert calls == ['gzip']
+
+            for encoding in CODECS:
+                client.get('/powers', headers={'Accept-Encoding': encoding})
+                client.get('/powers', headers={'Accept-Encoding': encoding})
+            assert sorted(calls) == sorted(CODECS)
+
+    def test_encodings_have_their_own_etag(self, cache_backend):
+        '''tags each encoding of a body with its own strong ETag and accepts any of them back.'''
+
+        with app.app_context():
+            add_powers()
+            client = app.test_client()
+            plain = client.get('/powers')
+            etag = plain.headers['ETag']
+            for encoding in CODECS:
+                response = client.get('/powers', headers={'Accept-Encoding': encoding})
+                assert response.headers['ETag'] == f'{etag[:-1]}-{encoding}"'
+
+                not_modified = client.get('/powers', headers={
+                    'If-None-Match': response.headers['ETag']})
+                assert not_modified.status_code == 304
+                assert not_modified.headers['ETag'] == etag
@@ -0,0 +1,105 @@
+from app import app
+from instrumentation import QueryCounter
+from models import db, Power
+from sqlalchemy import text
+
+
+class TestConditionalPatch:
+    '''If-Match handling of PATCH /powers/<int:id> (concurrency.py)'''
+
+    def test_patch_with_current_etag(self, make_rows):
+        '''applies a PATCH whose If-Match names the current version with one UPDATE and returns the next ETag.'''
+
+        with app.app_context():
+            _, (power,) = make_rows(heroes=0)
+            client = app.test_client()
+            etag = client.get(f'/powers/{power.id}').headers['ETag']
+
+            with QueryCounter(db.engine) as counter:
+                response = client.patch(
+                    f'/powers/{power.id}', headers={'If-Match': etag},
+                    json={'description': 'a description changed with If-Match'})
+
+            assert response.status_code == 200
+            assert response.json['description'] == 'a description changed with If-Match'
+            assert response.headers['ETag'] != etag
+            # No SELECT of the power; the other statements record the
+            # change feed entry and find the heroes whose cached detail to
+            # invalidate
+            assert counter.statements[0].startswith('UPDATE powers'), counter.statements
+            assert counter.statements[1].startswith('INSERT INTO changes'), counter.statements
+            assert not any('FROM powers' in s for s in counter.statements)
+            assert counter.count == 3, counter.statements
+
+            # The returned ETag is good for the next PATCH
+            response = client.patch(
+                f'/powers/{power.id}', headers={'If-Match': response.headers['ETag']},
+                json={'description': 'a second change made with If-Match'})
+            assert response.status_code == 200
+
+            # So is the tag of a compressed response
+            etag = response.headers['ETag']
+            response = client.patch(
+                f'/powers/{power.id}', headers={'If-Match': f'{etag[:-1]}-gzip"'},
+                json={'description': 'a third change made with If-Match'})
+            assert response.status_code == 200
+
+    def test_412_on_stale_etag(self, make_rows):
+        '''returns 412 and leaves the power alone when If-Match names an older version.'''
+
+        with app.app_context():
+            _, (power,) = make_rows(heroes=0)
+            client = app.test_client()
+            stale = client.get(f'/powers/{power.id}').headers['ETag']
+            client.patch(f'/powers/{power.id}',
+                         json={'description': 'written by another client first'})
+
+            response = client.patch(
+                f'/powers/{power.id}', headers={'If-Match': stale},
+                json={'description': 'written with an outdated version'})
+
+            assert response.status_code == 412
+            assert response.json['errors'] == ["Power has been modified"]
+            assert db.session.get(Power, power.id).description == \
+                'written by another client first'
+
+            # Tags this app never issued cannot match either
+            response = client.patch(
+                f'/powers/{power.id}', headers={'If-Match': '"not-a-version"'},
+                json={'description': 'written with a made up version'})
+            assert response.status_code == 412
+
+    def test_412_when_unconditional_patch_loses_the_race(self, monkeypatch, make_rows):
+        '''returns the same 412 when a PATCH without If-Match is overtaken by another update.'''
+
+        import app as app_module
+
+        with app.app_context():
+            _, (power,) = make_rows(heroes=0)
+            record = app_module.changes.record
+
+            def overtaken(*args):
+                # Another request commits its update after this one read the power
+                with db.session.no_autoflush:
+                    db.session.execute(text(
+                        'UPDATE powers SET version = version + 1 WHERE id = :id'),
+                        {'id': power.id})
+                return record(*args)
+
+            monkeypatch.setattr(app_module.changes, 'record', overtaken)
+            response = app.test_client().patch(
+                f'/powers/{power.id}',
+                json={'description': 'written over a version that moved on'})
+
+            assert response.status_code == 412
+            assert response.json['errors'] == ["Power has been modified"]
+
+    def test_404_with_if_match(self):
+        '''returns 404 for a conditional PATCH of a power that does not exist.'''
+
+        with app.app_context():
+            response = app.test_client().patch(
+                '/powers/0', headers={'If-Match': '"v1"'},
+                json={'description': 'a description for nobody at all'})
+            assert response.status_code == 404
+            assert response.json.get('error')
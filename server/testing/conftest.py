@@ -1,4 +1,162 @@
 #!/usr/bin/env python3
+"""
+Test database harness.
+
+Every test process (each pytest-xdist worker, or the single process
+without it) gets its own SQLite file in a temporary directory, created
+empty from the models and kept as a template. The tests never touch
+app.db, and workers never touch each other's files.
+
+Each test runs inside a transaction that is rolled back when it ends: the
+session is bound to one connection holding BEGIN and a SAVEPOINT, so
+db.session.commit() inside the test (or inside the views it calls)
+commits nothing, and db.session.rollback() returns to the SAVEPOINT. Every
+test starts from the same empty tables however many ran before it.
+
+Tests whose writes must really be committed, because other threads or
+processes read them through their own connections, are marked
+``@pytest.mark.commits``; the worker's file is restored from the template
+after each of them.
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+
+import pytest
+from sqlalchemy import event
+
+# The response cache stays on as configured; it is emptied before each
+# test. The suite writes faster than the write rate limit allows, though;
+# limits_test.py installs its own backends.
+os.environ.setdefault('LIMITS_BACKEND', 'none')
+
+# One directory per test process; app.py reads DB_URI when it is imported,
+# which happens after this module is loaded
+_db_dir = tempfile.mkdtemp(
+    prefix=f"superheroes-{os.environ.get('PYTEST_XDIST_WORKER', 'main')}-")
+DB_PATH = os.path.join(_db_dir, 'test.db')
+TEMPLATE_PATH = os.path.join(_db_dir, 'template.db')
+os.environ['DB_URI'] = f'sqlite:///{DB_PATH}'
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        'markers', "commits: run outside the per-test rollback; the test "
+                   "database is restored from the template afterwards")
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_db_dir, ignore_errors=True)
+
+
+def _copy(source, target):
+    # sqlite3's backup API copies a consistent snapshot, WAL included, and
+    # overwrites the target in place
+    src, dst = sqlite3.connect(source), sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+
+
+@pytest.fixture(scope='session')
+def test_app():
+    from app import app
+    from models import db
+
+    with app.app_context():
+        db.create_all()
+        db.engine.dispose()
+    _copy(DB_PATH, TEMPLATE_PATH)
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+
+
+@pytest.fixture(autouse=True)
+def database(request, test_app):
+    from cache import response_cache
+    from models import db
+
+    with test_app.app_context():
+        # Responses cached by an earlier test describe rows rolled back since
+        response_cache.clear()
+        if request.node.get_closest_marker('commits'):
+            yield
+            db.session.remove()
+            db.engine.dispose()
+            _copy(TEMPLATE_PATH, DB_PATH)
+            return
+
+        connection = db.engine.connect()
+        outer = connection.begin()
+        # pysqlite only opens a transaction before DML; without an explicit
+        # BEGIN the SAVEPOINT below would be the outermost transaction and
+        # releasing it would commit
+        connection.exec_driver_sql('BEGIN')
+        savepoint = connection.begin_nested()
+
+        app_session = db.session
+        db.session = db.create_scoped_session({'bind': connection, 'binds': {}})
+
+        @event.listens_for(db.session.session_factory, 'after_transaction_end')
+        def restart_savepoint(session, transaction):
+            # A rollback in the test ends the SAVEPOINT; start the next one
+            nonlocal savepoint
+            if not savepoint.is_active:
+                savepoint = connection.begin_nested()
+
+        try:
+            yield
+        finally:
+            db.session.remove()
+            db.session = app_session
+            outer.rollback()
+            connection.close()
+
+
+@pytest.fixture
+def make_rows(test_app):
+    """
+    Returns ``make_rows(heroes=1, powers=1, strength=None)``, which commits
+    that many heroes and powers with Faker names and returns them as
+    ``(heroes, powers)`` lists. With ``strength``, every new hero holds
+    every new power at that strength.
+    """
+    from faker import Faker
+    from models import db, Hero, HeroPower, Power
+
+    fake = Faker()
+
+    def make(heroes=1, powers=1, strength=None):
+        heroes = [Hero(name=fake.name(), super_name=fake.name()) for _ in range(heroes)]
+        powers = [Power(name=fake.name(), description=fake.sentence(nb_words=10))
+                  for _ in range(powers)]
+        db.session.add_all([*heroes, *powers])
+        db.session.commit()
+        if strength is not None:
+            db.session.add_all([HeroPower(strength=strength, hero_id=hero.id, power_id=power.id)
+                                for hero in heroes for power in powers])
+            db.session.commit()
+        return heroes, powers
+    return make
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def cache_backend(request, test_app, tmp_path):
+    # Runs the test once with each response cache backend installed
+    from cache import LRUCache, SQLiteCache
+
+    backend = LRUCache() if request.param == 'memory' \
+        else SQLiteCache(str(tmp_path / 'cache.db'))
+    previous = test_app.extensions['response_cache']
+    test_app.extensions['response_cache'] = backend
+    yield backend
+    test_app.extensions['response_cache'] = previous
+
 
 def pytest_itemcollected(item):
     par = item.parent.obj
@@ -6,4 +164,4 @@ def pytest_itemcollected(item):
     pref = par.__doc__.strip() if par.__doc__ else par.__class__.__name__
     suf = node.__doc__.strip() if node.__doc__ else node.__name__
     if pref or suf:
-        item._nodeid = ' '.join((pref, suf))
\ No newline at end of file
+        item._nodeid = ' '.join((pref, suf))
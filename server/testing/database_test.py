@@ -0,0 +1,95 @@
+import pytest
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+from app import BASE_DIR, create_app
+from database import PRODUCTION_PRAGMAS, database_config
+from models import db, Hero, Power
+
+
+def file_app(tmp_path, **environ):
+    # An app on a database file of its own, configured from ``environ``
+    environ.setdefault('DB_URI', f"sqlite:///{tmp_path / 'profile.db'}")
+    app = create_app(database_config(BASE_DIR, environ))
+    with app.app_context():
+        # The primary only: a read bind may be read-only
+        db.create_all(bind=None)
+    return app
+
+
+def statements(engine):
+    # Records the SQL each engine runs
+    seen = []
+    event.listen(engine, 'before_cursor_execute',
+                 lambda conn, cursor, statement, *args: seen.append(statement.split()[0]))
+    return seen
+
+
+class TestDatabaseConfig:
+    '''Engine profiles and read/write routing in database.py'''
+
+    def test_profiles(self):
+        '''pools SQLite files with PRAGMAs under production and leaves them alone under default.'''
+
+        config = database_config(BASE_DIR, {
+            'DB_URI': 'sqlite:////tmp/x.db', 'SQLITE_BUSY_TIMEOUT': '100',
+            'DB_POOL_SIZE': '3'})
+        options = config['SQLALCHEMY_ENGINE_OPTIONS']
+        assert options['sqlite_pragmas'] == dict(PRODUCTION_PRAGMAS, busy_timeout='100')
+        assert options['poolclass'] is QueuePool and options['pool_size'] == 3
+        assert 'SQLALCHEMY_BINDS' not in config
+
+        config = database_config(BASE_DIR, {'DB_URI': 'sqlite:////tmp/x.db',
+                                            'DB_PROFILE': 'default'})
+        assert config['SQLALCHEMY_ENGINE_OPTIONS'] == {}
+
+        # In-memory databases get the PRAGMAs but no pool of their own
+        options = database_config(BASE_DIR, {'DB_URI': 'sqlite://'})['SQLALCHEMY_ENGINE_OPTIONS']
+        assert 'sqlite_pragmas' in options and 'poolclass' not in options
+
+        options = database_config(BASE_DIR, {
+            'DB_URI': 'postgresql://db/heroes', 'DB_POOL_RECYCLE': '60'})['SQLALCHEMY_ENGINE_OPTIONS']
+        assert options['pool_recycle'] == 60 and options['pool_pre_ping']
+
+    # The apps below use their own engines, outside the per-test rollback
+    @pytest.mark.commits
+    def test_production_pragmas_and_pool(self, tmp_path):
+        '''applies the PRAGMAs to every connection and pools them.'''
+
+        app = file_app(tmp_path, DB_POOL_SIZE='2', SQLITE_BUSY_TIMEOUT='1234')
+        with app.app_context():
+            engine = db.get_engine(app)
+            with engine.connect() as conn:
+                assert conn.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+                assert conn.exec_driver_sql('PRAGMA busy_timeout').scalar() == 1234
+                assert conn.exec_driver_sql('PRAGMA synchronous').scalar() == 1  # NORMAL
+            assert isinstance(engine.pool, QueuePool) and engine.pool.size() == 2
+            engine.dispose()
+
+    @pytest.mark.commits
+    def test_reads_use_the_read_bind(self, tmp_path):
+        '''runs GET requests on DB_READ_URI and writes on the primary database.'''
+
+        path = tmp_path / 'profile.db'
+        app = file_app(tmp_path, DB_READ_URI=f'sqlite:///file:{path}?mode=ro&uri=true')
+        with app.app_context():
+            primary, read = db.get_engine(app), db.get_engine(app, bind='read')
+            db.session.add_all([Hero(name='Kal', super_name='Superman'),
+                                Power(name='Flight', description='flies far above the clouds')])
+            db.session.commit()
+            db.session.remove()
+            on_primary, on_read = statements(primary), statements(read)
+
+            client = app.test_client()
+            assert client.get('/heroes').json[0]['name'] == 'Kal'
+            assert on_read and set(on_read) == {'SELECT'}
+            assert on_primary == []
+
+            on_read.clear()
+            response = client.post('/hero_powers', json={
+                'strength': 'Weak', 'hero_id': 1, 'power_id': 1})
+            assert response.status_code == 200
+            assert 'INSERT' in on_primary
+            assert on_read == []
+            primary.dispose()
+            read.dispose()
@@ -0,0 +1,76 @@
+from app import app
+from instrumentation import QueryCounter
+from models import db
+
+
+class TestSparseFieldsets:
+    '''fields[...] and include on the read endpoints (fieldsets.py)'''
+
+    def test_list_fields(self, make_rows):
+        '''returns and SELECTs only the requested columns of a list, paged or not.'''
+
+        with app.app_context():
+            make_rows(heroes=2, powers=2, strength='Strong')
+            client = app.test_client()
+            with QueryCounter(db.engine) as counter:
+                response = client.get('/heroes?fields[hero]=name')
+            assert response.status_code == 200
+            assert all(hero.keys() == {'name'} for hero in response.json)
+            assert 'super_name' not in counter.statements[0]
+
+            response = client.get('/powers?fields[power]=id,name&limit=1')
+            assert response.json[0].keys() == {'id', 'name'}
+            assert 'X-Next-Cursor' in response.headers
+
+    def test_hero_include(self, make_rows):
+        '''embeds only the included relationships of a hero, with their own fieldsets.'''
+
+        with app.app_context():
+            (hero,), _ = make_rows(strength='Strong')
+            hero_id = hero.id
+            client = app.test_client()
+            full = client.get(f'/heroes/{hero_id}').json
+
+            with QueryCounter(db.engine) as counter:
+                response = client.get(f'/heroes/{hero_id}?fields[hero]=name&include=')
+            assert response.json == {'name': full['name']}
+            assert counter.count == 1
+
+            response = client.get(f'/heroes/{hero_id}?include=hero_powers')
+            assert response.json['hero_powers'] == [
+                {key: value for key, value in full['hero_powers'][0].items() if key != 'power'}]
+
+            with QueryCounter(db.engine) as counter:
+                response = client.get(
+                    f'/heroes/{hero_id}?fields[hero]=name&fields[hero_power]=strength'
+                    '&fields[power]=name&include=hero_powers.power')
+            assert response.json == {'name': full['name'], 'hero_powers': [
+                {'strength': 'Strong', 'power': {'name': full['hero_powers'][0]['power']['name']}}]}
+            assert counter.count == 2
+            assert 'description' not in counter.statements[1]
+
+    def test_power_fields_keep_etag(self, make_rows):
+        '''returns only the requested power fields and still sends the version ETag.'''
+
+        with app.app_context():
+            _, (power,) = make_rows(strength='Strong')
+            power_id = power.id
+            client = app.test_client()
+            full = client.get(f'/powers/{power_id}')
+            response = client.get(f'/powers/{power_id}?fields[power]=name')
+            assert response.json == {'name': full.json['name']}
+            assert response.headers['ETag'] == full.headers['ETag']
+
+    def test_invalid_fieldsets(self, make_rows):
+        '''returns 400 for unknown fields, types or includes.'''
+
+        with app.app_context():
+            (hero,), _ = make_rows(strength='Strong')
+            hero_id = hero.id
+            client = app.test_client()
+            for url in ('/heroes?fields[hero]=version', '/heroes?fields[power]=name',
+                        '/powers?include=hero_powers', f'/heroes/{hero_id}?include=heroes',
+                        f'/heroes/{hero_id}?fields[power]=version'):
+                response = client.get(url)
+                assert response.status_code == 400, url
+                assert response.json['errors']
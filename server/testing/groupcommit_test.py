@@ -0,0 +1,84 @@
+import threading
+
+from app import app
+from models import db, HeroPower
+from sqlalchemy import event
+import pytest
+
+
+@pytest.fixture
+def grouped():
+    # A window long enough for every test thread to join the first batch
+    batches = app.extensions['group_commit']
+    previous = (batches.enabled, batches.window, batches.max_rows)
+    batches.enabled, batches.window, batches.max_rows = True, 0.2, 64
+    yield batches
+    batches.enabled, batches.window, batches.max_rows = previous
+
+
+def post_concurrently(bodies):
+    # POSTs every body from its own thread; returns the responses in order
+    responses = [None] * len(bodies)
+
+    def post(index, body):
+        responses[index] = app.test_client().post('/hero_powers', json=body)
+
+    threads = [threading.Thread(target=post, args=item) for item in enumerate(bodies)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return responses
+
+
+# Rows are written by whichever request thread leads the group
+@pytest.mark.commits
+class TestGroupCommit:
+    '''GroupCommit in groupcommit.py'''
+
+    def test_commits_concurrent_rows_together(self, grouped, make_rows):
+        '''writes the rows of concurrent POST /hero_powers in one transaction and answers each with its own row.'''
+
+        with app.app_context():
+            (hero,), powers = make_rows(powers=8)
+            hero_id, power_ids = hero.id, [power.id for power in powers]
+            commits = []
+            listener = lambda conn: commits.append(1)
+            event.listen(db.engine, 'commit', listener)
+            try:
+                responses = post_concurrently([
+                    {'strength': 'Strong', 'power_id': power_id, 'hero_id': hero_id}
+                    for power_id in power_ids])
+            finally:
+                event.remove(db.engine, 'commit', listener)
+
+            assert [response.status_code for response in responses] == [200] * 8
+            assert [response.json['power_id'] for response in responses] == power_ids
+            assert len(commits) == 1
+
+            stored = {hp.id: hp.power_id for hp in
+                      HeroPower.query.filter(HeroPower.hero_id == hero_id)}
+            assert {response.json['id']: response.json['power_id']
+                    for response in responses} == stored
+
+    def test_conflicts_reported_to_their_caller(self, grouped, make_rows):
+        '''answers 409 only to the requests whose pair is taken and commits the rest of the batch.'''
+
+        with app.app_context():
+            (hero,), powers = make_rows(powers=3)
+            hero_id, power_ids = hero.id, [power.id for power in powers]
+            db.session.add(HeroPower(strength='Weak', hero_id=hero_id, power_id=power_ids[0]))
+            db.session.commit()
+
+            responses = post_concurrently([
+                {'strength': 'Strong', 'power_id': power_ids[0], 'hero_id': hero_id},
+                {'strength': 'Strong', 'power_id': power_ids[1], 'hero_id': hero_id},
+                {'strength': 'Average', 'power_id': power_ids[2], 'hero_id': hero_id},
+                {'strength': 'Weak', 'power_id': power_ids[2], 'hero_id': hero_id},
+            ])
+
+            statuses = [response.status_code for response in responses]
+            assert statuses[:2] == [409, 200]
+            # The same new pair twice: one of the two gets it
+            assert sorted(statuses[2:]) == [200, 409]
+            assert HeroPower.query.filter(HeroPower.hero_id == hero_id).count() == 3
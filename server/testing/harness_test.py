@@ -0,0 +1,51 @@
+import os
+
+from sqlalchemy.exc import IntegrityError
+
+from app import app
+from models import db, Hero, HeroPower
+
+
+class TestHarness:
+    '''Per-test database and rollback in conftest.py'''
+
+    def test_uses_a_test_database(self):
+        '''runs against a temporary file of its own, never app.db.'''
+
+        with app.app_context():
+            path = db.engine.url.database
+            assert os.path.basename(path) == 'test.db'
+            assert path != os.path.join(app.root_path, 'app.db')
+
+    def test_starts_empty(self, make_rows):
+        '''starts from empty tables, whatever the tests before it committed.'''
+
+        with app.app_context():
+            assert Hero.query.count() == 0
+            make_rows(powers=0)
+            assert len(app.test_client().get('/heroes').json) == 1
+
+    def test_starts_empty_again(self, make_rows):
+        '''the same, so whichever of the two runs second sees the other rolled back.'''
+
+        self.test_starts_empty(make_rows)
+
+    def test_rollback_keeps_earlier_commits(self, make_rows):
+        '''returns a failed write to the last commit, not to the start of the test.'''
+
+        with app.app_context():
+            (hero,), (power,) = make_rows()
+            link = {'hero_id': hero.id, 'power_id': power.id, 'strength': 'Weak'}
+            db.session.add(HeroPower(**link))
+            db.session.commit()
+
+            db.session.add(HeroPower(**link))
+            try:
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+            else:
+                raise AssertionError("the duplicate hero_power was committed")
+
+            assert Hero.query.count() == 1
+            assert HeroPower.query.count() == 1
@@ -0,0 +1,46 @@
+import logging
+
+from app import app
+from models import db, Hero
+from faker import Faker
+
+
+class TestRequestMetrics:
+    '''RequestMetrics in instrumentation.py'''
+
+    def test_exposes_prometheus_histograms(self):
+        '''exposes per-route wall time, SQL counts and response sizes at /metrics.'''
+
+        with app.app_context():
+            fake = Faker()
+            hero = Hero(name=fake.name(), super_name=fake.name())
+            db.session.add(hero)
+            db.session.commit()
+
+            client = app.test_client()
+            client.get(f'/heroes/{hero.id}')
+            response = client.get('/metrics')
+
+            assert response.status_code == 200
+            assert response.mimetype == 'text/plain'
+            text = response.get_data(as_text=True)
+            labels = 'method="GET",route="/heroes/<int:id>"'
+            assert f'http_request_duration_seconds_count{{{labels},status="200"}}' in text
+            assert f'http_request_sql_statements_bucket{{{labels},le="+Inf"}}' in text
+            assert f'http_response_size_bytes_count{{{labels}}}' in text
+            assert 'route="/metrics"' not in text
+
+    def test_logs_slow_requests_with_sql(self, caplog):
+        '''logs a warning with the SQL of requests slower than METRICS_SLOW_REQUEST_MS.'''
+
+        threshold = app.config['METRICS_SLOW_REQUEST_MS']
+        app.config['METRICS_SLOW_REQUEST_MS'] = 0
+        try:
+            with caplog.at_level(logging.WARNING):
+                app.test_client().get('/heroes/0')
+        finally:
+            app.config['METRICS_SLOW_REQUEST_MS'] = threshold
+
+        messages = [r.getMessage() for r in caplog.records if 'slow request' in r.getMessage()]
+        assert messages
+        assert 'FROM heroes' in messages[0]
@@ -0,0 +1,46 @@
+import json
+
+from app import app
+from jsonprovider import FastJSONProvider, RawJSON
+from models import db, Power
+from faker import Faker
+
+
+class TestFastJSONProvider:
+    '''FastJSONProvider in jsonprovider.py'''
+
+    def test_compact_unless_pretty_requested(self):
+        '''sends compact JSON, and indented JSON for ?pretty=1.'''
+
+        with app.app_context():
+            fake = Faker()
+            power = Power(name=fake.name(), description=fake.sentence(nb_words=10))
+            db.session.add(power)
+            db.session.commit()
+
+            client = app.test_client()
+            compact = client.get(f'/powers/{power.id}')
+            pretty = client.get(f'/powers/{power.id}?pretty=1')
+
+            assert compact.get_data() == json.dumps(
+                compact.json, separators=(',', ':'), sort_keys=True,
+                ensure_ascii=False).encode()
+            assert b'\n  "description"' in pretty.get_data()
+            assert pretty.json == compact.json
+
+    def test_raw_json_is_sent_as_is(self):
+        '''sends RawJSON bytes unchanged, and reformats them only for ?pretty=1.'''
+
+        body = RawJSON(b'{"b":1,"a":[1,2]}')
+        with app.test_request_context('/'):
+            assert app.json.response(body).get_data() == body
+        with app.test_request_context('/?pretty=1'):
+            assert json.loads(app.json.response(body).get_data()) == {"a": [1, 2], "b": 1}
+
+    def test_matches_standard_library(self):
+        '''encodes the same documents as the json module, including values orjson rejects.'''
+
+        provider = FastJSONProvider(app)
+        for value in ({"é": "ü", "n": [1, 2.5, None, True]}, {"big": 2 ** 70}):
+            assert json.loads(provider.encode(value)) == value
+            assert provider.loads(provider.dumps(value)) == value
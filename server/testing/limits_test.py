@@ -0,0 +1,128 @@
+import threading
+import time
+
+from app import app, create_app
+from limits import (AdaptiveLimit, Limits, LocalSlots, MemoryBuckets, SQLiteBuckets,
+                    SQLiteSlots)
+from models import db, Power
+from faker import Faker
+import pytest
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def limits(request, tmp_path):
+    if request.param == 'memory':
+        buckets, slots = MemoryBuckets(), LocalSlots()
+    else:
+        path = str(tmp_path / 'limits.db')
+        buckets, slots = SQLiteBuckets(path), SQLiteSlots(path)
+    previous = app.extensions['write_limiter']
+    limits = Limits(dict(app.config))
+    limits.buckets, limits.slots = buckets, slots
+    app.extensions['write_limiter'] = limits
+    yield limits
+    app.extensions['write_limiter'] = previous
+
+
+def patch_power(client, power_id, **kwargs):
+    return client.patch(f'/powers/{power_id}', json={
+        'description': 'a description long enough to pass'}, **kwargs)
+
+
+class TestWriteLimiter:
+    '''WriteLimiter in limits.py'''
+
+    def test_rate_limits_each_client(self, limits):
+        '''answers 429 with Retry-After once a client has spent its burst, without limiting reads.'''
+
+        limits.rate, limits.burst = 0.5, 2
+        with app.app_context():
+            fake = Faker()
+            power = Power(name=fake.name(), description=fake.sentence(nb_words=10))
+            db.session.add(power)
+            db.session.commit()
+
+            client = app.test_client()
+            assert patch_power(client, power.id).status_code == 200
+            assert patch_power(client, power.id).status_code == 200
+            response = patch_power(client, power.id)
+            assert response.status_code == 429
+            assert int(response.headers['Retry-After']) >= 1
+            assert client.get(f'/powers/{power.id}').status_code == 200
+
+            other = app.test_client()
+            response = other.patch(
+                f'/powers/{power.id}', environ_base={'REMOTE_ADDR': '10.0.0.2'},
+                json={'description': 'a description from another client'})
+            assert response.status_code == 200
+
+    def test_trusted_proxies(self):
+        '''keys the buckets on X-Forwarded-For only when TRUSTED_PROXIES says a proxy sets it.'''
+
+        def statuses(app):
+            # Two clients behind one proxy, a write each
+            client = app.test_client()
+            return [patch_power(client, 0, headers={'X-Forwarded-For': address}).status_code
+                    for address in ('10.0.0.1', '10.0.0.2')]
+
+        config = {'LIMITS_BACKEND': 'memory', 'WRITE_RATE_LIMIT': 0.5, 'WRITE_RATE_BURST': 1}
+        assert statuses(create_app(config)) == [404, 429]
+        assert statuses(create_app(dict(config, TRUSTED_PROXIES=1))) == [404, 404]
+
+    def test_sheds_writes_over_the_limit(self, limits):
+        '''answers 503 with Retry-After when every slot is taken and the queue wait runs out.'''
+
+        slots = limits.slots
+        limits.rate = 0
+        limits.limit = AdaptiveLimit(initial=1, maximum=1)
+        limits.queue_timeout = 0.05
+        with app.app_context():
+            token = slots.acquire(limits.limit, 10, 0)
+            assert token is not None
+            try:
+                response = patch_power(app.test_client(), 0)
+            finally:
+                slots.release(token)
+            assert response.status_code == 503
+            assert response.headers['Retry-After'] == '1'
+
+            # With the slot free again the write goes through (and 404s)
+            assert patch_power(app.test_client(), 0).status_code == 404
+
+
+class TestSlots:
+    '''LocalSlots and SQLiteSlots in limits.py'''
+
+    def test_queue_is_bounded(self, limits):
+        '''queues up to max_queue writes for a slot and sheds the rest.'''
+
+        slots = limits.slots
+        limit = AdaptiveLimit(initial=1, maximum=1)
+        first = slots.acquire(limit, 1, 1.0)
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(slots.acquire(limit, 1, 5.0)))
+        waiter.start()
+        time.sleep(0.2)
+
+        # The queue is full, so this write is shed at once instead of waiting
+        start = time.monotonic()
+        assert slots.acquire(limit, 1, 1.0) is None
+        assert time.monotonic() - start < 0.5
+
+        slots.release(first)
+        waiter.join(5)
+        assert results and results[0] is not None
+        slots.release(results[0])
+
+    def test_adaptive_limit(self):
+        '''grows the limit while writes are fast and cuts it when they are slow or fail.'''
+
+        limit = AdaptiveLimit(initial=4, minimum=1, maximum=8, target=0.05)
+        for _ in range(40):
+            limit.update(0.001, True)
+        assert limit() == 8
+        limit.update(0.5, True)
+        assert limit() == 6
+        for _ in range(20):
+            limit.update(0.001, False)
+        assert limit() == 1
@@ -0,0 +1,50 @@
+from app import app
+from instrumentation import QueryCounter
+from models import db
+
+
+def plans_touching(executed, table):
+    '''EXPLAIN QUERY PLAN details for every executed SELECT that reads table.'''
+
+    details = []
+    with db.engine.connect() as conn:
+        for statement, parameters in executed:
+            if not statement.lstrip().upper().startswith('SELECT') \
+                    or table not in statement:
+                continue
+            rows = conn.exec_driver_sql(
+                'EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+            details.extend(row[-1] for row in rows if table in row[-1])
+    return details
+
+
+class TestQueryPlans:
+    '''Indexes on hero_powers in models.py'''
+
+    def test_hero_detail_searches_hero_powers(self, make_rows):
+        '''GET /heroes/<id> reads hero_powers through an index, not a table scan.'''
+
+        with app.app_context():
+            (hero,), _ = make_rows(strength='Strong')
+            with QueryCounter(db.engine) as counter:
+                assert app.test_client().get(f'/heroes/{hero.id}').status_code == 200
+
+            details = plans_touching(counter.executed, 'hero_powers')
+            assert details
+            assert all(detail.startswith('SEARCH') for detail in details), details
+
+    def test_power_holders_use_covering_index(self, make_rows):
+        '''PATCH /powers/<id> finds the heroes holding the power from the covering index.'''
+
+        with app.app_context():
+            _, (power,) = make_rows(strength='Strong')
+            with QueryCounter(db.engine) as counter:
+                response = app.test_client().patch(
+                    f'/powers/{power.id}',
+                    json={'description': power.description + ' (patched)'})
+                assert response.status_code == 200
+
+            details = plans_touching(counter.executed, 'hero_powers')
+            assert details
+            assert all(detail.startswith('SEARCH') and 'COVERING INDEX' in detail
+                       for detail in details), details
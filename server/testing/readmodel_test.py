@@ -0,0 +1,90 @@
+from app import app
+from cache import response_cache
+from instrumentation import QueryCounter
+from models import db
+import readmodel
+import pytest
+
+
+@pytest.fixture
+def read_model():
+    app.config['HERO_READ_MODEL'] = True
+    yield
+    app.config['HERO_READ_MODEL'] = False
+
+
+class TestReadModel:
+    '''Hero detail documents in readmodel.py'''
+
+    def test_serves_document(self, read_model, make_rows):
+        '''serves /heroes/<int:id> from the hero's document with one query.'''
+
+        with app.app_context():
+            (hero,), _ = make_rows(strength='Weak')
+            hero_id = hero.id
+            client = app.test_client()
+            live = client.get(f'/heroes/{hero_id}').json
+
+            readmodel.refresh_heroes([hero_id])
+            db.session.commit()
+            # Or the live response would be served from the cache
+            response_cache.clear()
+            with QueryCounter(db.engine) as counter:
+                response = client.get(f'/heroes/{hero_id}')
+
+            assert response.status_code == 200
+            assert response.content_type == 'application/json'
+            assert response.json == live
+            assert counter.count == 1, counter.statements
+
+    def test_write_paths_update_documents(self, read_model, make_rows):
+        '''keeps documents in step with POST /hero_powers, /hero_powers/bulk and PATCH /powers/<int:id>.'''
+
+        with app.app_context():
+            (hero,), (power,) = make_rows(strength='Weak')
+            readmodel.refresh_heroes([hero.id])
+            db.session.commit()
+            _, (extra, bulk) = make_rows(heroes=0, powers=2)
+            client = app.test_client()
+
+            response = client.post('/hero_powers', json={
+                'strength': 'Strong', 'power_id': extra.id, 'hero_id': hero.id})
+            assert response.status_code == 200
+            response = client.post('/hero_powers/bulk', json=[
+                {'strength': 'Average', 'power_id': bulk.id, 'hero_id': hero.id}])
+            assert response.json['created'] == 1
+            response = client.patch(f'/powers/{power.id}', json={
+                'description': 'changed while the hero has a document'})
+            assert response.status_code == 200
+            etag = client.get(f'/powers/{extra.id}').headers['ETag']
+            response = client.patch(
+                f'/powers/{extra.id}', headers={'If-Match': etag},
+                json={'description': 'changed with If-Match as well'})
+            assert response.status_code == 200
+
+            document = client.get(f'/heroes/{hero.id}').json
+            descriptions = {hp['power_id']: hp['power']['description']
+                            for hp in document['hero_powers']}
+            assert descriptions[power.id] == 'changed while the hero has a document'
+            assert descriptions[extra.id] == 'changed with If-Match as well'
+            assert bulk.id in descriptions
+            assert readmodel.check([hero.id]) == ([], [], [])
+
+    def test_check_and_rebuild(self, make_rows):
+        '''reports documents that differ from the live join, and rebuild fixes them.'''
+
+        with app.app_context():
+            (hero,), (power,) = make_rows(strength='Weak')
+            readmodel.refresh_heroes([hero.id])
+            db.session.commit()
+
+            # A change made while the read model is switched off
+            power.description = 'changed behind the read model'
+            db.session.commit()
+            assert readmodel.check([hero.id]) == ([], [hero.id], [])
+
+            runner = app.test_cli_runner()
+            result = runner.invoke(args=['read-model', 'rebuild'])
+            assert result.exit_code == 0, result.output
+            result = runner.invoke(args=['read-model', 'check'])
+            assert result.exit_code == 0, result.output
@@ -0,0 +1,87 @@
+from app import app
+from cache import response_cache
+from instrumentation import QueryCounter
+from models import db, Hero, Power, HeroPower
+from faker import Faker
+
+
+class TestSearch:
+    '''Search and filters on /heroes and /powers (search.py)'''
+
+    def test_searches_heroes_by_substring(self):
+        '''finds heroes whose name or super_name contains q, and keeps the FTS index in sync.'''
+
+        with app.app_context():
+            fake = Faker()
+            token = fake.unique.lexify('zq????').lower()
+            match = Hero(name=fake.name(), super_name=f'Captain {token.title()}')
+            miss = Hero(name=fake.name(), super_name=fake.name())
+            db.session.add_all([match, miss])
+            db.session.commit()
+
+            client = app.test_client()
+            response = client.get(f'/heroes?q={token[1:5]}')
+            assert response.status_code == 200
+            assert [hero['id'] for hero in response.json] == [match.id]
+
+            # The triggers update the index on UPDATE and DELETE. These
+            # writes bypass the API, so nothing invalidates cached responses
+            match.super_name = 'Renamed'
+            db.session.commit()
+            response_cache.clear()
+            assert client.get(f'/heroes?q={token[1:5]}').json == []
+            miss.name = f'Doctor {token}'
+            db.session.commit()
+            response_cache.clear()
+            assert [h['id'] for h in client.get(f'/heroes?q={token}').json] == [miss.id]
+            db.session.delete(miss)
+            db.session.commit()
+            response_cache.clear()
+            assert client.get(f'/heroes?q={token}').json == []
+
+    def test_search_uses_fts_index(self):
+        '''answers q from the FTS5 index instead of scanning with LIKE.'''
+
+        with app.app_context():
+            with QueryCounter(db.engine) as counter:
+                app.test_client().get('/powers?q=flight')
+            assert any('powers_fts MATCH' in s for s in counter.statements)
+            assert not any('LIKE' in s for s in counter.statements)
+
+    def test_searches_powers_and_paginates(self):
+        '''combines q on /powers with limit/after pagination.'''
+
+        with app.app_context():
+            fake = Faker()
+            token = fake.unique.lexify('xk????').lower()
+            powers = [Power(name=f'{token} {i}', description=fake.sentence(nb_words=10))
+                      for i in range(3)]
+            db.session.add_all(powers)
+            db.session.commit()
+
+            response = app.test_client().get(f'/powers?q={token}&limit=2')
+            assert [p['id'] for p in response.json] == [p.id for p in powers[:2]]
+            after = response.headers['X-Next-Cursor']
+            response = app.test_client().get(f'/powers?q={token}&limit=2&after={after}')
+            assert [p['id'] for p in response.json] == [powers[2].id]
+
+    def test_filters_heroes_by_power_and_strength(self):
+        '''keeps the heroes holding power_id, optionally at a given strength.'''
+
+        with app.app_context():
+            fake = Faker()
+            strong, weak, other = [Hero(name=fake.name(), super_name=fake.name())
+                                   for _ in range(3)]
+            power = Power(name=fake.name(), description=fake.sentence(nb_words=10))
+            db.session.add_all([strong, weak, other, power,
+                                HeroPower(heroes=strong, power=power, strength='Strong'),
+                                HeroPower(heroes=weak, power=power, strength='Weak')])
+            db.session.commit()
+
+            client = app.test_client()
+            response = client.get(f'/heroes?power_id={power.id}')
+            assert [h['id'] for h in response.json] == [strong.id, weak.id]
+            response = client.get(f'/heroes?power_id={power.id}&strength=Weak')
+            assert [h['id'] for h in response.json] == [weak.id]
+            assert client.get('/heroes?strength=Cheese').status_code == 400
+            assert client.get('/heroes?power_id=x').status_code == 400
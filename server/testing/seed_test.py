@@ -0,0 +1,60 @@
+import pytest
+from sqlalchemy import text
+
+from app import app
+from models import db, Hero, HeroPower, Power
+from seed import Generator, seed_generated
+
+
+class TestGenerator:
+    '''Generator in seed.py'''
+
+    def test_is_deterministic(self):
+        '''yields the same rows for the same seed and different rows for another.'''
+
+        def rows(seed):
+            generate = Generator(seed)
+            return (list(generate.powers(5)), list(generate.heroes(20)),
+                    list(generate.hero_powers(20, 5, 3)))
+
+        assert rows(42) == rows(42)
+        assert rows(42) != rows(7)
+
+    def test_links_are_unique_per_hero(self):
+        '''never links a hero to the same power twice.'''
+
+        links = list(Generator(1).hero_powers(100, 10, 4))
+        assert len(links) == 400
+        assert len({(hero_id, power_id) for _, hero_id, power_id in links}) == 400
+
+
+class TestSeedGenerated:
+    '''seed_generated() in seed.py'''
+
+    # seed_generated() writes through connections of its own
+    @pytest.mark.commits
+    def test_failed_seed_restores_triggers(self, monkeypatch):
+        '''rebuilds the indexes, search triggers and counters when the load fails part way.'''
+
+        def failing(self, n_heroes, n_powers, links_per_hero):
+            yield ('Strong', 1, 1)
+            raise RuntimeError("disk full")
+
+        monkeypatch.setattr(Generator, 'hero_powers', failing)
+        with app.app_context():
+            with pytest.raises(RuntimeError):
+                seed_generated(5, 3, 2, seed=1, chunk_size=10)
+
+            names = {name for name, in db.session.execute(text(
+                "SELECT name FROM sqlite_master WHERE type IN ('index', 'trigger', 'table')"))}
+            indexes = {index.name for model in (Hero, Power, HeroPower)
+                       for index in model.__table__.indexes}
+            assert indexes <= names
+            assert {'heroes_fts', 'heroes_fts_ai', 'hero_powers_count_ai'} <= names
+
+            db.session.add(Hero(name='Late Arrival', super_name='The Tardy'))
+            db.session.commit()
+            client = app.test_client()
+            assert client.get('/stats').json['heroes'] == 6
+            assert [hero['name'] for hero in client.get('/heroes?q=Tardy').json] == [
+                'Late Arrival']
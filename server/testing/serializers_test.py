@@ -0,0 +1,64 @@
+import pytest
+from app import app
+from models import db, Hero, Power, HeroPower, HERO_DETAIL_OPTIONS
+import serializers
+from serializers import (MAX_DEPTH, SerializerError, hero_detail,
+                         hero_summary, power_summary)
+from faker import Faker
+
+
+class TestCompiledSerializers:
+    '''Compiled serializers in serializers.py'''
+
+    def test_matches_to_dict(self):
+        '''produces the same dictionaries as SerializerMixin.to_dict().'''
+
+        with app.app_context():
+            fake = Faker()
+            hero = Hero(name=fake.name(), super_name=fake.name())
+            powers = [Power(name=fake.name(),
+                            description=fake.sentence(nb_words=10))
+                      for _ in range(3)]
+            db.session.add_all([hero] + powers + [
+                HeroPower(heroes=hero, power=power, strength='Average')
+                for power in powers])
+            db.session.commit()
+
+            hero = Hero.query.options(*HERO_DETAIL_OPTIONS).get(hero.id)
+            assert hero_detail(hero) == hero.to_dict()
+            for power in powers:
+                assert power_summary(power) == power.to_dict()
+
+    def test_serializes_rows(self):
+        '''serializes column rows as well as model instances.'''
+
+        with app.app_context():
+            fake = Faker()
+            hero = Hero(name=fake.name(), super_name=fake.name())
+            db.session.add(hero)
+            db.session.commit()
+
+            row = db.session.query(Hero.id, Hero.name, Hero.super_name) \
+                .filter(Hero.id == hero.id).one()
+            assert hero_summary(row) == hero_summary(hero) == {
+                'id': hero.id, 'name': hero.name, 'super_name': hero.super_name}
+
+    def test_rejects_runaway_rules(self, monkeypatch):
+        '''refuses serialize_rules that recurse without limit, at MAX_DEPTH.'''
+
+        # Without their rules the models refer to each other forever:
+        # hero -> hero_powers -> heroes -> hero_powers -> ...
+        for model in (Hero, Power, HeroPower):
+            monkeypatch.setattr(model, 'serialize_rules', ())
+        depths = []
+        compile_ = serializers.compile_serializer
+
+        def recording(model, only=None, rules=(), depth=0):
+            depths.append(depth)
+            return compile_(model, only, rules, depth)
+
+        # The recursive calls go through the module's name
+        monkeypatch.setattr(serializers, 'compile_serializer', recording)
+        with pytest.raises(SerializerError, match=f'deeper than {MAX_DEPTH}'):
+            serializers.compile_serializer(Hero)
+        assert max(depths) == MAX_DEPTH + 1
@@ -0,0 +1,210 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from werkzeug.serving import make_server
+
+from app import create_app
+from cache import LRUCache
+from limits import Limits
+from models import db, Hero, HeroPower, Power
+from router import create_router
+import shards
+
+HEROES = 7
+
+# Lets the router's PATCH /powers/<id> past the shards' write limits
+TOKEN = 'replication-token'
+
+
+@pytest.fixture
+def cluster(tmp_path):
+    # Two shards split from a small database, each app served from a
+    # thread, and the router in front of them
+    source = str(tmp_path / 'source.db')
+    engine = create_engine(f'sqlite:///{source}')
+    db.Model.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(Power.__table__.insert(), [
+            {'name': f'power {i}', 'description': f'power number {i} described at length'}
+            for i in (1, 2)])
+        conn.execute(Hero.__table__.insert(), [
+            {'name': f'hero {i}', 'super_name': f'super {i}'} for i in range(1, HEROES + 1)])
+        conn.execute(HeroPower.__table__.insert(), [
+            {'strength': 'Weak', 'hero_id': i, 'power_id': 1} for i in range(1, HEROES + 1)])
+    engine.dispose()
+    paths = shards.split(source, str(tmp_path / 'shards'), 2)
+
+    servers, urls = [], []
+    for path in paths:
+        app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}',
+                          'REPLICATION_TOKEN': TOKEN})
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+        servers.append((app, server))
+        urls.append(f'http://127.0.0.1:{server.server_port}')
+    router = create_router(urls, {'REPLICATION_TOKEN': TOKEN})
+    yield router.test_client(), paths, [app for app, _ in servers]
+    router.extensions['shards'].pool.shutdown()
+    for app, server in servers:
+        server.shutdown()
+        with app.app_context():
+            db.engine.dispose()
+
+
+def client_urls(cluster):
+    # The shards' URLs, from the cluster's router
+    client, _, _ = cluster
+    return [f'http://{host}:{port}'
+            for host, port in client.application.extensions['shards'].addresses]
+
+
+def rows(path, query):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute(query).fetchall()
+    finally:
+        connection.close()
+
+
+# The shards' servers use connections of their own
+@pytest.mark.commits
+class TestShards:
+    '''Sharded deployment: shards.py and router.py'''
+
+    def test_split(self, cluster):
+        '''gives each shard its own heroes and hero_powers, and every power.'''
+
+        _, paths, _ = cluster
+        for index, path in enumerate(paths):
+            hero_ids = [id for id, in rows(path, 'SELECT id FROM heroes ORDER BY id')]
+            assert hero_ids == [id for id in range(1, HEROES + 1) if id % 2 == index]
+            assert rows(path, 'SELECT DISTINCT hero_id % 2 FROM hero_powers') == [(index,)]
+            assert rows(path, 'SELECT count(*) FROM powers') == [(2,)]
+
+    def test_writes_go_to_the_owner(self, cluster):
+        '''creates a hero_power on the hero's shard, with an id from that shard's range.'''
+
+        client, paths, _ = cluster
+        response = client.post('/hero_powers', json={
+            'strength': 'Strong', 'hero_id': 3, 'power_id': 2})
+        assert response.status_code == 200
+        id = response.json['id']
+        assert 2 * shards.ID_SPAN < id < 3 * shards.ID_SPAN
+        assert rows(paths[1], f'SELECT hero_id FROM hero_powers WHERE id = {id}') == [(3,)]
+        assert rows(paths[0], f'SELECT hero_id FROM hero_powers WHERE id = {id}') == []
+        assert len(client.get('/heroes/3').json['hero_powers']) == 2
+
+        response = client.post('/hero_powers', json={'strength': 'Strong', 'power_id': 2})
+        assert response.status_code == 400
+
+    def test_lists_are_merged(self, cluster):
+        '''merges GET /heroes from every shard by id, for pages and streams too.'''
+
+        client, _, _ = cluster
+        assert [hero['id'] for hero in client.get('/heroes').json] == list(range(1, HEROES + 1))
+
+        seen, after = [], 0
+        while after is not None:
+            response = client.get(f'/heroes?limit=3&after={after}')
+            seen += [hero['id'] for hero in response.json]
+            after = response.headers.get('X-Next-Cursor')
+        assert seen == list(range(1, HEROES + 1))
+
+        assert client.get('/heroes?limit=2&fields[hero]=name').json == [
+            {'name': 'hero 1'}, {'name': 'hero 2'}]
+        streamed = client.get('/heroes?stream=ndjson').get_data().splitlines()
+        assert len(streamed) == HEROES
+        assert [hero['id'] for hero in client.get('/heroes?ids=6,1,4').json] == [1, 4, 6]
+        assert client.get('/stats').json['heroes'] == HEROES
+
+    def test_power_updates_reach_every_shard(self, cluster):
+        '''applies PATCH /powers/<id> to every shard, checking If-Match once.'''
+
+        client, paths, _ = cluster
+        description = 'a new description long enough to be valid'
+        response = client.patch('/powers/1', json={'description': description},
+                                headers={'If-Match': '"v1"'})
+        assert response.status_code == 200
+        for path in paths:
+            assert rows(path, 'SELECT description, version FROM powers WHERE id = 1') == [
+                (description, 2)]
+        response = client.patch('/powers/1', json={'description': description},
+                                headers={'If-Match': '"v1"'})
+        assert response.status_code == 412
+
+    def test_power_updates_pass_the_write_limits(self, cluster):
+        '''applies PATCH /powers/<id> to a shard whose write limit the client has spent.'''
+
+        client, paths, apps = cluster
+        apps[1].extensions['write_limiter'] = Limits(dict(
+            apps[1].config, LIMITS_BACKEND='memory', WRITE_RATE_LIMIT=0.01,
+            WRITE_RATE_BURST=1))
+        for hero_id, status in ((1, 200), (3, 429)):
+            response = client.post('/hero_powers', json={
+                'strength': 'Strong', 'hero_id': hero_id, 'power_id': 2})
+            assert response.status_code == status
+
+        description = 'a new description long enough to be valid'
+        assert client.patch('/powers/2', json={'description': description}).status_code == 200
+        for path in paths:
+            assert rows(path, 'SELECT description FROM powers WHERE id = 2') == [(description,)]
+        assert not client.application.extensions['shards'].stale
+
+    def test_stale_shard_leaves_rotation(self, cluster):
+        '''keeps reads of powers off a shard that missed a PATCH until it is back in step.'''
+
+        _, paths, apps = cluster
+        # A router without the token: the shard's write limit refuses it
+        router = create_router(client_urls(cluster), {'REPLICATION_TOKEN': None})
+        shard_client = router.extensions['shards']
+        shard_client.recheck, shard_client.cache_ttl = 0, 0.5
+        client = router.test_client()
+        apps[1].extensions['response_cache'] = LRUCache(ttl=0.5)
+        apps[1].extensions['write_limiter'] = Limits(dict(
+            apps[1].config, LIMITS_BACKEND='memory', WRITE_RATE_LIMIT=0.01,
+            WRITE_RATE_BURST=1))
+        try:
+            old = client.get('/powers/2').json['description']
+            # Both shards cache the power
+            assert client.get('/powers/2').json['description'] == old
+            client.post('/hero_powers', json={'strength': 'Strong', 'hero_id': 1, 'power_id': 2})
+
+            description = 'a new description long enough to be valid'
+            assert client.patch('/powers/2', json={'description': description}).status_code == 200
+            assert rows(paths[1], 'SELECT description FROM powers WHERE id = 2') == [(old,)]
+            assert set(shard_client.stale) == {1}
+            for _ in range(4):
+                assert client.get('/powers/2').json['description'] == description
+
+            shards.sync_powers(paths)
+            # In step, but its cached responses have not expired yet
+            for _ in range(4):
+                assert client.get('/powers/2').json['description'] == description
+            assert set(shard_client.stale) == {1}
+
+            deadline = time.monotonic() + 5
+            while shard_client.stale and time.monotonic() < deadline:
+                assert client.get('/powers/2').json['description'] == description
+                time.sleep(0.1)
+            assert not shard_client.stale
+            for _ in range(4):
+                assert client.get('/powers/2').json['description'] == description
+        finally:
+            shard_client.pool.shutdown()
+
+    def test_bulk_keeps_indexes(self, cluster):
+        '''splits a bulk insert by shard and reports errors at their index in the request.'''
+
+        client, _, _ = cluster
+        response = client.post('/hero_powers/bulk', json=[
+            {'strength': 'Strong', 'hero_id': 1, 'power_id': 2},
+            {'strength': 'Strong', 'hero_id': 2, 'power_id': 2},
+            {'strength': 'Bogus', 'hero_id': 4, 'power_id': 2},
+            {'strength': 'Strong', 'hero_id': 5, 'power_id': 2}])
+        assert response.status_code == 200
+        assert response.json['created'] == 3
+        assert [error['index'] for error in response.json['errors']] == [2]
+        assert client.get('/stats').json['hero_powers'] == HEROES + 3
@@ -0,0 +1,78 @@
+import os
+import subprocess
+import sys
+
+import pytest
+from sqlalchemy import text
+
+from app import app, create_app
+from models import db
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestStartup:
+    '''create_app() and the fork handling in app.py and database.py'''
+
+    def test_import_skips_migrations(self):
+        '''imports the app without Flask-Migrate, alembic or Flask-RESTful.'''
+
+        result = subprocess.run(
+            [sys.executable, '-c', "import sys, app; print(sorted(set(sys.modules) & "
+             "{'flask_migrate', 'alembic', 'flask_restful'}))"],
+            cwd=SERVER_DIR, capture_output=True, text=True, check=True)
+        assert result.stdout.strip() == '[]'
+
+    def test_create_app_overrides_config(self):
+        '''builds a separate app with the routes, taking settings from the config argument.'''
+
+        other = create_app({'METRICS': False})
+        assert other is not app
+        with other.app_context():
+            client = other.test_client()
+            assert client.get('/heroes').status_code == 200
+            assert client.get('/metrics').status_code == 404
+
+    def test_apps_keep_their_own_extensions(self):
+        '''gives each app its own cache, limits, group commit and compression settings.'''
+
+        before = {name: app.extensions[name] for name in (
+            'response_cache', 'write_limiter', 'group_commit', 'compression')}
+        other = create_app({'RESPONSE_CACHE': 'memory', 'LIMITS_BACKEND': 'memory',
+                            'GROUP_COMMIT': True, 'COMPRESSION_ENCODINGS': ()})
+        assert {name: app.extensions[name] for name in before} == before
+        assert not app.extensions['group_commit'].enabled
+        assert other.extensions['group_commit'].enabled
+        assert other.extensions['write_limiter'].slots is not None
+        assert other.extensions['response_cache'] is not app.extensions['response_cache']
+
+        with other.app_context():
+            other.test_client().get('/powers')
+        assert other.extensions['response_cache'].get('powers|/powers?') is not None
+        with app.app_context():
+            # The other app's cache entry is not served here
+            assert app.extensions['response_cache'].get('powers|/powers?') is None
+            response = app.test_client().get('/powers', headers={'Accept-Encoding': 'gzip'})
+            assert response.status_code == 200
+
+    # Looks at the engine's own pool, which the rollback bypasses
+    @pytest.mark.commits
+    def test_forked_child_drops_connections(self):
+        '''gives a forked process an empty connection pool and leaves the parent's alone.'''
+
+        with app.app_context():
+            db.session.execute(text('SELECT 1'))
+            db.session.remove()
+            pooled = db.engine.pool.checkedin()
+            assert pooled >= 1
+
+            read, write = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.write(write, b'%d' % db.engine.pool.checkedin())
+                os._exit(0)
+            os.close(write)
+            os.waitpid(pid, 0)
+            assert os.read(read, 16) == b'0'
+            os.close(read)
+            assert db.engine.pool.checkedin() == pooled
@@ -0,0 +1,71 @@
+from app import app
+from instrumentation import QueryCounter
+import stats
+from models import db, Counter, Hero, HeroPower
+
+
+class TestStats:
+    '''GET /stats and GET /powers/<id>/stats (stats.py)'''
+
+    def test_counts_follow_writes(self, make_rows):
+        '''moves the counts with POST /hero_powers, bulk inserts and deletes.'''
+
+        with app.app_context():
+            heroes, (power,) = make_rows(heroes=3)
+            hero_ids, power_id = [hero.id for hero in heroes], power.id
+            client = app.test_client()
+            before = client.get('/stats').json
+
+            client.post('/hero_powers', json={
+                'strength': 'Strong', 'hero_id': hero_ids[0], 'power_id': power_id})
+            client.post('/hero_powers/bulk', json=[
+                {'strength': 'Weak', 'hero_id': hero_id, 'power_id': power_id}
+                for hero_id in hero_ids[1:]])
+
+            after = client.get('/stats').json
+            assert after['heroes'] == before['heroes']
+            assert after['hero_powers'] == before['hero_powers'] + 3
+            assert after['strengths']['Strong'] == before['strengths']['Strong'] + 1
+            assert after['strengths']['Weak'] == before['strengths']['Weak'] + 2
+            assert client.get(f'/powers/{power_id}/stats').json == {
+                'power_id': power_id, 'heroes': 3,
+                'strengths': {'Strong': 1, 'Weak': 2, 'Average': 0}}
+
+            HeroPower.query.filter_by(hero_id=hero_ids[1]).delete()
+            Hero.query.filter_by(id=hero_ids[1]).delete()
+            db.session.commit()
+
+            after = client.get('/stats').json
+            assert after['heroes'] == before['heroes'] - 1
+            assert after['hero_powers'] == before['hero_powers'] + 2
+            assert client.get(f'/powers/{power_id}/stats').json['strengths']['Weak'] == 1
+            assert stats.check() == []
+
+    def test_power_stats(self, make_rows):
+        '''reads a power's counts with one query, and answers 404 for an unknown power.'''
+
+        with app.app_context():
+            _, (power,) = make_rows(heroes=0)
+            power_id = power.id
+            client = app.test_client()
+            with QueryCounter(db.engine) as counter:
+                response = client.get(f'/powers/{power_id}/stats')
+            assert response.json['heroes'] == 0
+            assert counter.count == 1, counter.statements
+
+            response = client.get('/powers/0/stats')
+            assert response.status_code == 404
+            assert response.json == {'error': 'Power not found'}
+
+    def test_check_and_recompute(self, make_rows):
+        '''finds counters that drifted from the tables, and recomputes them.'''
+
+        with app.app_context():
+            make_rows()
+            db.session.query(Counter).filter_by(name='heroes').update({'value': -1})
+            db.session.commit()
+
+            assert [name for name, _, _ in stats.check()] == ['heroes']
+            stats.recompute()
+            assert stats.check() == []
+            assert app.test_client().get('/stats').json['heroes'] == Hero.query.count()
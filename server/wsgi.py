@@ -0,0 +1,30 @@
+"""
+WSGI entry point for pre-forking servers.
+
+    gunicorn --preload --workers 4 --chdir server wsgi:app
+
+With --preload the master process imports the app once and forks the
+workers from it, so they start at once and share the master's memory
+until they write to it. Everything a worker would otherwise build on its
+first request is built here, before the fork, and the garbage collector
+is told to leave those objects alone: a collection touches every object
+it tracks, which would copy the shared pages into each worker.
+
+Engines are reset in each worker (database.dispose_after_fork()), so no
+connection is shared across processes.
+
+The default response cache is per process; with several workers set
+RESPONSE_CACHE=sqlite:///path/to/cache.db (or none) so that a write made
+through one worker is not hidden by the others' cached responses.
+"""
+
+import gc
+
+from sqlalchemy.orm import configure_mappers
+
+from app import app
+
+# Mapper configuration otherwise runs on the first query of each worker
+configure_mappers()
+
+gc.freeze()